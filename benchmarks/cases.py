@@ -0,0 +1,272 @@
+"""Benchmark cases. Each case measures one code path, either through the %rdf magic or by calling the function
+behind it directly.
+
+A case is a function taking an Env and returning the callable to measure, or a pair (run, before) where before is
+called untimed ahead of every run to reset state, e.g. to give every entailment a fresh graph.
+"""
+import importlib.util
+import shutil
+from collections import namedtuple
+from itertools import islice
+from pathlib import Path
+
+import rdflib
+
+Case = namedtuple("Case", ["name", "function", "datasets", "max_scale", "requires"])
+cases = dict()
+
+QUERIES = {
+    "lubm": """PREFIX ub: <http://swat.cse.lehigh.edu/onto/univ-bench.owl#>
+SELECT ?student ?course ?teacher WHERE {
+    ?student a ub:GraduateStudent ; ub:takesCourse ?course ; ub:advisor ?teacher .
+    ?teacher ub:teacherOf ?course .
+}""",
+    "hierarchy": """PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+SELECT ?instance ?super WHERE { ?instance a ?class . ?class rdfs:subClassOf ?super }""",
+    "wide": """PREFIX ex: <http://example.org/>
+SELECT ?item ?number ?date WHERE { ?item ex:property2 ?number ; ex:property4 ?date FILTER(?number > 0) }""",
+}
+
+
+def case(name, datasets, max_scale=10 ** 7, requires=None):
+    """Registers a case for the given generators. Scales above max_scale are skipped unless forced, since e.g.
+    owlrl entailment of millions of triples takes hours."""
+    def register(function):
+        cases[name] = Case(name, function, datasets, max_scale, requires)
+        return function
+    return register
+
+
+class Env:
+    """What a case needs: the dataset file, the parsed graph, a fresh %rdf magic and a temporary directory."""
+
+    def __init__(self, dataset, path, tmp):
+        self.dataset = dataset
+        self.path = Path(path)
+        self.tmp = Path(tmp)
+        self._graph = None
+        self._magic = None
+        # Called when the case is done, e.g. to stop servers.
+        self.atexit = []
+
+    @property
+    def text(self):
+        return self.path.read_text(encoding="utf-8")
+
+    @property
+    def graph(self):
+        if self._graph is None:
+            self._graph = rdflib.Graph().parse(self.path, format="nt")
+        return self._graph
+
+    def copy_graph(self):
+        g = rdflib.Graph()
+        for t in self.graph:
+            g.add(t)
+        return g
+
+    @property
+    def query(self):
+        return QUERIES[self.dataset]
+
+    @property
+    def magic(self):
+        if self._magic is None:
+            from IPython.core.interactiveshell import InteractiveShell
+            import rwth_jupyter_rdfify
+            shell = InteractiveShell.instance()
+            rwth_jupyter_rdfify.load_ipython_extension(shell)
+            self._magic = shell.magics_manager.registry["JupyterRDF"]
+        return self._magic
+
+    def rdf(self, line, cell=None):
+        return self.magic.rdf(line, cell)
+
+    def label(self, label="g"):
+        """Stores the graph under label and returns label."""
+        self.magic.store["rdfgraphs"][label] = self.graph
+        return label
+
+
+def logger():
+    from rwth_jupyter_rdfify.log import RDFLogger
+    return RDFLogger()
+
+
+@case("parse/parse_graph", ["lubm", "wide"])
+def parse_graph(env):
+    from rwth_jupyter_rdfify.graph import parse_graph
+    text = env.text
+    log = logger()
+    return lambda: parse_graph(text, log, "turtle")
+
+
+@case("parse/magic", ["lubm", "wide"])
+def parse_magic(env):
+    from rwth_jupyter_rdfify.serialization import parse_cache
+    text = env.text
+
+    def before():
+        # Without the labelled graph of the last run, the whole cell is parsed again.
+        parse_cache.clear()
+        env.magic.store["rdfgraphs"].pop("g", None)
+    return lambda: env.rdf("turtle -l g -d none", text), before
+
+
+@case("parse/incremental", ["lubm", "wide"])
+def parse_incremental(env):
+    text = env.text
+    edited = text + '<http://example.org/edited> <http://example.org/p> "one more statement" .\n'
+    return lambda: env.rdf("turtle -l g -d none", edited), lambda: env.rdf("turtle -l g -d none", text)
+
+
+@case("entail/owlrl", ["hierarchy", "lubm"], max_scale=10 ** 5)
+def entail_owlrl(env):
+    from rwth_jupyter_rdfify.entailment import entail
+    state = dict()
+    return lambda: entail(state["g"], "rdfs"), lambda: state.update(g=env.copy_graph())
+
+
+@case("entail/native", ["hierarchy", "lubm"], max_scale=10 ** 6, requires="numpy")
+def entail_native(env):
+    from rwth_jupyter_rdfify.entailment import entail
+    state = dict()
+    return lambda: entail(state["g"], "rdfs", "native"), lambda: state.update(g=env.copy_graph())
+
+
+@case("entail/magic", ["lubm"], max_scale=10 ** 5)
+def entail_magic(env):
+    def before():
+        env.magic.store["rdfgraphs"]["g"] = env.copy_graph()
+    return lambda: env.rdf("graph entail-rdfs -l g"), before
+
+
+@case("entail/update", ["hierarchy", "lubm"], max_scale=10 ** 5)
+def entail_update(env):
+    from rwth_jupyter_rdfify.entailment import entail
+    # A new instance of a class of the graph, with a literal of the graph if it has any.
+    new = rdflib.URIRef("http://example.org/new")
+    added = [(new, rdflib.RDF.type, next(env.graph.objects(predicate=rdflib.RDF.type)))]
+    added.extend((new, p, o) for _, p, o in islice((t for t in env.graph if isinstance(t[2], rdflib.Literal)), 1))
+    state = dict()
+
+    def before():
+        state["g"] = env.copy_graph()
+        entail(state["g"], "rdfs")
+
+    def run():
+        state["g"].entailment.add(state["g"], added)
+
+    # The updated closure must equal the closure of the whole graph.
+    full = env.copy_graph()
+    full.addN((s, p, o, full) for s, p, o in added)
+    entail(full, "rdfs")
+    before()
+    run()
+    if set(state["g"]) != set(full):
+        raise RuntimeError("The updated closure differs from the closure of the whole graph")
+    return run, before
+
+
+@case("query/run_query", ["lubm", "hierarchy", "wide"])
+def query_run_query(env):
+    from rwth_jupyter_rdfify.prepared import run_query
+    g = env.graph
+    return lambda: len(run_query(g, env.query))
+
+
+@case("query/magic", ["lubm", "hierarchy", "wide"])
+def query_magic(env):
+    label = env.label()
+    return lambda: env.rdf(f"sparql --local {label} --max-rows 100000000", env.query)
+
+
+@case("query/sqlite", ["lubm", "hierarchy", "wide"], max_scale=10 ** 6)
+def query_sqlite(env):
+    env.rdf(f"persistence --load {env.path} --format nt --db {env.tmp / 'g.sqlite'} --label db")
+
+    def run():
+        # The query runs in a worker thread, which must be able to read the database of the graph.
+        env.rdf("sparql --local db --max-rows 100000000 --store r", env.query)
+        if env.magic.store["rdfresults"].pop("r", None) is None:
+            raise RuntimeError("Querying the graph in the database failed")
+    return run
+
+
+@case("table/html_table", ["lubm", "wide"], max_scale=10 ** 6)
+def table_html(env):
+    from rwth_jupyter_rdfify.table import graph_spo_iterator, html_table
+    g = env.graph
+    return lambda: html_table(graph_spo_iterator(g))
+
+
+@case("render/draw_graph", ["lubm"], requires="dot")
+def render_draw(env):
+    from rwth_jupyter_rdfify.graph import draw_graph
+    from rwth_jupyter_rdfify.render import SVGCache, renderer
+    g = env.graph
+    log = logger()
+
+    def before():
+        # A new cache, otherwise every run after the first one is a cache hit.
+        renderer.cache = SVGCache(env.tmp / "svg")
+        shutil.rmtree(env.tmp / "svg", ignore_errors=True)
+    return lambda: draw_graph(g, log, wait=True), before
+
+
+@case("persist/save-turtle", ["lubm", "wide"])
+def persist_save_turtle(env):
+    label = env.label()
+    return lambda: env.rdf(f"persistence --save {label} --label {label} --format turtle --output {env.tmp / 'g.ttl'}")
+
+
+@case("persist/load-turtle", ["lubm", "wide"])
+def persist_load_turtle(env):
+    path = env.tmp / "g.ttl"
+    env.graph.serialize(path, format="turtle")
+    return lambda: env.rdf(f"persistence --load {path} --format turtle --label loaded")
+
+
+@case("persist/save-snapshot", ["lubm", "wide"])
+def persist_save_snapshot(env):
+    label = env.label()
+    return lambda: env.rdf(f"persistence --save {label} --label {label} --format snapshot "
+                           f"--output {env.tmp / 'g.rdfsnap'}")
+
+
+@case("persist/load-snapshot", ["lubm", "wide"])
+def persist_load_snapshot(env):
+    label = env.label()
+    path = env.tmp / "g.rdfsnap"
+    env.rdf(f"persistence --save {label} --label {label} --format snapshot --output {path}")
+    return lambda: env.rdf(f"persistence --load {path} --format snapshot --label loaded")
+
+
+def remote_case(env, line, query):
+    from sparql_server import SPARQLServer
+    server = SPARQLServer(env.graph).start()
+    env.atexit.append(server.stop)
+    return lambda: env.rdf(f"sparql --endpoint {server.url} --no-cache {line}", query)
+
+
+@case("remote/select-xml", ["lubm"], max_scale=10 ** 6)
+def remote_select_xml(env):
+    return remote_case(env, "--format xml --store r", env.query)
+
+
+@case("remote/select-json", ["lubm"], max_scale=10 ** 6)
+def remote_select_json(env):
+    return remote_case(env, "--format json --store r", env.query)
+
+
+@case("remote/paged", ["lubm"], max_scale=10 ** 6)
+def remote_paged(env):
+    return remote_case(env, "--paged --page-size 10000 --display none --store r", env.query)
+
+
+def available(requirement):
+    if requirement is None:
+        return True
+    if requirement == "dot":
+        return shutil.which("dot") is not None
+    return importlib.util.find_spec(requirement) is not None
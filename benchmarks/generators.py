@@ -0,0 +1,199 @@
+"""Seeded generators of synthetic RDF graphs.
+
+Every generator yields about n triples as N-Triples lines, which are valid Turtle as well. The same name, size and
+seed always give the same graph, so results of different runs and machines are comparable.
+
+lubm: an ontology of universities in the style of the Lehigh University Benchmark plus departments, faculty,
+      students, courses and publications as instances.
+hierarchy: a deep rdfs:subClassOf tree and instances of its leaf classes, the worst case of RDFS entailment.
+wide: subjects with many literal valued properties (strings, language tagged strings, numbers, dates).
+"""
+import random
+from pathlib import Path
+
+UB = "http://swat.cse.lehigh.edu/onto/univ-bench.owl#"
+EX = "http://example.org/"
+RDF_TYPE = "<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>"
+RDFS = "http://www.w3.org/2000/01/rdf-schema#"
+OWL = "http://www.w3.org/2002/07/owl#"
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+# (class, superclass) pairs of the lubm ontology.
+UB_CLASSES = [
+    ("Organization", None), ("University", "Organization"), ("Department", "Organization"),
+    ("Person", None), ("Employee", "Person"), ("Faculty", "Employee"), ("Professor", "Faculty"),
+    ("FullProfessor", "Professor"), ("AssociateProfessor", "Professor"), ("AssistantProfessor", "Professor"),
+    ("Lecturer", "Faculty"), ("Student", "Person"), ("UndergraduateStudent", "Student"),
+    ("GraduateStudent", "Student"), ("Work", None), ("Course", "Work"), ("GraduateCourse", "Course"),
+    ("Publication", "Work"), ("Article", "Publication"),
+]
+# (property, superproperty, domain, range) of the lubm ontology.
+UB_PROPERTIES = [
+    ("memberOf", None, "Person", "Organization"), ("worksFor", "memberOf", "Employee", "Organization"),
+    ("headOf", "worksFor", "Professor", "Department"), ("subOrganizationOf", None, "Organization", "Organization"),
+    ("takesCourse", None, "Student", "Course"), ("teacherOf", None, "Faculty", "Course"),
+    ("advisor", None, "Student", "Professor"), ("publicationAuthor", None, "Publication", "Person"),
+]
+PROFESSORS = ["FullProfessor", "AssociateProfessor", "AssistantProfessor", "Lecturer"]
+WORDS = ["graph", "query", "node", "edge", "triple", "schema", "shape", "ontology", "reasoner", "endpoint",
+         "literal", "resource", "class", "property", "closure", "index", "store", "notebook", "magic", "table"]
+
+
+def iri(base, name):
+    return f"<{base}{name}>"
+
+
+def literal(value, datatype=None, lang=None):
+    text = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    if lang is not None:
+        return f'"{text}"@{lang}'
+    if datatype is not None:
+        return f'"{text}"^^<{XSD}{datatype}>'
+    return f'"{text}"'
+
+
+def triple(s, p, o):
+    return f"{s} {p} {o} .\n"
+
+
+def lubm(n, seed=0):
+    rng = random.Random(seed)
+    sub_class = iri(RDFS, "subClassOf")
+    for name, parent in UB_CLASSES:
+        yield triple(iri(UB, name), RDF_TYPE, iri(OWL, "Class"))
+        if parent is not None:
+            yield triple(iri(UB, name), sub_class, iri(UB, parent))
+    for name, parent, domain, range_ in UB_PROPERTIES:
+        yield triple(iri(UB, name), RDF_TYPE, iri(OWL, "ObjectProperty"))
+        if parent is not None:
+            yield triple(iri(UB, name), iri(RDFS, "subPropertyOf"), iri(UB, parent))
+        yield triple(iri(UB, name), iri(RDFS, "domain"), iri(UB, domain))
+        yield triple(iri(UB, name), iri(RDFS, "range"), iri(UB, range_))
+    count = 0
+    university = 0
+    while count < n:
+        uni = iri(EX, f"University{university}")
+        yield triple(uni, RDF_TYPE, iri(UB, "University"))
+        count += 1
+        for d in range(rng.randint(10, 20)):
+            dept = iri(EX, f"University{university}/Department{d}")
+            lines = [triple(dept, RDF_TYPE, iri(UB, "Department")), triple(dept, iri(UB, "subOrganizationOf"), uni)]
+            faculty = []
+            courses = []
+            for f in range(rng.randint(15, 25)):
+                person = iri(EX, f"University{university}/Department{d}/Faculty{f}")
+                faculty.append(person)
+                lines.append(triple(person, RDF_TYPE, iri(UB, rng.choice(PROFESSORS))))
+                lines.append(triple(person, iri(UB, "worksFor"), dept))
+                lines.append(triple(person, iri(UB, "name"), literal(f"Faculty {f}")))
+                lines.append(triple(person, iri(UB, "emailAddress"), literal(f"faculty{f}@dept{d}.edu")))
+                for c in range(rng.randint(1, 2)):
+                    course = iri(EX, f"University{university}/Department{d}/Course{f}_{c}")
+                    courses.append(course)
+                    lines.append(triple(course, RDF_TYPE, iri(UB, rng.choice(["Course", "GraduateCourse"]))))
+                    lines.append(triple(course, iri(UB, "name"), literal(f"Course {f}.{c}")))
+                    lines.append(triple(person, iri(UB, "teacherOf"), course))
+                for p in range(rng.randint(0, 5)):
+                    publication = iri(EX, f"University{university}/Department{d}/Faculty{f}/Publication{p}")
+                    lines.append(triple(publication, RDF_TYPE, iri(UB, "Article")))
+                    lines.append(triple(publication, iri(UB, "publicationAuthor"), person))
+            lines.append(triple(faculty[0], iri(UB, "headOf"), dept))
+            for s in range(rng.randint(80, 160)):
+                student = iri(EX, f"University{university}/Department{d}/Student{s}")
+                graduate = rng.random() < 0.25
+                lines.append(triple(student, RDF_TYPE,
+                                    iri(UB, "GraduateStudent" if graduate else "UndergraduateStudent")))
+                lines.append(triple(student, iri(UB, "memberOf"), dept))
+                lines.append(triple(student, iri(UB, "name"), literal(f"Student {s}")))
+                for course in rng.sample(courses, min(len(courses), rng.randint(2, 4))):
+                    lines.append(triple(student, iri(UB, "takesCourse"), course))
+                if graduate:
+                    lines.append(triple(student, iri(UB, "advisor"), rng.choice(faculty)))
+            for line in lines:
+                yield line
+                count += 1
+                if count >= n:
+                    return
+        university += 1
+
+
+def hierarchy(n, seed=0, branching=3, depth=12):
+    """A tree of classes with branching subclasses per class down to depth, or until a quarter of n triples is
+    used. The other triples type instances with random leaf classes."""
+    rng = random.Random(seed)
+    sub_class = iri(RDFS, "subClassOf")
+    budget = max(n // 4, 1)
+    count = 0
+    level = [iri(EX, "Class0")]
+    yield triple(level[0], RDF_TYPE, iri(RDFS, "Class"))
+    count += 1
+    leaves = level
+    next_id = 1
+    for _ in range(depth):
+        children = []
+        for parent in level:
+            for _ in range(branching):
+                if count >= budget:
+                    break
+                child = iri(EX, f"Class{next_id}")
+                next_id += 1
+                children.append(child)
+                yield triple(child, sub_class, parent)
+                count += 1
+        if not children:
+            break
+        leaves = children
+        level = children
+    instance = 0
+    while count < n:
+        yield triple(iri(EX, f"instance{instance}"), RDF_TYPE, rng.choice(leaves))
+        instance += 1
+        count += 1
+
+
+def wide(n, seed=0, properties=25):
+    rng = random.Random(seed)
+    count = 0
+    subject = 0
+    while True:
+        s = iri(EX, f"item{subject}")
+        for p in range(properties):
+            kind = p % 5
+            if kind == 0:
+                o = literal(" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 30))))
+            elif kind == 1:
+                o = literal(rng.choice(WORDS).title(), lang=rng.choice(["en", "de", "fr"]))
+            elif kind == 2:
+                o = literal(rng.randint(-10 ** 6, 10 ** 6), "integer")
+            elif kind == 3:
+                o = literal(f"{rng.uniform(0, 1000):.4f}", "decimal")
+            else:
+                o = literal(f"20{rng.randint(10, 25)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}", "date")
+            yield triple(s, iri(EX, f"property{p}"), o)
+            count += 1
+            if count >= n:
+                return
+        subject += 1
+
+
+generators = {"lubm": lubm, "hierarchy": hierarchy, "wide": wide}
+
+
+def parse_scale(text):
+    """Parses sizes like 1000, 10k or 1M."""
+    text = text.strip().lower()
+    factor = {"k": 10 ** 3, "m": 10 ** 6}.get(text[-1], 1)
+    return int(float(text.rstrip("km")) * factor)
+
+
+def dataset(name, n, seed=0, directory=None):
+    """Returns the path of an N-Triples file with the graph of generator name, writing it on first use."""
+    directory = Path(directory or Path(__file__).resolve().parent / ".data")
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{name}-{n}-{seed}.nt"
+    if not path.exists():
+        partial = path.with_suffix(".tmp")
+        with open(partial, "w", encoding="utf-8") as f:
+            f.writelines(generators[name](n, seed))
+        partial.replace(path)
+    return path
@@ -0,0 +1,89 @@
+"""Measures how long loading the extension takes in a fresh interpreter.
+
+Every measurement runs in a new process. The time to import IPython and rdflib, which a kernel using the extension
+pays anyway, is measured separately and subtracted. The script also checks that loading the extension does not import
+any of the heavy optional dependencies, which should only be imported by the subcommands using them.
+
+    python benchmarks/import_time.py --runs 10 --max-ms 50
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+# Modules which must not be imported by %load_ext.
+HEAVY_MODULES = ["owlrl", "requests", "graphviz", "pyshex", "pyarrow", "pandas", "numpy", "rdflib.plugins.sparql"]
+
+SETUP = f"""
+import sys, time
+sys.path.insert(0, {str(SRC)!r})
+start = time.perf_counter()
+import IPython.display, rdflib
+from IPython.core.interactiveshell import InteractiveShell
+shell = InteractiveShell.instance()
+base = time.perf_counter()
+"""
+
+LOAD = SETUP + """
+import rwth_jupyter_rdfify
+rwth_jupyter_rdfify.load_ipython_extension(shell)
+loaded = time.perf_counter()
+"""
+
+PROBES = {
+    "load_ext": LOAD + """
+result = {"base": base - start, "measured": loaded - base}
+""",
+    "first_turtle_cell": LOAD + """
+shell.run_cell_magic("rdf", "turtle -d none", "<http://example.org/a> <http://example.org/b> <http://example.org/c> .")
+result = {"base": base - start, "measured": time.perf_counter() - loaded}
+""",
+}
+
+
+def run_probe(code):
+    code += f"""
+import json
+result["heavy"] = [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+print(json.dumps(result))
+"""
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh interpreters per measurement")
+    parser.add_argument("--max-ms", type=float, help="Fail if loading the extension takes longer than this")
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+
+    results = dict()
+    failed = False
+    for name, code in PROBES.items():
+        runs = [run_probe(code) for _ in range(args.runs)]
+        results[name] = {
+            "median_ms": statistics.median(run["measured"] for run in runs) * 1000,
+            "min_ms": min(run["measured"] for run in runs) * 1000,
+            "base_ms": statistics.median(run["base"] for run in runs) * 1000,
+            "heavy_modules": runs[0]["heavy"],
+        }
+        print(f"{name:20} median {results[name]['median_ms']:8.1f}ms  min {results[name]['min_ms']:8.1f}ms  "
+              f"(IPython and rdflib: {results[name]['base_ms']:.1f}ms)")
+    heavy = results["load_ext"]["heavy_modules"]
+    if heavy:
+        print(f"Loading the extension imported {', '.join(heavy)}")
+        failed = True
+    if args.max_ms is not None and results["load_ext"]["median_ms"] > args.max_ms:
+        print(f"Loading the extension took longer than {args.max_ms}ms")
+        failed = True
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Runs the benchmark suite and compares the results with a baseline.
+
+Every case runs on every dataset and scale in its own process, so caches and memory of one measurement do not
+affect the next. The wall time of each run is measured after an untimed first run, which also records the peak
+memory allocated by Python with tracemalloc. Datasets are generated once and kept in benchmarks/.data.
+
+    python benchmarks/run.py --scales 1k,10k --output results.json
+    python benchmarks/run.py --scales 1k,10k --baseline results.json --threshold 0.2
+    python benchmarks/run.py --cases "entail/*" --datasets hierarchy --scales 1k,10k,100k
+"""
+import argparse
+import fnmatch
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+SRC = HERE.parent / "src"
+sys.path.insert(0, str(SRC))
+sys.path.insert(0, str(HERE))
+
+from cases import Env, available, cases  # noqa: E402
+from generators import dataset, generators, parse_scale  # noqa: E402
+
+
+def measure(name, dataset_name, n, seed, repeat, data_dir):
+    """Runs one case in this process and returns its result."""
+    case = cases[name]
+    path = dataset(dataset_name, n, seed, data_dir)
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        env = Env(dataset_name, path, tmp)
+        bench = case.function(env)
+        run, before = bench if isinstance(bench, tuple) else (bench, None)
+        try:
+            if before is not None:
+                before()
+            gc.collect()
+            tracemalloc.start()
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            times = []
+            for _ in range(repeat):
+                if before is not None:
+                    before()
+                gc.collect()
+                start = time.perf_counter()
+                run()
+                times.append(time.perf_counter() - start)
+        finally:
+            for function in env.atexit:
+                function()
+    return {
+        "case": name,
+        "dataset": dataset_name,
+        "scale": n,
+        "seconds": min(times),
+        "median_seconds": statistics.median(times),
+        "runs": times,
+        "peak_mb": peak / 2 ** 20,
+    }
+
+
+def run_worker(name, dataset_name, n, args):
+    """Runs one case in a new process. Returns its result or a dict with the error."""
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        result_file = f.name
+    try:
+        command = [sys.executable, __file__, "--worker", name, dataset_name, str(n), result_file,
+                   "--seed", str(args.seed), "--repeat", str(args.repeat)]
+        if args.data_dir is not None:
+            command += ["--data-dir", args.data_dir]
+        process = subprocess.run(command, capture_output=True, text=True, timeout=args.timeout)
+        if process.returncode != 0:
+            return {"error": process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "failed"}
+        return json.loads(Path(result_file).read_text())
+    except subprocess.TimeoutExpired:
+        return {"error": f"timed out after {args.timeout}s"}
+    finally:
+        os.unlink(result_file)
+
+
+def selected(args):
+    """Yields (case, dataset, scale) of all measurements selected by args."""
+    scales = [parse_scale(scale) for scale in args.scales.split(",")]
+    for name, case in cases.items():
+        if not any(fnmatch.fnmatch(name, pattern) for pattern in args.cases):
+            continue
+        if not available(case.requires):
+            print(f"Skipping {name}: {case.requires} is not available")
+            continue
+        for dataset_name in case.datasets:
+            if args.datasets and dataset_name not in args.datasets:
+                continue
+            for n in scales:
+                if n > case.max_scale and not args.force:
+                    continue
+                yield name, dataset_name, n
+
+
+def key(result):
+    return f"{result['case']}[{result['dataset']}-{result['scale']}]"
+
+
+def metadata(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=HERE).stdout.strip()
+    except OSError:
+        commit = None
+    import rdflib
+    return {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "rdflib": rdflib.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+    }
+
+
+def compare(results, baseline, threshold, memory_threshold, min_seconds):
+    """Prints the change of every result against the baseline. Returns the keys of all regressions."""
+    regressions = []
+    print(f"\n{'measurement':55} {'seconds':>9} {'baseline':>9} {'change':>8} {'peak MB':>9} {'baseline':>9}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or "error" in result or "error" in base:
+            continue
+        change = result["seconds"] / base["seconds"] - 1 if base["seconds"] else 0.0
+        slower = change > threshold and result["seconds"] - base["seconds"] > min_seconds
+        larger = result["peak_mb"] > base["peak_mb"] * (1 + memory_threshold) and result["peak_mb"] - base["peak_mb"] > 1
+        flag = " slower" if slower else ""
+        flag += " larger" if larger else ""
+        if slower or larger:
+            regressions.append(name)
+        print(f"{name:55} {result['seconds']:9.4f} {base['seconds']:9.4f} {change:+8.1%} "
+              f"{result['peak_mb']:9.1f} {base['peak_mb']:9.1f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite of Jupyter-RDFify")
+    parser.add_argument("--cases", nargs="+", default=["*"], help="Glob patterns of the cases to run, e.g. 'parse/*'")
+    parser.add_argument("--datasets", nargs="+", choices=list(generators), help="Only use these generators")
+    parser.add_argument("--scales", default="1k,10k", help="Comma separated numbers of triples, e.g. 1k,10k,100k,1M,10M")
+    parser.add_argument("--force", action="store_true", help="Also run cases on scales above their limit")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed runs per measurement")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the dataset generators")
+    parser.add_argument("--timeout", type=float, default=3600, help="Seconds after which a measurement is aborted")
+    parser.add_argument("--data-dir", help="Directory of the generated datasets. Defaults to benchmarks/.data")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Relative slowdown counted as regression")
+    parser.add_argument("--memory-threshold", type=float, default=0.25, help="Relative growth of peak memory counted as regression")
+    parser.add_argument("--min-seconds", type=float, default=0.005, help="Slowdowns below this many seconds are ignored as noise")
+    parser.add_argument("--list", action="store_true", help="List the cases and exit")
+    parser.add_argument("--worker", nargs=4, metavar=("CASE", "DATASET", "SCALE", "RESULT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        name, dataset_name, n, result_file = args.worker
+        result = measure(name, dataset_name, int(n), args.seed, args.repeat, args.data_dir)
+        Path(result_file).write_text(json.dumps(result))
+        return
+    if args.list:
+        for name, case in cases.items():
+            print(f"{name:25} {', '.join(case.datasets):25} up to {case.max_scale:>10} triples"
+                  + (f", needs {case.requires}" if case.requires else ""))
+        return
+
+    results = dict()
+    for name, dataset_name, n in selected(args):
+        result = run_worker(name, dataset_name, n, args)
+        result.update(case=name, dataset=dataset_name, scale=n)
+        results[key(result)] = result
+        if "error" in result:
+            print(f"{key(result):55} error: {result['error']}")
+        else:
+            print(f"{key(result):55} {result['seconds']:9.4f}s {result['peak_mb']:9.1f} MB")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({"meta": metadata(args), "results": results}, indent=2))
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())["results"]
+        regressions = compare(results, baseline, args.threshold, args.memory_threshold, args.min_seconds)
+        if regressions:
+            print(f"\n{len(regressions)} regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
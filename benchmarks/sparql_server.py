@@ -0,0 +1,93 @@
+"""Local stand-in for a remote SPARQL endpoint, so remote code paths can be measured without a network.
+
+The server answers GET and POST SPARQL protocol requests by evaluating the query on an rdflib graph and returns
+SPARQL XML or JSON results (RDF/XML for CONSTRUCT and DESCRIBE queries), gzip compressed if the client accepts it.
+max_rows caps the result size like many public endpoints do. Queries are evaluated one at a time, since rdflib's
+query parser can not be used by several threads at once.
+"""
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class SPARQLServer:
+    def __init__(self, graph, max_rows=None, host="127.0.0.1", port=0):
+        self.graph = graph
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/sparql"
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.answer(parse_qs(urlparse(self.path).query).get("query", [""])[0])
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length).decode("utf-8")
+                if self.headers.get("Content-Type", "").startswith("application/sparql-query"):
+                    self.answer(body)
+                else:
+                    self.answer(parse_qs(body).get("query", [""])[0])
+
+            def answer(self, query):
+                try:
+                    body, content_type = server.evaluate(query, self.headers.get("Accept", ""))
+                except Exception as e:
+                    body, content_type, status = str(e).encode("utf-8"), "text/plain", 400
+                else:
+                    status = 200
+                self.send_response(status)
+                self.send_header("Content-Type", content_type + "; charset=utf-8")
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body, compresslevel=1)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def evaluate(self, query, accept):
+        with self.lock:
+            return self._evaluate(query, accept)
+
+    def _evaluate(self, query, accept):
+        res = self.graph.query(query)
+        if res.type in ("CONSTRUCT", "DESCRIBE"):
+            return res.graph.serialize(format="xml", encoding="utf-8"), "application/rdf+xml"
+        if res.type == "SELECT" and self.max_rows is not None:
+            res.bindings = res.bindings[:self.max_rows]
+        if "json" in accept:
+            return res.serialize(format="json"), "application/sparql-results+json"
+        return res.serialize(format="xml"), "application/sparql-results+xml"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="sparql-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,11 +1,34 @@
 __version__ = '1.0.2'
 
+from importlib import import_module
+
 from IPython.display import display_javascript
 from .jupyter_rdf import JupyterRDF
-from .serialization import SerializationModule
-from .sparql import SPARQLModule
-from .graph_manager import GraphManagerModule
-from .persistence import PersistenceModule
+
+# Public names and the submodules defining them. They are imported on first access, so that loading the extension
+# does not import rdflib's SPARQL engine, requests, owlrl, graphviz or pyarrow.
+lazy_names = {
+    "SerializationModule": ".serialization",
+    "SPARQLModule": ".sparql",
+    "GraphManagerModule": ".graph_manager",
+    "PersistenceModule": ".persistence",
+    "TableModule": ".table_module",
+    "ExportModule": ".export_module",
+    "StatsModule": ".stats_module",
+    "JobsModule": ".jobs_module",
+    "run_query": ".prepared",
+    "to_arrow": ".columnar",
+    "to_pandas": ".columnar",
+    "to_parquet": ".columnar",
+}
+
+
+def __getattr__(name):
+    if name not in lazy_names:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(lazy_names[name], __name__), name)
+    globals()[name] = value
+    return value
 
 
 def load_ipython_extension(ipython):
@@ -30,17 +53,25 @@ def load_ipython_extension(ipython):
     }, True)
     jupyter_rdf = JupyterRDF(ipython)
     jupyter_rdf.register_module(
-        SerializationModule, "turtle", "Turtle module", "Turtle")
+        ".serialization:SerializationModule", "turtle", "Turtle module", "Turtle")
+    jupyter_rdf.register_module(
+        ".serialization:SerializationModule", "n3", "Notation 3 module", "N3")
+    jupyter_rdf.register_module(
+        ".serialization:SerializationModule", "json-ld", "JSON-LD module", "JSON-LD")
+    jupyter_rdf.register_module(
+        ".serialization:SerializationModule", "xml", "XML+RDF module", "XML+RDF")
+    jupyter_rdf.register_module(
+        ".sparql:SPARQLModule", "sparql", "SPARQL module", "SPARQL")
     jupyter_rdf.register_module(
-        SerializationModule, "n3", "Notation 3 module", "N3")
+        ".graph_manager:GraphManagerModule", "graph", "Graph management module", "Graphman")
     jupyter_rdf.register_module(
-        SerializationModule, "json-ld", "JSON-LD module", "JSON-LD")
+        ".persistence:PersistenceModule", "persistence", "Persistence module", "Persistence")
     jupyter_rdf.register_module(
-        SerializationModule, "xml", "XML+RDF module", "XML+RDF")
+        ".table_module:TableModule", "table", "Table module", "Table")
     jupyter_rdf.register_module(
-        SPARQLModule, "sparql", "SPARQL module", "SPARQL")
+        ".export_module:ExportModule", "export", "Export module", "Export")
     jupyter_rdf.register_module(
-        GraphManagerModule, "graph", "Graph management module", "Graphman")
+        ".stats_module:StatsModule", "stats", "Statistics module", "Stats")
     jupyter_rdf.register_module(
-        PersistenceModule, "persistence", "Persistence module", "Persistence")
+        ".jobs_module:JobsModule", "jobs", "Background jobs module", "Jobs")
     ipython.register_magics(jupyter_rdf)
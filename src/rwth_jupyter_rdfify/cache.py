@@ -0,0 +1,144 @@
+import hashlib
+import struct
+from collections import OrderedDict, defaultdict
+from pathlib import Path
+
+from rdflib import BNode
+
+
+def content_key(*parts):
+    """Stable hash over several strings which is used as cache key."""
+    h = hashlib.sha256()
+    for part in parts:
+        data = part.encode("utf-8")
+        # Length prefix so that ("ab", "c") and ("a", "bc") do not collide.
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    return h.hexdigest()
+
+
+class LRUCache:
+    """Bounded mapping which evicts the least recently used entry and counts hits and misses."""
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """Inserts value and returns the list of (key, value) pairs evicted to stay within maxsize."""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        evicted = []
+        while len(self.entries) > self.maxsize:
+            evicted.append(self.entries.popitem(last=False))
+        return evicted
+
+    def pop(self, key, default=None):
+        return self.entries.pop(key, default)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        return f"{self.hits} hits, {self.misses} misses, {len(self)}/{self.maxsize} entries"
+
+
+class ParseCache:
+    """Caches parsed graphs by the hash of their format and source text.
+    Entries are kept as plain triple tuples which are cheap to copy into a fresh graph.
+    If a spill directory is set, entries are also written there as graph snapshots and survive kernel restarts."""
+
+    def __init__(self, maxsize=16, spill_dir=None):
+        self.memory = LRUCache(maxsize)
+        self.spill_dir = None
+        self.disk_hits = 0
+        self.set_spill_dir(spill_dir)
+
+    def set_spill_dir(self, spill_dir):
+        if spill_dir is not None:
+            spill_dir = Path(spill_dir)
+            spill_dir.mkdir(parents=True, exist_ok=True)
+        self.spill_dir = spill_dir
+
+    def key(self, fmt, prefix, text):
+        return content_key(fmt, prefix, text)
+
+    def get(self, key, store="default"):
+        """Returns a new graph holding the cached triples or None if the key is unknown."""
+        entry = self.memory.get(key)
+        if entry is None and self.spill_dir is not None:
+            entry = self._read_spill(key)
+            if entry is not None:
+                self.disk_hits += 1
+                self.memory.put(key, entry)
+        if entry is None:
+            return None
+        return graph_from_entry(entry, store)
+
+    def put(self, key, graph):
+        entry = entry_from_graph(graph)
+        self.memory.put(key, entry)
+        if self.spill_dir is not None:
+            self._write_spill(key, graph)
+
+    def clear(self):
+        self.memory.clear()
+
+    def stats(self):
+        s = f"Parse cache: {self.memory.stats()}"
+        if self.spill_dir is not None:
+            s += f", {self.disk_hits} served from '{self.spill_dir}'"
+        return s
+
+    def _spill_path(self, key):
+        return self.spill_dir / f"{key}.rdfsnap"
+
+    def _read_spill(self, key):
+        # Imported here as snapshot.py depends on graph.py, which uses the caches of this module.
+        from .snapshot import load_snapshot
+        try:
+            return entry_from_graph(load_snapshot(self._spill_path(key))["graph"])
+        except (OSError, ValueError, KeyError, struct.error):
+            return None
+
+    def _write_spill(self, key, graph):
+        from .snapshot import save_snapshot
+        save_snapshot(self._spill_path(key), {"graph": graph})
+
+
+def entry_from_graph(graph):
+    return tuple(graph), tuple(graph.namespaces())
+
+
+def graph_from_entry(entry, store="default"):
+    """New graph holding the triples of entry. Its blank nodes are fresh, so graphs of the same entry do not share
+    them, just like two parses of the same text."""
+    # Imported here as graph.py uses the caches of this module.
+    from .graph import new_graph
+    triples, namespaces = entry
+    g = new_graph(store)
+    for prefix, namespace in namespaces:
+        g.bind(prefix, namespace, override=True)
+    bnodes = defaultdict(BNode)
+
+    def fresh(term):
+        return bnodes[term] if isinstance(term, BNode) else term
+
+    g.addN((fresh(s), p, fresh(o), g) for s, p, o in triples)
+    return g
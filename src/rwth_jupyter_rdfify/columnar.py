@@ -0,0 +1,220 @@
+"""Columnar export of query results and graphs to Arrow tables, pandas DataFrames and Parquet files.
+
+Every variable becomes a dictionary encoded column: each distinct term is converted to its string once and the rows
+only store its index. Variables holding numeric, boolean or date literals additionally get a typed column named
+"<variable>_value". Literals are decoded per distinct string and datatype, and the typed column is gathered from the
+decoded values with the row indices. Remote results are read straight from the response without creating rdflib terms.
+Needs pyarrow (and pandas for DataFrames)."""
+import rdflib
+from rdflib.namespace import XSD
+from rdflib.query import Result
+
+from .results import ResultRows, SpooledRows, result_mime_types, result_rows
+from .sparql_client import SPARQLResponse
+
+XSD_NS = str(XSD)
+INTEGER_TYPES = ["integer", "int", "long", "short", "byte", "nonNegativeInteger", "positiveInteger",
+                 "negativeInteger", "nonPositiveInteger", "unsignedLong", "unsignedInt", "unsignedShort", "unsignedByte"]
+# Kind of the typed column for a literal datatype.
+value_kinds = {XSD_NS + name: "int" for name in INTEGER_TYPES}
+value_kinds.update({XSD_NS + name: "float" for name in ["decimal", "double", "float"]})
+value_kinds.update({XSD_NS + "boolean": "bool", XSD_NS + "dateTime": "datetime", XSD_NS + "dateTimeStamp": "datetime",
+                    XSD_NS + "date": "datetime"})
+
+
+def import_arrow():
+    try:
+        import numpy as np
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError("Columnar export requires pyarrow. Install it with 'pip install pyarrow pandas'.")
+    return np, pa
+
+
+def term_strings(terms):
+    """Strings of rdflib terms or raw (kind, value, datatype, language) tuples, None stays None."""
+    return [None if t is None else t[1] if type(t) is tuple else str(t) for t in terms]
+
+
+def term_datatypes(terms):
+    """Datatype IRIs of literals as strings, None for other terms."""
+    datatypes = [t[2] if type(t) is tuple else getattr(t, "datatype", None) for t in terms]
+    return [None if datatype is None else str(datatype) for datatype in datatypes]
+
+
+def choose_kind(datatypes):
+    """Kind of the typed column for the datatypes of a column, None if it holds no or differently typed literals."""
+    kinds = set(value_kinds.get(datatype) for datatype in set(datatypes))
+    kinds.discard(None)
+    if kinds == {"int", "float"}:
+        return "float"
+    return kinds.pop() if len(kinds) == 1 else None
+
+
+def decode_values(np, pa, dictionary, datatypes, kind):
+    """Decodes the distinct values of a column into kind. Returns the decoded values as Arrow array, with nulls for
+    values which are no literal of kind or can not be decoded."""
+    import pyarrow.compute as pc
+    known = {datatype: datatype in value_kinds for datatype in set(datatypes)}
+    typed = np.array([known[datatype] for datatype in datatypes], dtype=bool)
+    if kind in ("int", "float") and typed.all():
+        # Common case of a clean numeric column, cast in one go.
+        try:
+            return pc.cast(pc.utf8_trim_whitespace(dictionary), pa.int64() if kind == "int" else pa.float64())
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            pass
+    dtype = {"int": np.int64, "float": np.float64, "bool": np.bool_, "datetime": "datetime64[us]"}[kind]
+    decoded = np.zeros(len(dictionary), dtype=dtype)
+    invalid = ~typed
+    for i, value in enumerate(dictionary.to_pylist()):
+        if invalid[i]:
+            continue
+        try:
+            if kind == "int":
+                decoded[i] = int(value)
+            elif kind == "float":
+                decoded[i] = float(value)
+            elif kind == "bool":
+                decoded[i] = value.strip() in ("true", "1")
+            else:
+                decoded[i] = np.datetime64(strip_timezone(value))
+        except (ValueError, OverflowError):
+            invalid[i] = True
+    return pa.array(decoded, mask=invalid)
+
+
+def strip_timezone(value):
+    """Drops the timezone of an xsd:dateTime or xsd:date, which numpy does not parse."""
+    value = value.strip()
+    if value.endswith("Z"):
+        return value[:-1]
+    if len(value) > 10 and value[-6] in "+-" and value[-3] == ":":
+        return value[:-6]
+    return value
+
+
+class ColumnarBuilder:
+    """Collects rows and turns them into Arrow record batches, one column at a time. Terms with the same string,
+    e.g. "1" and "1"^^xsd:integer, share one dictionary entry, but only the typed one gets a value in the typed column.
+    The typed columns are chosen with the first batch so that all batches have the same schema."""
+
+    def __init__(self, header):
+        self.header = list(header)
+        self.rows = []
+        self.count = 0
+        self.kinds = None
+
+    def add(self, row):
+        self.rows.append(row)
+        self.count += 1
+
+    def batch(self):
+        """Returns the rows added since the last batch as Arrow record batch."""
+        np, pa = import_arrow()
+        rows, self.rows = self.rows, []
+        first = self.kinds is None
+        if first:
+            self.kinds = dict()
+        names = []
+        arrays = []
+        columns = list(zip(*rows)) if rows else [()] * len(self.header)
+        for name, terms in zip(self.header, columns):
+            encoded = pa.array(term_strings(terms), type=pa.string()).dictionary_encode()
+            names.append(name)
+            arrays.append(encoded)
+            if any(t is rdflib.Literal or t is tuple for t in set(map(type, terms))):
+                datatypes = term_datatypes(terms)
+            else:
+                datatypes = [None] * len(terms)
+            if first:
+                self.kinds[name] = choose_kind(datatypes)
+            kind = self.kinds[name]
+            if kind is None:
+                continue
+            # Values are decoded once per distinct pair of string and datatype.
+            missing = encoded.is_null().to_numpy(zero_copy_only=False)
+            present = np.flatnonzero(~missing)
+            types = pa.array(datatypes, type=pa.string()).dictionary_encode()
+            type_codes = types.indices.fill_null(-1).to_numpy(zero_copy_only=False).astype(np.int64)
+            codes = encoded.indices.fill_null(0).to_numpy(zero_copy_only=False).astype(np.int64)
+            pairs = codes[present] * (len(types.dictionary) + 1) + type_codes[present] + 1
+            _, position, inverse = np.unique(pairs, return_index=True, return_inverse=True)
+            firsts = present[position]
+            decoded = decode_values(np, pa, encoded.dictionary.take(pa.array(codes[firsts])),
+                                    [datatypes[j] for j in firsts.tolist()], kind)
+            indices = np.zeros(len(terms), dtype=np.int64)
+            indices[present] = inverse.reshape(-1)
+            names.append(f"{name}_value")
+            arrays.append(decoded.take(pa.array(indices, mask=missing)))
+        return pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+def columnar_rows(obj):
+    """Returns the column names and an iterator over the rows of a graph, a query result or a stored remote result."""
+    if isinstance(obj, Result):
+        if obj.type == "SELECT":
+            return [str(var) for var in obj.vars], iter(obj)
+        if obj.graph is not None:
+            return columnar_rows(obj.graph)
+        raise TypeError(f"{obj.type} results can not be exported")
+    if isinstance(obj, rdflib.Graph):
+        return ["subject", "predicate", "object"], iter(obj)
+    if isinstance(obj, (SpooledRows, ResultRows)):
+        if isinstance(obj, ResultRows) and obj.exhausted:
+            raise ValueError("The rows of this result have been read already. Store remote results with --store.")
+        return obj.header, iter(obj)
+    if isinstance(obj, SPARQLResponse):
+        mime = obj.content_type.split(";")[0].strip()
+        if mime in result_mime_types:
+            rows = result_rows(obj.open(), mime, raw=True)
+            return next(rows), rows
+        g = rdflib.Graph()
+        g.parse(data=obj.body, format="xml")
+        return columnar_rows(g)
+    raise TypeError(f"Can not export {type(obj).__name__} objects")
+
+
+def record_batches(obj, batch_size=100000):
+    """Yields the rows of obj as Arrow record batches of up to batch_size rows."""
+    header, rows = columnar_rows(obj)
+    builder = ColumnarBuilder(header)
+    for row in rows:
+        builder.add(row)
+        if builder.count % batch_size == 0:
+            yield builder.batch()
+    if builder.count % batch_size or builder.count == 0:
+        yield builder.batch()
+
+
+def to_arrow(obj):
+    """Returns a graph, SELECT result or stored remote result as pyarrow Table."""
+    header, rows = columnar_rows(obj)
+    builder = ColumnarBuilder(header)
+    for row in rows:
+        builder.add(row)
+    _, pa = import_arrow()
+    return pa.Table.from_batches([builder.batch()])
+
+
+def to_pandas(obj):
+    """Returns a graph, SELECT result or stored remote result as pandas DataFrame with categorical term columns."""
+    return to_arrow(obj).to_pandas()
+
+
+def to_parquet(obj, path, batch_size=100000):
+    """Writes a graph, SELECT result or stored remote result to a Parquet file, batch_size rows at a time.
+    Returns the number of rows written."""
+    _, pa = import_arrow()
+    import pyarrow.parquet as pq
+    writer = None
+    rows = 0
+    try:
+        for batch in record_batches(obj, batch_size):
+            if writer is None:
+                writer = pq.ParquetWriter(path, batch.schema)
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
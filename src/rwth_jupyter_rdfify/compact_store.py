@@ -0,0 +1,233 @@
+"""Memory efficient rdflib store.
+
+Terms are interned into a term dictionary and triples are kept as integer ids in three sorted permutations
+(SPO, POS and OSP), each stored in two flat arrays. Recent changes are buffered in small hash indexes and merged into
+the sorted arrays in bulk, so interleaved additions and lookups (e.g. while parsing or entailing) stay cheap."""
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+from rdflib import plugin
+from rdflib.store import Store
+
+MASK = 0xFFFFFFFF
+# Typecode of an array of 32 bit ids. "L" is 64 bits wide on most 64 bit platforms.
+ID = "I" if array("I").itemsize == 4 else "L"
+# Buffered changes are merged once they exceed this many triples or a quarter of the store, whichever is larger.
+MIN_MERGE = 1 << 16
+
+
+class Permutation:
+    """One sort order of all triples. hi holds the first two ids packed into 64 bits, lo the third one in 32 bits."""
+    __slots__ = ("order", "hi", "lo")
+
+    def __init__(self, order):
+        self.order = order
+        self.hi = array("Q")
+        self.lo = array(ID)
+
+    def rebuild(self, triples):
+        a, b, c = self.order
+        keys = sorted(((t[a] << 32) | t[b], t[c]) for t in triples)
+        self.hi = array("Q", (k[0] for k in keys))
+        self.lo = array(ID, (k[1] for k in keys))
+
+    def span(self, first, second=None):
+        if second is None:
+            low, high = first << 32, (first << 32) | MASK
+        else:
+            low = high = (first << 32) | second
+        return bisect_left(self.hi, low), bisect_right(self.hi, high)
+
+    def contains(self, first, second, third):
+        i, j = self.span(first, second)
+        k = bisect_left(self.lo, third, i, j)
+        return k < j and self.lo[k] == third
+
+    def scan(self, i=0, j=None):
+        """Yields the (s, p, o) id triples in positions i to j."""
+        a, b, c = self.order
+        hi, lo = self.hi, self.lo
+        for k in range(i, len(hi) if j is None else j):
+            t = [0, 0, 0]
+            t[a], t[b], t[c] = hi[k] >> 32, hi[k] & MASK, lo[k]
+            yield tuple(t)
+
+    def nbytes(self):
+        return self.hi.itemsize * len(self.hi) + self.lo.itemsize * len(self.lo)
+
+
+class CompactStore(Store):
+    """Non context aware store keeping triples as dictionary encoded integer arrays."""
+    context_aware = False
+    formula_aware = False
+    transaction_aware = False
+    graph_aware = False
+
+    def __init__(self, configuration=None, identifier=None):
+        super().__init__(configuration, identifier)
+        self.ids = dict()
+        self.terms = list()
+        self.spo = Permutation((0, 1, 2))
+        self.pos = Permutation((1, 2, 0))
+        self.osp = Permutation((2, 0, 1))
+        self.size = 0
+        # Changes not yet merged into the permutations.
+        self.added = set()
+        self.added_index = (defaultdict(set), defaultdict(set), defaultdict(set))
+        self.removed = set()
+        self.__namespace = dict()
+        self.__prefix = dict()
+
+    def _encode(self, term):
+        i = self.ids.get(term)
+        if i is None:
+            i = len(self.terms)
+            self.ids[term] = i
+            self.terms.append(term)
+        return i
+
+    def _decode(self, t):
+        terms = self.terms
+        return terms[t[0]], terms[t[1]], terms[t[2]]
+
+    def _in_arrays(self, t):
+        return self.spo.contains(*t) and t not in self.removed
+
+    def add(self, triple, context, quoted=False):
+        if quoted:
+            raise ValueError("The compact store does not support quoted statements")
+        Store.add(self, triple, context, quoted)
+        encode = self._encode
+        t = (encode(triple[0]), encode(triple[1]), encode(triple[2]))
+        if t in self.removed:
+            self.removed.discard(t)
+        elif t in self.added or self.spo.contains(*t):
+            return
+        else:
+            self.added.add(t)
+            for position, index in enumerate(self.added_index):
+                index[t[position]].add(t)
+            if len(self.added) > max(MIN_MERGE, self.size // 4):
+                self.merge()
+        self.size += 1
+
+    def remove(self, triple_pattern, context=None):
+        for (triple, _) in list(self.triples(triple_pattern, context)):
+            t = tuple(self.ids[term] for term in triple)
+            if t in self.added:
+                self.added.discard(t)
+                for position, index in enumerate(self.added_index):
+                    index[t[position]].discard(t)
+            else:
+                self.removed.add(t)
+            self.size -= 1
+            Store.remove(self, triple, context)
+        if len(self.removed) > max(MIN_MERGE, self.size // 4):
+            self.merge()
+
+    def merge(self):
+        """Merges the buffered changes into the sorted permutations."""
+        removed = self.removed
+        triples = [t for t in self.spo.scan() if t not in removed]
+        triples.extend(self.added)
+        for permutation in (self.spo, self.pos, self.osp):
+            permutation.rebuild(triples)
+        self.added = set()
+        self.added_index = (defaultdict(set), defaultdict(set), defaultdict(set))
+        self.removed = set()
+
+    def load_encoded(self, terms, triples):
+        """Bulk loads an empty store from a term list and (s, p, o) tuples of indexes into it."""
+        self.terms = list(terms)
+        self.ids = {term: i for i, term in enumerate(self.terms)}
+        triples = list(triples)
+        for permutation in (self.spo, self.pos, self.osp):
+            permutation.rebuild(triples)
+        self.size = len(triples)
+
+    def triples(self, triple_pattern, context=None):
+        ids = []
+        for term in triple_pattern:
+            if term is None:
+                ids.append(None)
+            elif term in self.ids:
+                ids.append(self.ids[term])
+            else:
+                # Unknown terms can not match anything.
+                return
+        s, p, o = ids
+        for t in self._match(s, p, o):
+            yield self._decode(t), iter(())
+
+    def _match(self, s, p, o):
+        if s is not None and p is not None and o is not None:
+            t = (s, p, o)
+            if t in self.added or self._in_arrays(t):
+                yield t
+            return
+        if s is not None:
+            permutation, span = (self.spo, self.spo.span(s, p)) if o is None else (self.osp, self.osp.span(o, s))
+        elif p is not None:
+            permutation, span = self.pos, self.pos.span(p, o)
+        elif o is not None:
+            permutation, span = self.osp, self.osp.span(o)
+        else:
+            permutation, span = self.spo, (0, len(self.spo.hi))
+        removed = self.removed
+        for t in permutation.scan(*span):
+            if t not in removed:
+                yield t
+        # Buffered additions, looked up by the most selective bound position.
+        if s is not None:
+            candidates = self.added_index[0].get(s, ())
+        elif p is not None:
+            candidates = self.added_index[1].get(p, ())
+        elif o is not None:
+            candidates = self.added_index[2].get(o, ())
+        else:
+            candidates = self.added
+        for t in list(candidates):
+            if (p is None or t[1] == p) and (o is None or t[2] == o):
+                yield t
+
+    def __len__(self, context=None):
+        return self.size
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    def nbytes(self):
+        """Rough size of the triple indexes in bytes, excluding the term dictionary and buffered changes."""
+        return self.spo.nbytes() + self.pos.nbytes() + self.osp.nbytes()
+
+    def bind(self, prefix, namespace, override=True):
+        bound_namespace = self.__namespace.get(prefix)
+        bound_prefix = self.__prefix.get(namespace)
+        if bound_prefix is None and bound_namespace is not None:
+            bound_prefix = self.__prefix.get(bound_namespace)
+        if override:
+            if bound_prefix is not None:
+                del self.__namespace[bound_prefix]
+            if bound_namespace is not None:
+                del self.__prefix[bound_namespace]
+            self.__prefix[namespace] = prefix
+            self.__namespace[prefix] = namespace
+        else:
+            namespace = bound_namespace if bound_namespace is not None else namespace
+            prefix = bound_prefix if bound_prefix is not None else prefix
+            self.__prefix[namespace] = prefix
+            self.__namespace[prefix] = namespace
+
+    def namespace(self, prefix):
+        return self.__namespace.get(prefix, None)
+
+    def prefix(self, namespace):
+        return self.__prefix.get(namespace, None)
+
+    def namespaces(self):
+        for prefix, namespace in self.__namespace.items():
+            yield prefix, namespace
+
+
+plugin.register("Compact", Store, __name__, "CompactStore")
@@ -0,0 +1,404 @@
+import copy
+from collections import defaultdict
+from itertools import islice
+
+from rdflib import BNode, Literal, URIRef
+from rdflib.namespace import OWL, RDF, RDFS, XSD
+from .native_rdfs import rdfs_closure
+from .stats import stats
+
+regimes = {
+    "rdfs": "RDFS regime",
+    "owl": "OWL-RL regime",
+    "rdfs+owl": "RDFS regime and then the OWL-RL regime",
+}
+engines = ["owlrl", "native"]
+# Terms of these namespaces occur in a large part of all triples. They are not followed when looking for
+# triples affected by a change, which keeps the affected neighbourhood small.
+vocabulary = (str(RDF), str(RDFS), str(OWL), str(XSD))
+
+
+def deductive_closure(regime, closure_class=None):
+    """Returns the owlrl DeductiveClosure for a regime. closure_class replaces the semantics class of the regime."""
+    from owlrl import DeductiveClosure, RDFS_Semantics, OWLRL_Semantics
+    if regime == "rdfs":
+        return DeductiveClosure(closure_class or RDFS_Semantics)
+    elif regime == "owl":
+        return DeductiveClosure(closure_class or OWLRL_Semantics)
+    elif regime == "rdfs+owl":
+        return DeductiveClosure(closure_class or OWLRL_Semantics, rdfs_closure=True)
+    raise ValueError(f"Unknown entailment regime '{regime}'")
+
+
+def semantics_class(regime):
+    from owlrl import RDFS_Semantics, OWLRL_Semantics
+    return RDFS_Semantics if regime == "rdfs" else OWLRL_Semantics
+
+
+def entail(graph, regime, engine="owlrl"):
+    """Expands graph in-place under regime and remembers the regime and the inferred triples on the graph.
+    A previous entailment of the graph is retracted first."""
+    entailment = Entailment(regime, engine)
+    if getattr(graph, "entailment", None) is not None:
+        graph.entailment.retract(graph)
+    entailment.expand(graph)
+    graph.entailment = entailment
+    return entailment
+
+
+def is_vocabulary(term):
+    # URIRef.startswith does not take a tuple of prefixes.
+    return isinstance(term, URIRef) and str(term).startswith(vocabulary)
+
+
+def is_vocabulary_triple(t):
+    return all(is_vocabulary(term) for term in t)
+
+
+def vocabulary_terms(triples):
+    """Vocabulary terms and datatypes of literals used by triples."""
+    terms = set()
+    for t in triples:
+        for term in t:
+            if isinstance(term, Literal):
+                term = term.datatype
+            if term is not None and is_vocabulary(term):
+                terms.add(term)
+    return terms
+
+
+def list_head(graph, node):
+    """Walks rdf:rest links backwards to the head of the rdf list containing node."""
+    seen = {node}
+    prev = graph.value(predicate=RDF.rest, object=node)
+    while prev is not None and prev not in seen:
+        seen.add(prev)
+        node = prev
+        prev = graph.value(predicate=RDF.rest, object=node)
+    return node
+
+
+def neighbourhood_terms(graph, triples):
+    """Non-vocabulary terms of triples plus the heads of rdf lists they are members of.
+    Rules joining through list members (e.g. owl:intersectionOf, owl:propertyChainAxiom) are triggered by the
+    triple mentioning the list head."""
+    terms = set()
+    for t in triples:
+        for term in t:
+            if not is_vocabulary(term):
+                terms.add(term)
+    for term in list(terms):
+        for cell in graph.subjects(RDF.first, term):
+            terms.add(list_head(graph, cell))
+    return terms
+
+
+def triples_with_terms(graph, terms):
+    for term in terms:
+        yield from graph.triples((term, None, None))
+        if not isinstance(term, Literal):
+            yield from graph.triples((None, term, None))
+        yield from graph.triples((None, None, term))
+
+
+def literal_key(lt):
+    """Value under which owlrl's one-time rules treat literals as equal, or None if they are only equal as terms."""
+    if not isinstance(lt, Literal) or lt.value is None:
+        return None
+    try:
+        hash(lt.value)
+    except TypeError:
+        return None
+    return lt.value
+
+
+def delta_closure_class(semantics, seed, derived, entailment):
+    """Subclass of an owlrl semantics class which runs the rule cycles semi-naively.
+    The first cycle only visits triples near seed, every further cycle only triples near the triples derived in the
+    previous one. All triples added to the graph are collected in the set derived. Like in the full run, the one-time
+    rules and the rules of the first cycle only apply to asserted triples, here to those near seed."""
+    import rdflib
+    from owlrl import OWLRL_Semantics
+    from owlrl.AxiomaticTriples import OWLRL_Datatypes_Disjointness
+    from owlrl.Namespaces import ERRNS
+    from owlrl.XsdDatatypes import OWL_RL_Datatypes
+
+    class DeltaClosure(semantics):
+
+        def flush_stored_triples(self):
+            derived.update(self.added_triples)
+            super().flush_stored_triples()
+
+        def asserted(self, t):
+            return t not in entailment.inferred and t not in derived and t in self.graph
+
+        def asserted_triples(self, pattern):
+            return [t for t in self.graph.triples(pattern) if self.asserted(t)]
+
+        def witnesses(self, terms):
+            """For every vocabulary term, a triple and an asserted triple using it in each position. They derive the
+            triples of vocabulary terms only, e.g. rdf:type rdf:type rdf:Property, which are not near seed."""
+            found = []
+            for term in terms:
+                for pattern in [(term, None, None), (None, term, None), (None, None, term)]:
+                    found.extend(islice(self.graph.triples(pattern), 1))
+                    found.extend(islice((t for t in self.graph.triples(pattern) if self.asserted(t)), 1))
+            return found
+
+        def seed_one_time_rules(self, base, terms):
+            """Applies the one-time rules to the asserted triples base and returns the added triples. terms are the
+            vocabulary terms of seed."""
+            self.empty_stored_triples()
+            if issubclass(semantics, OWLRL_Semantics):
+                self._one_time_rules_misc()
+                self.datatype_rules(base, terms)
+            else:
+                self.literal_rules(base)
+            added = self.added_triples
+            self.flush_stored_triples()
+            return added
+
+        def literal_rules(self, base):
+            """RDFS_Semantics.one_time_rules: (s p lt1) entails (s p lt2) for literals with equal values."""
+            for s, p, o in base:
+                for other in entailment.equal_literals(self.graph, o):
+                    partners = self.asserted_triples((None, None, other))
+                    if partners:
+                        self.store_triple((s, p, other))
+                    for s2, p2, _ in partners:
+                        self.store_triple((s2, p2, o))
+
+        def datatype_rules(self, base, terms):
+            """Runs OWLRL_Semantics' datatype rules on base and the asserted triples they are joined with: the
+            owl:sameAs links and datatype typings of their resources and a triple using each datatype which is
+            disjoint with a datatype of base or terms."""
+            part = rdflib.Graph()
+            for s, p, o in base:
+                part.add((s, p, o))
+                if p == OWL.sameAs:
+                    for x in (s, o):
+                        for t in self.asserted_triples((x, RDF.type, None)):
+                            part.add(t)
+                elif p == RDF.type and o in OWL_RL_Datatypes:
+                    for t in self.asserted_triples((s, OWL.sameAs, None)) + self.asserted_triples((None, OWL.sameAs, s)):
+                        part.add(t)
+            used = set(o.datatype for o in part.objects() if isinstance(o, Literal))
+            used.update(o for o in part.objects(predicate=RDF.type) if o in OWL_RL_Datatypes)
+            relevant = used | terms
+            for l, _, r in OWLRL_Datatypes_Disjointness:
+                for dt in ({l, r} - used if relevant.intersection((l, r)) else ()):
+                    witness = self.datatype_witness(dt)
+                    if witness is not None:
+                        part.add(witness)
+            graph = self.graph
+            self.graph = part
+            try:
+                self._one_time_rules_datatypes()
+            finally:
+                self.graph = graph
+
+        def datatype_witness(self, datatype):
+            """An asserted triple whose object is a literal of datatype or which types a resource as datatype."""
+            for x, _, _ in self.graph.triples((None, RDF.type, datatype)):
+                if isinstance(x, Literal):
+                    partners = self.asserted_triples((None, None, x))
+                    if partners:
+                        return partners[0]
+                elif self.asserted((x, RDF.type, datatype)):
+                    return x, RDF.type, datatype
+            return None
+
+        def post_process(self):
+            if hasattr(self, "bnodes"):
+                # The full run drops the triples with blank node predicates, all of which stem from asserted triples.
+                self.bnodes.extend(t[1] for t in derived if isinstance(t[1], BNode) and t[1] not in self.bnodes)
+            super().post_process()
+
+        def closure(self):
+            # pre_process, the axioms and the one-time rules on the rest of the graph were handled by the initial
+            # expansion.
+            delta = seed
+            initial = set()
+            cycle_num = 0
+            while delta:
+                cycle_num += 1
+                triggers = set(t for t in delta if t in self.graph)
+                triggers.update(triples_with_terms(
+                    self.graph, neighbourhood_terms(self.graph, delta)))
+                # Triples of vocabulary terms only, e.g. xsd:boolean owl:disjointWith xsd:decimal, join with the
+                # triples using these terms, but are not near them.
+                # Reflexive ones like rdf:type rdfs:subPropertyOf rdf:type entail nothing new.
+                triggers.update(t for t in entailment.vocabulary_triples(self.graph, vocabulary_terms(delta))
+                                if t[0] != t[2])
+                if cycle_num == 1:
+                    terms = vocabulary_terms(seed)
+                    triggers.update(self.witnesses(terms))
+                    initial = self.seed_one_time_rules([t for t in triggers if self.asserted(t)], terms)
+                    triggers.update(initial)
+                    triggers.update(triples_with_terms(
+                        self.graph, neighbourhood_terms(self.graph, initial)))
+                self.empty_stored_triples()
+                for t in triggers:
+                    # Rules of the first cycle, like typing all subjects and objects as rdfs:Resource, only apply to
+                    # the asserted triples and the results of the one-time rules.
+                    first = cycle_num == 1 and (t in initial or self.asserted(t))
+                    self.rules(t, 1 if first else max(cycle_num, 2))
+                delta = self.added_triples
+                for t in delta:
+                    self.destination.add(t)
+                derived.update(delta)
+
+            self.post_process()
+            self.flush_stored_triples()
+            # Post processing may have dropped some of the derived triples again.
+            for t in [t for t in derived if t not in self.graph]:
+                derived.discard(t)
+            for m in self.error_messages:
+                if (None, ERRNS.error, Literal(m)) in self.destination:
+                    continue
+                self.destination.bind("err", "http://www.daml.org/2002/03/agents/agent-ont#")
+                message = BNode()
+                for t in [(message, RDF.type, ERRNS.ErrorMessage), (message, ERRNS.error, Literal(m))]:
+                    self.destination.add(t)
+                    derived.add(t)
+
+    return DeltaClosure
+
+
+class Entailment:
+    """Closure of a graph under an entailment regime, maintained incrementally.
+    Inferred triples are tracked separately from the asserted ones, so they can be retracted without recomputation.
+    Additions are handled semi-naively, removals by deleting all possibly affected inferences and rederiving them."""
+
+    def __init__(self, regime, engine="owlrl"):
+        if regime not in regimes:
+            raise ValueError(f"Unknown entailment regime '{regime}'")
+        if engine == "native" and regime != "rdfs":
+            raise ValueError("The native engine only supports the RDFS regime")
+        self.regime = regime
+        self.engine = engine
+        self.inferred = set()
+        # Literals of the graph by literal_key, built on first use. Entries of removed literals are left behind.
+        self.literals = None
+        # Triples of vocabulary terms only, built on first use. Entries of removed triples are left behind.
+        self.vocabulary = None
+
+    def expand(self, graph):
+        """Computes the full closure of graph from scratch."""
+        with stats.phase("entail") as phase:
+            asserted = set(graph)
+            if self.engine == "native":
+                rdfs_closure(graph)
+            else:
+                deductive_closure(self.regime).expand(graph)
+            self.inferred = set(t for t in graph if t not in asserted)
+            self.vocabulary = None
+            phase.count(triples=asserted, inferred=self.inferred)
+
+    def equal_literals(self, graph, literal):
+        """Other literals of graph which owlrl treats as equal to literal. May include literals no longer in graph."""
+        key = literal_key(literal)
+        if key is None:
+            return ()
+        if getattr(self, "literals", None) is None:
+            self.literals = defaultdict(set)
+            for o in graph.objects():
+                if literal_key(o) is not None:
+                    self.literals[literal_key(o)].add(o)
+        self.literals[key].add(literal)
+        return [lt for lt in self.literals[key] if lt != literal]
+
+    def vocabulary_triples(self, graph, terms):
+        """Triples of graph which consist of vocabulary terms only and use one of terms."""
+        if getattr(self, "vocabulary", None) is None:
+            self.vocabulary = set(t for t in graph if is_vocabulary_triple(t))
+        return [t for t in self.vocabulary if not terms.isdisjoint(t) and t in graph]
+
+    def copy(self):
+        """Copy of the entailment whose sets can be changed independently of this one."""
+        copied = copy.copy(self)
+        copied.inferred = set(self.inferred)
+        copied.literals = None
+        copied.vocabulary = None
+        return copied
+
+    def retract(self, graph):
+        """Removes all inferred triples from graph, leaving only the asserted ones."""
+        for t in self.inferred:
+            graph.remove(t)
+        self.inferred = set()
+        self.vocabulary = None
+
+    def add(self, graph, triples):
+        """Asserts triples in graph and adds everything that follows from them."""
+        new = set()
+        for t in triples:
+            if t in self.inferred:
+                # Already entailed, now also asserted. Rules which only apply to asserted triples may now apply.
+                self.inferred.discard(t)
+                new.add(t)
+            elif t not in graph:
+                graph.add(t)
+                new.add(t)
+        if not new:
+            return
+        if any(is_vocabulary(s) for s, _, _ in new):
+            # Statements about the vocabulary itself can affect any triple.
+            self._recompute(graph)
+        else:
+            self._derive(graph, new)
+
+    def remove(self, graph, triples):
+        """Removes triples from graph together with all inferences that no longer follow."""
+        removed = set()
+        for t in triples:
+            if t in graph:
+                graph.remove(t)
+                self.inferred.discard(t)
+                removed.add(t)
+        if not removed:
+            return
+        if any(is_vocabulary(s) for s, _, _ in removed) or self._has_errors(graph):
+            # Statements about the vocabulary can affect any triple, and owlrl's consistency errors cannot be traced
+            # back to the triples they stem from.
+            self._recompute(graph)
+            return
+        # Overdelete: every inferred triple connected to the removed ones through shared terms.
+        frontier = neighbourhood_terms(graph, removed)
+        seen = set(frontier)
+        overdeleted = set()
+        while frontier:
+            found = set(t for t in triples_with_terms(graph, frontier)
+                        if t in self.inferred and t not in overdeleted)
+            overdeleted.update(found)
+            frontier = neighbourhood_terms(graph, found) - seen
+            seen.update(frontier)
+        # Inferred triples of vocabulary terms only, like rdf:type rdf:type rdf:Property, are not connected to the
+        # removed ones through shared terms. Those using a vocabulary term of the deleted triples are deleted as well.
+        terms = vocabulary_terms(removed | overdeleted)
+        overdeleted.update(t for t in self.vocabulary_triples(graph, terms) if t in self.inferred)
+        for t in overdeleted:
+            graph.remove(t)
+        self.inferred.difference_update(overdeleted)
+        # Rederive: the remaining triples around the deleted ones may still entail some of them.
+        self._derive(graph, removed | overdeleted)
+
+    def _derive(self, graph, seed):
+        derived = set()
+        with stats.phase("entail update") as phase:
+            deductive_closure(self.regime, delta_closure_class(
+                semantics_class(self.regime), seed, derived, self)).expand(graph)
+            phase.count(seed=seed, inferred=derived)
+        self.inferred.update(derived)
+        if getattr(self, "vocabulary", None) is not None:
+            self.vocabulary.update(t for t in derived if is_vocabulary_triple(t))
+
+    def _has_errors(self, graph):
+        if self.engine == "native":
+            return False
+        from owlrl.Namespaces import ERRNS
+        return (None, RDF.type, ERRNS.ErrorMessage) in graph
+
+    def _recompute(self, graph):
+        self.retract(graph)
+        self.expand(graph)
@@ -0,0 +1,47 @@
+from pathlib import Path
+
+from .columnar import to_arrow, to_pandas, to_parquet
+from .jobs import add_background_argument
+from .rdf_module import RDFModule
+from .stats import stats
+
+
+class ExportModule(RDFModule):
+    def __init__(self, name, parser, logger, description, displayname):
+        super().__init__(name, parser, logger, description, displayname)
+        self.parser.add_argument(
+            "--label", "-l", default="last", help="Labelled graph or stored query result to export")
+        self.parser.add_argument(
+            "--to", "-t", choices=["pandas", "arrow", "parquet"], default="pandas", help="pandas and arrow return a DataFrame or Table, parquet writes the file given by --output")
+        self.parser.add_argument(
+            "--output", "-o", help="Parquet file to write")
+        self.parser.add_argument(
+            "--batch-size", type=int, default=100000, help="Number of rows held in memory while writing a Parquet file")
+        add_background_argument(self.parser)
+
+    def handle(self, params, store):
+        if params.label in store["rdfresults"] and store["rdfresults"][params.label] is not None:
+            obj = store["rdfresults"][params.label]
+        elif params.label in store["rdfgraphs"] and store["rdfgraphs"][params.label] is not None:
+            obj = store["rdfgraphs"][params.label]
+        else:
+            self.log(f"No graph or result labelled '{params.label}' found.")
+            return None
+        if params.to == "parquet" and params.output is None:
+            self.log("Please specify the Parquet file with --output.")
+            return None
+        try:
+            with stats.phase("export") as phase:
+                if params.to == "pandas":
+                    result = to_pandas(obj)
+                elif params.to == "arrow":
+                    result = to_arrow(obj)
+                else:
+                    result = to_parquet(obj, params.output, params.batch_size)
+                phase.count(rows=result)
+            if params.to != "parquet":
+                return result
+            self.log(f"Wrote {result} rows to '{Path(params.output).absolute()}'.")
+        except (ImportError, TypeError, ValueError) as e:
+            self.log(str(e))
+        return None
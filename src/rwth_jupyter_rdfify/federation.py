@@ -0,0 +1,160 @@
+"""One query sent to several endpoints and local graphs at once.
+
+Every target is queried in its own thread. Rows are passed to the caller through a bounded queue as soon as a target
+produces them, so the merged result is built while the slowest target is still answering. Rows are aligned by
+variable name, since targets may return the variables in a different order."""
+import queue
+import threading
+import time
+
+import rdflib
+from rdflib.plugins.sparql.algebra import translateQuery
+
+from .local_query import CancellableGraph, QueryCancelled
+from .paging import graph_formats
+from .prepared import parse_query, prepared_queries
+from .results import result_rows
+
+
+class TargetStats:
+    """Rows returned by a target, seconds until its first row and until it finished, and its error if it failed."""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.first_row = None
+        self.elapsed = None
+        self.error = None
+
+
+def is_endpoint(target):
+    return target.startswith("http://") or target.startswith("https://")
+
+
+def query_type(query):
+    """Returns SELECT, CONSTRUCT, DESCRIBE or ASK and the projected variable names, which are None if the query can
+    not be parsed locally (e.g. because it uses extensions of an endpoint)."""
+    try:
+        parsed = parse_query(query)
+    except Exception:
+        return "SELECT", None
+    kind = parsed[1].name[:-len("Query")].upper()
+    if kind != "SELECT":
+        return kind, None
+    return kind, [str(var) for var in translateQuery(parsed).algebra.PV]
+
+
+class FederatedQuery:
+    """Runs prefix + query on every target. targets maps names to local graphs or, for endpoints, to None."""
+
+    def __init__(self, targets, query, client, prefix="", fmt="xml", use_cache=True, compress=True,
+                 queue_size=10000):
+        self.targets = targets
+        self.query = query
+        self.client = client
+        self.prefix = prefix
+        self.fmt = fmt
+        self.use_cache = use_cache
+        self.compress = compress
+        self.kind, self.header = query_type(prefix + query)
+        self.stats = {name: TargetStats(name) for name in targets}
+        self.queue = queue.Queue(queue_size)
+        self.cancelled = threading.Event()
+        self.threads = []
+
+    def start(self):
+        for name, graph in self.targets.items():
+            thread = threading.Thread(target=self._run, args=(name, graph), name="rdfify-federated", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def _put(self, item):
+        while True:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self.cancelled.is_set():
+                    raise QueryCancelled()
+
+    def _run(self, name, graph):
+        stats = self.stats[name]
+        start = time.perf_counter()
+        try:
+            if graph is None:
+                response = self.client.query(name, self.prefix + self.query, self.fmt, self.use_cache, self.compress)
+                mime = response.content_type.split(";")[0].strip()
+                if self.kind in ("CONSTRUCT", "DESCRIBE"):
+                    g = rdflib.Graph()
+                    g.parse(data=response.body, format=graph_formats.get(mime, "xml"))
+                    items = iter(g)
+                else:
+                    items = result_rows(response.open(), mime)
+                    self._put(("header", name, next(items)))
+            else:
+                prepared = prepared_queries.prepare(self.query, self.prefix, dict(graph.namespaces()))
+                if not isinstance(graph, rdflib.ConjunctiveGraph):
+                    graph = CancellableGraph(graph, self.cancelled)
+                res = graph.query(prepared)
+                if res.type == "SELECT":
+                    self._put(("header", name, [str(var) for var in res.vars]))
+                    items = res
+                else:
+                    items = iter(res.graph)
+            for item in items:
+                if self.cancelled.is_set():
+                    close = getattr(items, "close", None)
+                    if close is not None:
+                        close()
+                    break
+                if stats.first_row is None:
+                    stats.first_row = time.perf_counter() - start
+                stats.rows += 1
+                self._put(("row", name, item))
+        except QueryCancelled:
+            pass
+        except Exception as e:
+            stats.error = e
+        finally:
+            stats.elapsed = time.perf_counter() - start
+            try:
+                self._put(("done", name, None))
+            except QueryCancelled:
+                pass
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def events(self):
+        """Yields the (event, target, value) tuples of all targets until every target is done."""
+        running = len(self.targets)
+        while running:
+            event = self.queue.get()
+            if event[0] == "done":
+                running -= 1
+            yield event
+
+    def rows(self, distinct=False, source=True, on_event=None):
+        """Yields the merged rows of a SELECT query, aligned to header. self.header is known once the first row is
+        yielded. With source, the name of the target is appended to every row. With distinct, rows already returned by
+        another target are left out. on_event is called with every event."""
+        positions = dict()
+        seen = set()
+        for event, name, value in self.events():
+            if on_event is not None:
+                on_event(event, name, value)
+            if event == "header":
+                if self.header is None:
+                    self.header = list(value)
+                positions[name] = [value.index(var) if var in value else None for var in self.header]
+            elif event == "row":
+                row = [value[i] if i is not None else None for i in positions[name]]
+                if distinct:
+                    key = tuple(row)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                if source:
+                    row.append(rdflib.Literal(name))
+                yield row
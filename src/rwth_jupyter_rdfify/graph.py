@@ -1,48 +1,286 @@
-from graphviz import Digraph
+from collections import Counter
+from itertools import chain, islice
+
 import rdflib
+from .compact_store import CompactStore
+from .render import RenderError, layout_engines, renderer
+from .results import result_cell_rows
+from .stats import stats
 from .util import literal_to_string, StopCellExecution
 
+stores = ["default", "compact"]
+quad_formats = ["nquads", "trig"]
+
+
+summaries = ["type", "namespace"]
+# Number of triples the summary shown when the layout of a drawing fails is built from.
+SUMMARY_TRIPLES = 100000
+
+
+def add_draw_arguments(parser):
+    """Adds the arguments controlling how large graphs are drawn."""
+    parser.add_argument(
+        "--max-nodes", type=int, default=500, help="Maximum number of nodes drawn. Further triples are left out")
+    parser.add_argument(
+        "--max-edges", type=int, default=1000, help="Maximum number of edges drawn. Further triples are left out")
+    parser.add_argument(
+        "--focus", help="Only draw the neighbourhood of this resource, given as IRI or prefixed name")
+    parser.add_argument(
+        "--depth", type=int, default=1, help="Number of steps from the --focus resource which are drawn")
+    parser.add_argument(
+        "--summarize", choices=summaries, help="Collapse all nodes with the same rdf:type or namespace into one node with a count")
+    parser.add_argument(
+        "--layout", choices=layout_engines, default="dot", help="Graphviz layout engine")
+    parser.add_argument(
+        "--draw-timeout", type=float, default=30, help="Seconds the layout may take before a summary or table is shown instead")
+    parser.add_argument(
+        "--wait", help="Compute the layout before the cell finishes instead of in the background", action="store_true")
+
+
+def draw_options(params):
+    return {"max_nodes": params.max_nodes, "max_edges": params.max_edges, "focus": params.focus,
+            "depth": params.depth, "summarize": params.summarize, "layout": params.layout,
+            "timeout": params.draw_timeout, "wait": params.wait}
+
+
+def resolve_term(g, text):
+    """Turns an IRI in angle brackets, a prefixed name or a plain IRI into a URIRef."""
+    text = text.strip()
+    if text.startswith("<") and text.endswith(">"):
+        return rdflib.URIRef(text[1:-1])
+    prefix, colon, local = text.partition(":")
+    if colon and not local.startswith("//"):
+        namespace = g.namespace_manager.store.namespace(prefix)
+        if namespace is not None:
+            return rdflib.URIRef(namespace + local)
+    return rdflib.URIRef(text)
+
+
+def neighbourhood(g, focus, depth=1):
+    """Yields the triples within depth steps of focus in either direction, nearest first. Literals are not expanded."""
+    visited = {focus}
+    frontier = [focus]
+    seen = set()
+    for _ in range(depth):
+        following = []
+        for node in frontier:
+            if isinstance(node, rdflib.term.Literal):
+                continue
+            for triple in chain(g.triples((node, None, None)), g.triples((None, None, node))):
+                if triple in seen:
+                    continue
+                seen.add(triple)
+                yield triple
+                for n in (triple[0], triple[2]):
+                    if n not in visited:
+                        visited.add(n)
+                        following.append(n)
+        frontier = following
 
-def draw_graph(g, logger, shorten_uris=True, rename_blank_nodes=True):
+
+def draw_graph(g, logger, shorten_uris=True, rename_blank_nodes=True, max_nodes=500, max_edges=1000, focus=None,
+               depth=1, summarize=None, layout="dot", timeout=30, wait=False):
+    """Draws g, or the neighbourhood of focus, until max_nodes or max_edges is reached.
+    summarize collapses the nodes of each rdf:type or namespace into one node.
+    The layout is computed in the background, see render.py."""
     ns = g.namespace_manager
+    if summarize is not None:
+        renderer.render(summary_graph(g, summarize, shorten_uris, max_nodes), logger, layout, timeout,
+                        lambda: table_fallback(g), wait)
+        return
+    if focus is not None:
+        if not isinstance(focus, rdflib.term.Node):
+            focus = resolve_term(g, focus)
+        if (focus, None, None) not in g and (None, None, focus) not in g:
+            logger.print(f"Resource {focus.n3(ns)} does not occur in the graph.")
+            return
+        triples = neighbourhood(g, focus, depth)
+    else:
+        triples = iter(g)
+
+    from graphviz import Digraph
     dot = Digraph()
+    # Every term is serialized once, when it gets its node id.
     nodes = dict()
+    predicates = dict()
     bnodes = 0
-    for i, node in enumerate(g.all_nodes()):
-        if isinstance(node, rdflib.term.URIRef):
-            if shorten_uris:
-                l = node.n3(ns)
-            else:
-                l = node.n3()
-            dot.node(str(i), label=l)
-        elif isinstance(node, rdflib.term.BNode):
-            if rename_blank_nodes:
+
+    def node_id(node):
+        nonlocal bnodes
+        i = nodes.get(node)
+        if i is None:
+            i = nodes[node] = str(len(nodes))
+            if isinstance(node, rdflib.term.BNode) and rename_blank_nodes:
                 l = f"_:bn{bnodes}"
                 bnodes += 1
             else:
-                l = node.n3()
-            dot.node(str(i), label=l)
-        elif isinstance(node, rdflib.term.Literal):
-            if shorten_uris:
-                l = node.n3(ns)
-            else:
-                l = node.n3()
-            dot.node(str(i), label=l, shape="box")
-        else:
-            continue
-        nodes[node.n3()] = str(i)
+                l = node.n3(ns) if shorten_uris else node.n3()
+            dot.node(i, label=l, shape="box" if isinstance(node, rdflib.term.Literal) else None)
+        return i
+
+    edges = 0
+    truncated = False
+    with stats.phase("build dot") as phase:
+        for s, p, o in triples:
+            if edges >= max_edges or len(nodes) + (s not in nodes) + (o not in nodes) > max_nodes:
+                truncated = True
+                break
+            l = predicates.get(p)
+            if l is None:
+                l = predicates[p] = p.n3(ns) if shorten_uris else p.n3()
+            dot.edge(node_id(s), node_id(o), label=l)
+            edges += 1
+        phase.count(nodes=len(nodes), edges=edges)
+    if truncated:
+        logger.print(f"Drawing {len(nodes)} nodes and {edges} of {len(g)} triples. Use --max-nodes and --max-edges to "
+                     f"draw more, --focus to draw the neighbourhood of a resource or --summarize to collapse nodes.")
+
+    def fallback():
+        # A summary has few nodes, so its layout is quick unless the drawing was small already. It is built from a
+        # copy of the first triples, as later cells may change g while the layout runs.
+        if len(g) <= max_nodes:
+            return table_fallback(g)
+        table = triple_table_html(g)
+        triples = list(islice(g, SUMMARY_TRIPLES))
+        namespaces = list(g.namespaces())
+
+        def summary():
+            part = rdflib.Graph()
+            for prefix, namespace in namespaces:
+                part.bind(prefix, namespace, override=True)
+            part.addN((s, p, o, part) for s, p, o in triples)
+            try:
+                svg = renderer.render_now(summary_graph(part, "type", shorten_uris, 50), layout, timeout)
+            except RenderError:
+                return table
+            of = f" of the first {len(triples)} triples" if len(triples) == SUMMARY_TRIPLES else ""
+            return f"<p>Showing a summary by rdf:type{of} instead.</p>" + svg
+
+        return summary
+
+    renderer.render(dot, logger, layout, timeout, fallback, wait)
+
+
+def table_fallback(g):
+    """Fallback of a drawing of g showing its first triples, which are taken right away."""
+    html = triple_table_html(g)
+    return lambda: html
+
+
+def triple_table_html(g, limit=20):
+    from .table import html_table
+    rows = result_cell_rows(["subject", "predicate", "object"], islice(g, limit))
+    more = f"<p>First {limit} of {len(g)} triples.</p>" if len(g) > limit else ""
+    return html_table(rows) + more
+
+
+def summary_graph(g, by="type", shorten_uris=True, max_nodes=500):
+    """Returns a Digraph with one node per rdf:type or namespace, labelled with the number of nodes it stands for,
+    and one edge per predicate between two groups, labelled with the number of triples."""
+    ns = g.namespace_manager
+    types = dict()
+    if by == "type":
+        for s, o in g.subject_objects(rdflib.RDF.type):
+            if s not in types or o < types[s]:
+                types[s] = o
+
+    def group_of(node):
+        if isinstance(node, rdflib.term.Literal):
+            return node.datatype or "literals"
+        if by == "type":
+            return types.get(node, "untyped")
+        if isinstance(node, rdflib.term.BNode):
+            return "blank nodes"
+        iri = str(node)
+        cut = max(iri.rfind("#"), iri.rfind("/"))
+        return rdflib.URIRef(iri[:cut + 1]) if cut >= 0 else "other"
+
+    groups = dict()
+    counts = Counter()
+    edges = Counter()
+
+    def group(node):
+        key = groups.get(node)
+        if key is None:
+            key = groups[node] = group_of(node)
+            counts[key] += 1
+        return key
+
     for s, p, o in g:
-        if shorten_uris:
-            l = p.n3(ns)
+        gs = group(s)
+        # The types are the groups themselves, so type triples are only counted for their subject.
+        if by == "type" and p == rdflib.RDF.type:
+            continue
+        edges[(gs, p, group(o))] += 1
+
+    # Groups beyond the budget are merged into one.
+    kept = set(key for key, _ in counts.most_common(max(max_nodes - 1, 1)))
+    if len(kept) < len(counts):
+        other = "other"
+        counts[other] = sum(n for key, n in counts.items() if key not in kept)
+        kept.add(other)
+        merged = Counter()
+        for (gs, p, go), n in edges.items():
+            merged[(gs if gs in kept else other, p, go if go in kept else other)] += n
+        edges = merged
+
+    from graphviz import Digraph
+    dot = Digraph()
+    ids = dict()
+    for key in kept:
+        ids[key] = str(len(ids))
+        if isinstance(key, rdflib.term.Node):
+            l = key.n3(ns) if shorten_uris else key.n3()
         else:
-            l = p.n3()
-        dot.edge(nodes[s.n3()], nodes[o.n3()], label=l)
-    logger.out(dot)
+            l = key
+        dot.node(ids[key], label=f"{l}\n({counts[key]})", shape="box", style="rounded")
+    predicates = dict()
+    for (gs, p, go), n in edges.items():
+        l = predicates.get(p)
+        if l is None:
+            l = predicates[p] = p.n3(ns) if shorten_uris else p.n3()
+        dot.edge(ids[gs], ids[go], label=f"{l} ({n})")
+    return dot
+
+
+def new_graph(store="default", fmt=None):
+    """Returns an empty graph backed by the given store type. Quad formats need a context aware graph."""
+    if fmt in quad_formats:
+        if store != "default":
+            raise ValueError(f"The {store} store does not support the quad format {fmt}")
+        return rdflib.ConjunctiveGraph()
+    if store == "compact":
+        return rdflib.Graph(store=CompactStore())
+    return rdflib.Graph()
+
+
+def in_memory(g):
+    """Whether g is a plain graph held in memory, not a dataset or a graph in a database."""
+    return type(g) is rdflib.Graph and (isinstance(g.store, CompactStore) or type(g.store).__name__ == "Memory")
+
+
+def copy_graph(g):
+    """Returns a copy of a graph in memory with its namespaces, source and a copy of its entailment."""
+    if not in_memory(g):
+        raise ValueError("Only graphs in memory can be copied")
+    copied = new_graph("compact" if isinstance(g.store, CompactStore) else "default")
+    for prefix, namespace in g.namespaces():
+        copied.bind(prefix, namespace, override=True)
+    copied.addN((s, p, o, copied) for s, p, o in g)
+    if hasattr(g, "source"):
+        copied.source = g.source
+    entailment = getattr(g, "entailment", None)
+    if entailment is not None:
+        copied.entailment = entailment.copy()
+    return copied
 
 
-def parse_graph(string, logger, fmt="xml"):
+def parse_graph(string, logger, fmt="xml", store="default"):
     try:
-        return rdflib.Graph().parse(data=string, format=fmt)
+        with stats.phase("parse") as phase:
+            g = new_graph(store, fmt).parse(data=string, format=fmt)
+            phase.count(characters=len(string), triples=g)
+        return g
     except Exception as err:
         logger.print(f"Could not parse {fmt} graph:<br>{str(err)}")
         raise StopCellExecution
@@ -1,7 +1,13 @@
+import html
 
-from owlrl import DeductiveClosure, RDFS_Semantics, OWLRL_Semantics
-from .graph import draw_graph
+from .entailment import engines, entail, regimes
+from .graph import add_draw_arguments, draw_graph, draw_options, new_graph, parse_graph, stores
+from .jobs import add_background_argument
+from .memory_budget import Spilled, parse_size
 from .rdf_module import RDFModule
+from .render import renderer
+from .sqlite_store import graph_labels, open_graph
+from .table import html_table
 
 
 class GraphManagerModule(RDFModule):
@@ -9,9 +15,27 @@ class GraphManagerModule(RDFModule):
     def __init__(self, name, parser, logger, description, displayname):
         super().__init__(name, parser, logger, description, displayname)
         self.parser.add_argument(
-            "action", choices=["list", "remove", "draw", "entail-rdfs", "entail-owl", "entail-rdfs+owl"], help="Action to perform")
+            "action", choices=["list", "remove", "draw", "entail-rdfs", "entail-owl", "entail-rdfs+owl", "retract", "add-triples", "remove-triples", "convert", "attach", "cancel-draw", "pin", "unpin", "budget"],
+            help="Action to perform. budget shows the estimated memory of all graphs and sources and sets the memory budget with --limit, above which the least recently used ones are spilled to disk until they are accessed again. pin keeps the graph and source labelled --label in memory, unpin allows spilling them again. cancel-draw stops the layout of the drawing given by --job or of all running drawings. attach opens all graphs of the database given by --db. convert copies a graph into the store given by --store. retract removes all inferred triples of an entailed graph. add-triples and remove-triples take the triples in Turtle notation from the cell and keep the closure of an entailed graph up to date")
         self.parser.add_argument(
             "--label", "-l", help="Reference a local graph by label")
+        self.parser.add_argument(
+            "--store", choices=stores, default="compact", help="Target store of the convert action")
+        self.parser.add_argument(
+            "--db", help="SQLite database file for the attach action")
+        self.parser.add_argument(
+            "--engine", choices=engines, default="owlrl", help="Reasoner used for entailment. The native engine evaluates the RDFS rules on integer encoded triples using numpy and only supports the RDFS regime")
+        self.parser.add_argument(
+            "--job", type=int, help="Number of the drawing stopped by the cancel-draw action")
+        self.parser.add_argument(
+            "--limit", help="Memory budget of the budget action, e.g. 512MB or 2GB. none disables spilling")
+        self.parser.add_argument(
+            "--spill-dir", help="Directory of spilled graphs and sources. Defaults to a temporary directory")
+        add_draw_arguments(self.parser)
+        add_background_argument(self.parser)
+
+    def copies_graphs(self, params):
+        return params.action.startswith("entail-") or params.action in ["retract", "add-triples", "remove-triples"]
 
     def check_label(self, label, store):
         if label is not None:
@@ -27,33 +51,144 @@ class GraphManagerModule(RDFModule):
         if params.action is not None:
             if params.action == "list":
                 labels = "The following labelled graphs are present:<br><ul>"
-                for label in store["rdfgraphs"].keys():
-                    labels += f"<li>{label}</li>"
+                for label in store["rdfgraphs"]:
+                    g = store["rdfgraphs"].peek(label)
+                    if isinstance(g, Spilled):
+                        labels += f"<li>{label} (spilled)</li>"
+                        continue
+                    entailment = getattr(g, "entailment", None)
+                    if entailment is None:
+                        labels += f"<li>{label}</li>"
+                    else:
+                        labels += f"<li>{label} (entailed: {entailment.regime})</li>"
                 self.logger.display_html(labels + "</ul>")
             elif params.action == "draw":
                 if self.check_label(params.label, store):
-                    draw_graph(store["rdfgraphs"]
-                               [params.label], self.logger)
+                    draw_graph(store["rdfgraphs"][params.label], self.logger, **draw_options(params))
+            elif params.action == "cancel-draw":
+                jobs = renderer.cancel(params.job)
+                if jobs:
+                    self.log(f"Cancelled drawing {', '.join(str(job.id) for job in jobs)}.")
+                else:
+                    self.log("No drawing is being laid out.")
             elif params.action == "remove":
                 if self.check_label(params.label, store):
                     del store["rdfgraphs"][params.label]
                     self.log(
                         f"Graph labelled '{params.label}' has been removed.")
-            elif params.action == "entail-rdfs":
+            elif params.action.startswith("entail-"):
                 if self.check_label(params.label, store):
-                    DeductiveClosure(RDFS_Semantics).expand(
-                        store["rdfgraphs"][params.label])
-                    self.log(
-                        f"Graph labelled '{params.label}' has been entailed using the RDFS regime.")
-            elif params.action == "entail-owl":
+                    self.entail(params.label, params.action[len("entail-"):], params.engine, store)
+            elif params.action == "retract":
                 if self.check_label(params.label, store):
-                    DeductiveClosure(OWLRL_Semantics).expand(
-                        store["rdfgraphs"][params.label])
-                    self.log(
-                        f"Graph labelled '{params.label}' has been entailed using the OWL-RL regime.")
-            elif params.action == "entail-rdfs+owl":
+                    g = store["rdfgraphs"][params.label]
+                    entailment = getattr(g, "entailment", None)
+                    if entailment is None:
+                        self.log(f"Graph labelled '{params.label}' has not been entailed.")
+                    else:
+                        count = len(entailment.inferred)
+                        entailment.retract(g)
+                        g.entailment = None
+                        g.commit()
+                        store["rdfgraphs"].changed(params.label)
+                        self.log(
+                            f"Retracted {count} inferred triples from graph labelled '{params.label}'.")
+            elif params.action in ["add-triples", "remove-triples"]:
                 if self.check_label(params.label, store):
-                    DeductiveClosure(OWLRL_Semantics, rdfs_closure=True).expand(
-                        store["rdfgraphs"][params.label])
-                    self.log(
-                        f"Graph labelled '{params.label}' has been entailed using the RDFS regime and then the OWL-RL regime.")
+                    self.update(params.label, params.action == "add-triples", params.cell, store)
+            elif params.action == "attach":
+                if params.db is None:
+                    self.log("Please specify the database with --db.")
+                else:
+                    labels = graph_labels(params.db)
+                    for label in labels:
+                        store["rdfgraphs"][label] = open_graph(params.db, label)
+                    self.log(f"Attached {len(labels)} graphs from '{params.db}': {', '.join(labels)}")
+            elif params.action == "convert":
+                if self.check_label(params.label, store):
+                    self.convert(params.label, params.store, store)
+            elif params.action in ["pin", "unpin"]:
+                if params.label is None:
+                    self.log("Please specify the label with parameter --label or -l.")
+                elif params.action == "pin":
+                    store["rdfgraphs"].budget.pin(params.label)
+                    self.log(f"Graph and source labelled '{params.label}' are kept in memory.")
+                else:
+                    store["rdfgraphs"].budget.unpin(params.label)
+                    self.log(f"Graph and source labelled '{params.label}' may be spilled again.")
+            elif params.action == "budget":
+                self.budget(params.limit, params.spill_dir, store)
+
+    def entail(self, label, regime, engine, store):
+        g = store["rdfgraphs"][label]
+        entailment = getattr(g, "entailment", None)
+        if entailment is not None and entailment.regime == regime:
+            self.log(
+                f"Graph labelled '{label}' is already entailed using the {regimes[regime]} and kept up to date. Use the retract action to recompute it from scratch.")
+            return
+        entail(g, regime, engine)
+        g.commit()
+        store["rdfgraphs"].changed(label)
+        self.log(
+            f"Graph labelled '{label}' has been entailed using the {regimes[regime]}.")
+
+    def convert(self, label, backend, store):
+        g = store["rdfgraphs"][label]
+        # Ends the open transaction of a graph in a database, which is replaced by the converted graph.
+        g.commit()
+        converted = new_graph(backend)
+        for prefix, namespace in g.namespaces():
+            converted.bind(prefix, namespace, override=True)
+        converted.addN((s, p, o, converted) for s, p, o in g)
+        for attr in ["source", "entailment"]:
+            if hasattr(g, attr):
+                setattr(converted, attr, getattr(g, attr))
+        for key in store["rdfgraphs"]:
+            if store["rdfgraphs"].peek(key) is g:
+                store["rdfgraphs"][key] = converted
+        self.log(f"Graph labelled '{label}' now uses the {backend} store ({len(converted)} triples).")
+
+    def budget(self, limit, spill_dir, store):
+        from .stats_module import format_bytes
+        budget = store["rdfgraphs"].budget
+        if spill_dir is not None:
+            budget.spill_dir = spill_dir
+        if limit is not None:
+            budget.limit = parse_size(limit)
+            spilled = budget.enforce()
+            if spilled:
+                kinds = "; ".join(f"{kind}s {', '.join(labels)}" for kind, labels in spilled.items())
+                self.log(f"Spilled {kinds} to disk.")
+        rows = [["kind", "labels", "estimated memory", "state"]]
+        for label_store, value, labels, _, size in budget.entries():
+            state = "spilled" if isinstance(value, Spilled) else "memory"
+            if budget.pinned.intersection(labels):
+                state += ", pinned"
+            rows.append([label_store.kind, html.escape(", ".join(labels)), format_bytes(size), state])
+        limit = "none" if budget.limit is None else format_bytes(budget.limit)
+        self.logger.display_html(
+            f"<p>Estimated memory {format_bytes(budget.usage())} of budget {limit}.</p>" + html_table(iter(rows)))
+
+    def update(self, label, add, cell, store):
+        if cell is None:
+            self.log("Please give the triples in Turtle notation as cell content.")
+            return
+        g = store["rdfgraphs"][label]
+        triples = list(parse_graph(cell, self.logger, "turtle"))
+        before = len(g)
+        entailment = getattr(g, "entailment", None)
+        if entailment is not None:
+            if add:
+                entailment.add(g, triples)
+            else:
+                entailment.remove(g, triples)
+        else:
+            for t in triples:
+                if add:
+                    g.add(t)
+                else:
+                    g.remove(t)
+        g.commit()
+        store["rdfgraphs"].changed(label)
+        suffix = "" if entailment is None else f" (including the {regimes[entailment.regime]} closure)"
+        self.log(f"Graph labelled '{label}' changed from {before} to {len(g)} triples{suffix}.")
@@ -0,0 +1,137 @@
+"""On-disk cache for downloaded RDF documents.
+
+Every cached document is stored under the hash of its URL and Accept header: the response body as it was received,
+a JSON file with the ETag and Last-Modified validators and, once the document has been parsed, a binary snapshot of the
+parsed graph. Later downloads send conditional requests, so an unchanged document costs a single round trip and is
+restored from its snapshot instead of being parsed again."""
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import requests
+
+from .cache import content_key
+
+CHUNK_SIZE = 1 << 16
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "jupyter-rdfify" / "downloads"
+
+
+class CachedDocument:
+    """A cached response body. modified is False if the server confirmed that the cached copy is still current."""
+
+    def __init__(self, cache, key, meta, modified):
+        self.cache = cache
+        self.key = key
+        self.meta = meta
+        self.modified = modified
+
+    @property
+    def path(self):
+        return self.cache.body_path(self.key)
+
+    @property
+    def sha256(self):
+        return self.meta["sha256"]
+
+    @property
+    def size(self):
+        return self.meta["size"]
+
+    def snapshot_path(self, fmt):
+        """Path of the snapshot holding this body parsed as fmt. It changes with the body, so stale snapshots are never used."""
+        return self.cache.directory / f"{self.key}-{self.sha256[:16]}-{fmt}.rdfsnap"
+
+
+class DownloadCache:
+    """Downloads documents into a cache directory, revalidating cached copies with conditional GET requests."""
+
+    def __init__(self, directory=None):
+        self.directory = None
+        self.session = None
+        self.set_directory(directory)
+
+    def set_directory(self, directory):
+        self.directory = Path(directory) if directory is not None else default_cache_dir()
+
+    def key(self, url, accept):
+        return content_key(url, accept)
+
+    def body_path(self, key):
+        return self.directory / f"{key}.body"
+
+    def _meta_path(self, key):
+        return self.directory / f"{key}.json"
+
+    def _read_meta(self, key):
+        try:
+            with open(self._meta_path(key), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not self.body_path(key).exists():
+            return None
+        return meta
+
+    def _write_meta(self, key, meta):
+        path = self._meta_path(key)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, path)
+
+    def fetch(self, url, accept, offline=False, timeout=30):
+        """Returns a CachedDocument for url. In offline mode only the cache is consulted and a missing entry raises
+        a LookupError. Network and HTTP errors are raised as requests exceptions."""
+        key = self.key(url, accept)
+        meta = self._read_meta(key)
+        if offline:
+            if meta is None:
+                raise LookupError(f"'{url}' is not in the download cache '{self.directory}'")
+            return CachedDocument(self, key, meta, False)
+
+        headers = {"Accept": accept, "Accept-Encoding": "gzip, deflate"}
+        if meta is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        if self.session is None:
+            self.session = requests.Session()
+        with self.session.get(url, headers=headers, timeout=timeout, stream=True) as response:
+            if response.status_code == 304 and meta is not None:
+                return CachedDocument(self, key, meta, False)
+            response.raise_for_status()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            meta = self._store_body(key, response)
+        meta["url"] = url
+        meta["accept"] = accept
+        meta["etag"] = response.headers.get("ETag")
+        meta["last_modified"] = response.headers.get("Last-Modified")
+        meta["content_type"] = response.headers.get("Content-Type")
+        self._write_meta(key, meta)
+        self._remove_snapshots(key, keep=meta["sha256"])
+        return CachedDocument(self, key, meta, True)
+
+    def _store_body(self, key, response):
+        """Streams the (decompressed) body to disk and returns its size and hash."""
+        path = self.body_path(key)
+        tmp = path.with_suffix(".part")
+        h = hashlib.sha256()
+        size = 0
+        with open(tmp, "wb") as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+                h.update(chunk)
+                size += len(chunk)
+        os.replace(tmp, path)
+        return {"sha256": h.hexdigest(), "size": size}
+
+    def _remove_snapshots(self, key, keep):
+        for path in self.directory.glob(f"{key}-*.rdfsnap"):
+            if not path.name.startswith(f"{key}-{keep[:16]}-"):
+                path.unlink(missing_ok=True)
@@ -0,0 +1,258 @@
+"""Incremental re-parsing of labelled Turtle cells.
+
+split_statements cuts a Turtle document into its top level statements and directives without parsing it. The
+TurtleState of a labelled graph remembers the statements of the last run of its cell together with the triples each
+of them produced. When the cell runs again with the same directives, only the statements which are new are parsed
+and the triples of the statements which disappeared are removed, unless another statement still asserts them. The
+resulting GraphDelta is applied to the graph in place, through its Entailment if it is entailed, so the closure is
+kept up to date instead of being lost. Blank node labels map to the same blank nodes in every run of the cell.
+"""
+import re
+import weakref
+from collections import Counter, defaultdict
+
+import rdflib
+from rdflib.plugins.parsers.notation3 import RDFSink, SinkParser
+
+from .graph import new_graph
+
+TOKEN = re.compile(r'"""(?:[^"\\]|\\.|"(?!""))*"""'
+                   r"|'''(?:[^'\\]|\\.|'(?!''))*'''"
+                   r'|"(?:[^"\\\n]|\\.)*"'
+                   r"|'(?:[^'\\\n]|\\.)*'"
+                   r"|<[^>\s]*>"
+                   r"|#[^\n]*"
+                   r"|[\[\]().]"
+                   r"|[^\"'<#\[\]().]+"
+                   r"|.", re.S)
+DIRECTIVE = re.compile(r"@prefix\s|@base\s|(?i:prefix|base)\s")
+
+
+def is_name_char(c):
+    return c.isalnum() or c in "_-:%\\"
+
+
+def is_directive(statement):
+    return DIRECTIVE.match(statement) is not None
+
+
+def split_statements(text):
+    """Returns the top level statements and directives of a Turtle document, each with its terminating dot. A dot
+    ends a statement outside of strings, IRIs, comments, blank node property lists and collections, unless it is
+    part of a number or prefixed name. SPARQL style PREFIX and BASE directives end with their IRI."""
+    statements = []
+    start = 0
+    depth = 0
+    first = True
+    sparql = False
+    for match in TOKEN.finditer(text):
+        token = match.group()
+        if first:
+            if token.isspace() or token[0] == "#":
+                continue
+            first = False
+            sparql = re.match(r"(?i:prefix|base)\s", token.lstrip()) is not None
+        if token[0] in "[(":
+            depth += 1
+            continue
+        if token[0] in ")]":
+            depth -= 1
+            continue
+        if sparql:
+            if token[0] != "<":
+                continue
+        elif token != "." or depth > 0:
+            continue
+        else:
+            i = match.start()
+            before = text[i - 1] if i > 0 else " "
+            after = text[i + 1] if i + 1 < len(text) else " "
+            if after.isdigit() or (is_name_char(before) and is_name_char(after)):
+                continue
+        end = match.end()
+        statements.append(text[start:end].strip())
+        start = end
+        first = True
+    rest = text[start:].strip()
+    if rest and not all(m.group().isspace() or m.group()[0] == "#" for m in TOKEN.finditer(rest)):
+        statements.append(rest)
+    return statements
+
+
+class StatementParser:
+    """Parses statements one at a time with rdflib's Turtle parser and returns the triples of each. Directives
+    affect all statements parsed after them. bnodes maps blank node labels to blank nodes and is extended."""
+
+    def __init__(self, base, bnodes):
+        self.triples = []
+        sink = RDFSink(rdflib.Graph())
+        self.parser = SinkParser(sink, baseURI=base, turtle=True)
+        self.parser._anonymousNodes = bnodes
+        self.parser.startDoc()
+        # The sink adds the triples of the document to its graph, here they are collected per statement.
+        sink.graph = self
+
+    def add(self, triple):
+        self.triples.append(triple)
+
+    def parse(self, statement):
+        self.triples = []
+        self.parser.feed(statement)
+        return tuple(self.triples)
+
+    @property
+    def bindings(self):
+        return self.parser._bindings
+
+
+class GraphDelta:
+    """Changes of a graph by a re-run of its cell. added and removed are the asserted triples, changes of the
+    closure of an entailed graph are not included."""
+
+    def __init__(self, added, removed, statements_added, statements_removed):
+        self.added = frozenset(added)
+        self.removed = frozenset(removed)
+        self.statements_added = statements_added
+        self.statements_removed = statements_removed
+
+    def __bool__(self):
+        return bool(self.added or self.removed)
+
+    def __repr__(self):
+        return (f"<GraphDelta {self.statements_added} statements added, {self.statements_removed} removed: "
+                f"+{len(self.added)} -{len(self.removed)} triples>")
+
+
+class TurtleState:
+    """Statements of the last run of a labelled Turtle cell and the triples each of them produced."""
+
+    def __init__(self, graph, base):
+        # The state does not keep the graph alive, e.g. when it is removed or spilled to disk.
+        self.ref = weakref.ref(graph)
+        self.base = base
+        self.directives = ()
+        self.bnodes = dict()
+        # (number of preceding directives, statement text) -> triples of each occurrence of the statement
+        self.entries = defaultdict(list)
+        # Triples asserted by more than one statement, with their number. All other triples are asserted once.
+        self.shared = dict()
+        self.asserted = 0
+
+    @property
+    def graph(self):
+        return self.ref()
+
+    @graph.setter
+    def graph(self, graph):
+        self.ref = weakref.ref(graph)
+
+    def is_current(self, graph):
+        """Whether graph is the graph of the state and its asserted triples were not changed by anything else."""
+        entailment = getattr(graph, "entailment", None)
+        inferred = len(entailment.inferred) if entailment is not None else 0
+        return graph is self.graph and len(graph) - inferred == self.asserted
+
+    def asserts(self, t):
+        entailment = getattr(self.graph, "entailment", None)
+        return t in self.graph and (entailment is None or t not in entailment.inferred)
+
+    def release(self, t, removed):
+        """Counts one statement less asserting t. Adds t to removed if no statement asserts it anymore."""
+        count = self.shared.get(t, 1)
+        if count > 2:
+            self.shared[t] = count - 1
+        elif count == 2:
+            del self.shared[t]
+        else:
+            removed.add(t)
+
+    def claim(self, t, added, removed):
+        """Counts one statement more asserting t. Adds t to added if no statement asserted it before."""
+        if t in removed:
+            removed.discard(t)
+        elif t in added or self.asserts(t):
+            self.shared[t] = self.shared.get(t, 1) + 1
+        else:
+            added.add(t)
+
+    def update(self, text):
+        """Applies the changes of text against the last run to the graph. Returns the GraphDelta or None if the
+        directives changed, which requires parsing the whole text. Raises the parser's errors for invalid statements,
+        leaving the graph unchanged."""
+        statements = split_statements(text)
+        directives = tuple(s for s in statements if is_directive(s))
+        if directives != self.directives:
+            return None
+        keys = []
+        preceding = 0
+        for statement in statements:
+            if is_directive(statement):
+                keys.append(None)
+                preceding += 1
+            else:
+                keys.append((preceding, statement))
+        new = Counter(key for key in keys if key is not None)
+        old = Counter({key: len(occurrences) for key, occurrences in self.entries.items()})
+        added_keys = new - old
+        removed_keys = old - new
+        if not added_keys and not removed_keys:
+            return GraphDelta((), (), 0, 0)
+
+        parser = StatementParser(self.base, self.bnodes)
+        parsed = []
+        pending = Counter(added_keys)
+        for statement, key in zip(statements, keys):
+            if key is None:
+                parser.parse(statement)
+            elif pending[key] > 0:
+                pending[key] -= 1
+                parsed.append((key, parser.parse(statement)))
+
+        added, removed = set(), set()
+        for key, count in removed_keys.items():
+            for _ in range(count):
+                for t in self.entries[key].pop():
+                    self.release(t, removed)
+            if not self.entries[key]:
+                del self.entries[key]
+        for key, triples in parsed:
+            self.entries[key].append(triples)
+            for t in triples:
+                self.claim(t, added, removed)
+
+        entailment = getattr(self.graph, "entailment", None)
+        if entailment is not None:
+            entailment.remove(self.graph, removed)
+            entailment.add(self.graph, added)
+        else:
+            for t in removed:
+                self.graph.remove(t)
+            self.graph.addN((s, p, o, self.graph) for s, p, o in added)
+        self.asserted += len(added) - len(removed)
+        return GraphDelta(added, removed, sum(added_keys.values()), sum(removed_keys.values()))
+
+
+def parse_turtle(text, store="default"):
+    """Parses a Turtle document statement by statement. Returns the graph and its TurtleState."""
+    g = new_graph(store)
+    state = TurtleState(g, g.absolutize(""))
+    parser = StatementParser(state.base, state.bnodes)
+    directives = []
+    added = set()
+    for statement in split_statements(text):
+        triples = parser.parse(statement)
+        if is_directive(statement):
+            directives.append(statement)
+            continue
+        state.entries[(len(directives), statement)].append(triples)
+        for t in triples:
+            if t in added:
+                state.shared[t] = state.shared.get(t, 1) + 1
+            else:
+                added.add(t)
+    g.addN((s, p, o, g) for s, p, o in added)
+    for prefix, namespace in parser.bindings.items():
+        g.bind(prefix, namespace)
+    state.directives = tuple(directives)
+    state.asserted = len(added)
+    return g, state
@@ -0,0 +1,333 @@
+"""Background jobs running %rdf calls in worker threads.
+
+A call with --background runs in a thread and returns its Job right away, so the notebook stays usable. The job
+writes into StagedLabels, which read through to the store of the notebook but keep all writes of the job to
+themselves. When the call finishes, its writes are applied to the store at once while holding the store lock, so
+other cells never see half of a result. A label written or changed in place by a cell or another job after the job
+started is not overwritten, i.e. the most recently started writer of a label wins. Modules which change graphs in place, like the
+graph manager, get copies of the graphs they read, which replace the originals when the job completes. Datasets and
+graphs in a database are changed in place instead. The output of the job is collected and shown in a display of the
+cell which started it, together with its status. Cancelling a job raises KeyboardInterrupt in its thread; the writes
+of cancelled and failed jobs are discarded.
+"""
+import ctypes
+import html
+import itertools
+import threading
+import time
+from collections.abc import MutableMapping
+
+from IPython.display import HTML
+
+from .stats import stats
+
+# Seconds between updates of the displays of running jobs.
+PROGRESS_INTERVAL = 1.0
+# Number of finished jobs kept for %rdf jobs.
+KEEP_FINISHED = 50
+DELETED = object()
+
+
+def add_background_argument(parser):
+    parser.add_argument(
+        "--background", help="Run in a background thread and return the job right away. The results are stored when it completes. Use %%rdf jobs to list, wait for and cancel jobs", action="store_true")
+
+
+class StagedLabels(MutableMapping):
+    """View of a LabelStore which keeps writes to itself until commit. With copies set, graphs read from the store are
+    copied, so changing them in place does not affect the store before commit."""
+
+    def __init__(self, labels, copies=False):
+        self.labels = labels
+        self.copies = copies
+        self.writes = dict()
+        # id of the original graph -> (original, copy, labels referring to the original when it was copied)
+        self.copied = dict()
+
+    @property
+    def budget(self):
+        return self.labels.budget
+
+    @property
+    def kind(self):
+        return self.labels.kind
+
+    def __getitem__(self, label):
+        if label in self.writes:
+            value = self.writes[label]
+            if value is DELETED:
+                raise KeyError(label)
+            return value
+        value = self.labels[label]
+        if not self.copies or not hasattr(value, "store"):
+            return value
+        from .graph import copy_graph, in_memory
+        if not in_memory(value):
+            # Graphs in a database and datasets are too large to copy, they are changed in place.
+            return value
+        entry = self.copied.get(id(value))
+        if entry is None:
+            with self.labels.budget.lock:
+                referring = [key for key, v in self.labels.data.items() if v is value]
+            entry = self.copied[id(value)] = (value, copy_graph(value), referring)
+        return entry[1]
+
+    def __setitem__(self, label, value):
+        self.writes[label] = value
+
+    def __delitem__(self, label):
+        if label not in self:
+            raise KeyError(label)
+        self.writes[label] = DELETED
+
+    def changed(self, label):
+        # Changed copies are applied on commit, graphs changed in place need no commit.
+        pass
+
+    def __iter__(self):
+        labels = list(self.labels)
+        labels.extend(label for label in self.writes if label not in self.labels)
+        return iter([label for label in labels if self.writes.get(label) is not DELETED])
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, label):
+        if label in self.writes:
+            return self.writes[label] is not DELETED
+        return label in self.labels
+
+    def peek(self, label):
+        if label in self.writes:
+            return self[label]
+        value = self.labels.peek(label)
+        entry = self.copied.get(id(value))
+        return value if entry is None else entry[1]
+
+    def is_spilled(self, label):
+        return label not in self.writes and self.labels.is_spilled(label)
+
+    def read(self, label):
+        if label in self.writes or id(self.labels.peek(label)) in self.copied:
+            return self[label]
+        return self.labels.read(label)
+
+    def commit(self, since):
+        """Applies the writes and copies to the store, except to labels written after the clock value since.
+        Must be called holding the lock of the budget. Returns the applied and the skipped labels."""
+        changes = dict()
+        for original, copied, referring in self.copied.values():
+            for label in referring:
+                changes[label] = copied
+        changes.update(self.writes)
+        applied, skipped = [], []
+        for label, value in changes.items():
+            if self.labels.written.get(label, -1) > since:
+                skipped.append(label)
+            elif value is DELETED:
+                if label in self.labels:
+                    del self.labels[label]
+                applied.append(label)
+            else:
+                self.labels[label] = value
+                applied.append(label)
+        return applied, skipped
+
+
+class JobOutput:
+    """Display handle of an output of a job, updating it replaces the output."""
+
+    def __init__(self, job, index):
+        self.job = job
+        self.index = index
+
+    def update(self, obj):
+        with self.job.lock:
+            self.job.outputs[self.index] = obj
+
+
+def output_html(obj):
+    if isinstance(obj, str):
+        return f"<pre>{html.escape(obj)}</pre>"
+    for method in ["_repr_html_", "_repr_svg_"]:
+        if hasattr(obj, method):
+            data = getattr(obj, method)()
+            if data:
+                return data
+    return f"<pre>{html.escape(str(getattr(obj, 'data', obj)))}</pre>"
+
+
+class Job:
+    """A %rdf call running in a background thread. value holds the return value of the call once it is done."""
+
+    def __init__(self, job_id, line, since):
+        self.id = job_id
+        self.line = line
+        self.since = since
+        self.status = "running"
+        self.started = time.monotonic()
+        self.finished = None
+        self.outputs = []
+        self.value = None
+        self.error = None
+        self.applied = []
+        self.skipped = []
+        self.thread = None
+        self.handle = None
+        self.cancelled = False
+        self.committing = False
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return not self.done.is_set()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def output(self, obj):
+        """Adds an output of the job and returns its handle."""
+        with self.lock:
+            self.outputs.append(obj)
+            return JobOutput(self, len(self.outputs) - 1)
+
+    def wait(self, timeout=None):
+        """Waits until the job is done. Returns False if it is still running after timeout seconds."""
+        return self.done.wait(timeout)
+
+    def cancel(self):
+        """Interrupts the job. Returns False if it already finished or is storing its results."""
+        with self.lock:
+            if self.done.is_set() or self.committing or self.cancelled:
+                return False
+            self.cancelled = True
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(self.thread.ident),
+                                                       ctypes.py_object(KeyboardInterrupt))
+            return True
+
+    def summary(self):
+        elapsed = f"{self.elapsed:.1f}s"
+        if self.status == "running":
+            return f"running for {elapsed}"
+        if self.status == "failed":
+            return f"failed after {elapsed}: {self.error}"
+        if self.status == "cancelled":
+            return f"cancelled after {elapsed}, nothing was stored"
+        text = f"done after {elapsed}"
+        stored = [label for label in self.applied if label != "last"]
+        if stored:
+            text += f", stored {', '.join(stored)}"
+        skipped = [label for label in self.skipped if label != "last"]
+        if skipped:
+            text += f", kept {', '.join(skipped)} which changed while the job ran"
+        return text
+
+    def html(self):
+        with self.lock:
+            outputs = list(self.outputs)
+        status = f"<p>Job {self.id} <code>%rdf {html.escape(self.line)}</code>: {html.escape(self.summary())}."
+        if self.status == "running":
+            status += f" Cancel with <code>%rdf jobs cancel --job {self.id}</code>."
+        return status + "</p>" + "".join(output_html(obj) for obj in outputs)
+
+    def refresh(self):
+        if self.handle is not None:
+            self.handle.update(HTML(self.html()))
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.status}: %rdf {self.line}>"
+
+
+class JobManager:
+    def __init__(self):
+        self.jobs = dict()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.monitor = None
+
+    def submit(self, line, call, store, logger, budget, copies=False, cell=None):
+        """Runs call(store) in a background thread on a staged view of store and returns the job. copies is passed
+        to the staged graphs. cell is the stats record of the call, which is completed when the job finishes."""
+        with budget.lock:
+            job = Job(next(self.ids), line, next(budget.clock))
+        staged = {key: StagedLabels(labels, copies and key == "rdfgraphs") for key, labels in store.items()}
+
+        def work():
+            logger.capture(job)
+            stats.local.cell = cell
+            try:
+                try:
+                    value = call(staged)
+                    with job.lock:
+                        if job.cancelled:
+                            raise KeyboardInterrupt
+                        job.committing = True
+                except KeyboardInterrupt:
+                    # Clears a pending interruption which was not delivered yet.
+                    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(threading.get_ident()), None)
+                    job.status = "cancelled"
+                    return
+                except Exception as e:
+                    job.error = str(e)
+                    job.status = "failed"
+                    return
+                with budget.lock:
+                    for labels in staged.values():
+                        applied, skipped = labels.commit(job.since)
+                        job.applied.extend(label for label in applied if label not in job.applied)
+                        job.skipped.extend(label for label in skipped if label not in job.skipped)
+                job.value = value
+                job.status = "done"
+                budget.enforce()
+            finally:
+                logger.capture(None)
+                stats.local.cell = None
+                stats.end_cell(cell)
+                job.finished = time.monotonic()
+                job.done.set()
+                job.refresh()
+
+        job.handle = logger.show(HTML(job.html()))
+        job.thread = threading.Thread(target=work, name=f"rdfify-job-{job.id}", daemon=True)
+        with self.lock:
+            self.jobs[job.id] = job
+            self.prune()
+            job.thread.start()
+            if self.monitor is None or not self.monitor.is_alive():
+                self.monitor = threading.Thread(target=self.watch, name="rdfify-jobs", daemon=True)
+                self.monitor.start()
+        return job
+
+    def watch(self):
+        """Updates the displays of running jobs until all are done."""
+        while True:
+            time.sleep(PROGRESS_INTERVAL)
+            running = self.running()
+            for job in running:
+                job.refresh()
+            if not running:
+                with self.lock:
+                    if not self.running():
+                        self.monitor = None
+                        return
+
+    def running(self):
+        return [job for job in list(self.jobs.values()) if job.running]
+
+    def prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if not job.running]
+        for job_id in finished[:max(len(finished) - KEEP_FINISHED, 0)]:
+            del self.jobs[job_id]
+
+    def select(self, job_id=None):
+        """Returns the job job_id, or all jobs if job_id is None. Raises KeyError for unknown jobs."""
+        if job_id is None:
+            return list(self.jobs.values())
+        if job_id not in self.jobs:
+            raise KeyError(f"There is no job {job_id}")
+        return [self.jobs[job_id]]
+
+
+jobs = JobManager()
@@ -0,0 +1,62 @@
+import html
+import time
+
+from .jobs import jobs
+from .rdf_module import RDFModule
+from .table import html_table
+
+
+class JobsModule(RDFModule):
+    instrumented = False
+
+    def __init__(self, name, parser, logger, description, displayname):
+        super().__init__(name, parser, logger, description, displayname)
+        self.parser.add_argument(
+            "action", nargs="?", choices=["list", "wait", "cancel"], default="list",
+            help="list shows the background jobs started with --background. wait blocks until the job given by --job or all jobs are done and shows their output, cancel interrupts them and discards their results")
+        self.parser.add_argument(
+            "--job", "-j", type=int, help="Number of the job, all jobs if omitted")
+        self.parser.add_argument(
+            "--timeout", type=float, help="Seconds after which wait gives up")
+
+    def handle(self, params, store):
+        try:
+            selected = jobs.select(params.job)
+        except KeyError as e:
+            self.log(str(e.args[0]))
+            return
+        if params.action == "wait":
+            return self.wait(selected, params.timeout)
+        elif params.action == "cancel":
+            cancelled = [job for job in selected if job.cancel()]
+            if cancelled:
+                self.log(f"Cancelled job {', '.join(str(job.id) for job in cancelled)}.")
+            else:
+                self.log("No job is running.")
+        elif not selected:
+            self.log("No background jobs were started.")
+        else:
+            rows = [["job", "call", "status"]]
+            for job in selected:
+                rows.append([job.id, f"<code>%rdf {html.escape(job.line)}</code>", html.escape(job.summary())])
+            self.logger.display_html(html_table(iter(rows)))
+
+    def wait(self, selected, timeout):
+        """Waits for the running jobs in selected and shows the output of those waited for. Interrupting the kernel
+        only stops waiting, the jobs keep running."""
+        running = [job for job in selected if job.running]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            for job in running:
+                if not job.wait(None if deadline is None else max(deadline - time.monotonic(), 0)):
+                    self.log(f"Job {job.id} is still running after {timeout:g}s.")
+                    return None
+        except KeyboardInterrupt:
+            self.log("Stopped waiting, the jobs keep running.")
+            return None
+        for job in running:
+            self.log(f"Job {job.id} {job.summary()}.")
+            for obj in job.outputs:
+                self.logger.out(obj, _print=isinstance(obj, str))
+        if len(selected) == 1:
+            return selected[0].value
@@ -1,9 +1,12 @@
 from IPython.core.magic import (
     Magics, magics_class, line_cell_magic, needs_local_scope)
+from importlib import import_module
 from shlex import split
 
 from .rdf_module import RDFModule
 from .log import RDFLogger
+from .memory_budget import LabelStore, MemoryBudget
+from .stats import stats
 from .util import MagicParser
 
 
@@ -21,28 +24,73 @@ class JupyterRDF(Magics):
             "--return-store", "-r", help="Returns a copy of all present elements (graphs, schemas, etc.)", action="store_true")
         self.subparsers = self.parser.add_subparsers(help="RDF modules")
         self.submodules = list()
+        # Modules registered by import path which have not been imported yet, by subcommand.
+        self.lazy_modules = dict()
         self.logger = RDFLogger()
 
+        # Graphs and sources may be spilled to disk by the budget, see %rdf graph budget.
+        self.budget = MemoryBudget()
         self.store = {
-            "rdfgraphs": dict(),
-            "rdfsources": dict(),
-            "rdfresults": dict(),
-            "rdfshapes": dict()
+            "rdfgraphs": LabelStore(self.budget, "graph"),
+            "rdfsources": LabelStore(self.budget, "source"),
+            "rdfresults": LabelStore(self.budget, "result", spill=False),
+            "rdfshapes": LabelStore(self.budget, "shape", spill=False)
         }
 
     def register_module(self, module_class, name, description="", displayname=None):
+        """Registers an RDFModule subclass as subcommand. module_class may also be given as "module:Class" import path,
+        relative to this package if it starts with a dot. Such modules are imported when their subcommand is used
+        first, so registering them costs nothing."""
+        if isinstance(module_class, str):
+            self.lazy_modules[name.lower()] = (module_class, name, description, displayname)
+            return
         assert issubclass(module_class, RDFModule)
         self.submodules.append(module_class(
             name, self.subparsers, self.logger, description, displayname))
 
+    def load_module(self, subcommand):
+        path, name, description, displayname = self.lazy_modules.pop(subcommand)
+        module, class_name = path.split(":")
+        self.register_module(getattr(import_module(module, __package__), class_name), name, description, displayname)
+
+    def load_modules_for(self, args):
+        """Imports the lazily registered module of the subcommand in args. All modules are imported if the help or an
+        unknown subcommand is requested, so that the parser can list them."""
+        for arg in args:
+            if arg in ["-h", "--help"]:
+                break
+            if not arg.startswith("-"):
+                if arg in self.lazy_modules:
+                    self.load_module(arg)
+                    return
+                if arg in self.subparsers.choices:
+                    return
+                break
+        else:
+            return
+        for subcommand in list(self.lazy_modules):
+            self.load_module(subcommand)
+
     @line_cell_magic
     def rdf(self, line, cell=None):
         try:
-            args = self.parser.parse_args(split(line))
+            argv = split(line)
+            self.load_modules_for(argv)
+            args = self.parser.parse_args(argv)
             self.logger.set_verbose(args.verbose)
             if args.return_store:
                 return self.store
             args.cell = cell
-            return args.func(args, self.store)
+            module = getattr(args.func, "__self__", None)
+            cell_stats = stats.begin_cell(line) if getattr(module, "instrumented", False) else None
+            if getattr(args, "background", False):
+                from .jobs import jobs
+                return jobs.submit(line, lambda store: args.func(args, store), self.store, self.logger, self.budget,
+                                   module.copies_graphs(args), cell_stats)
+            try:
+                return args.func(args, self.store)
+            finally:
+                stats.end_cell(cell_stats)
+                self.budget.enforce()
         except Exception as e:
             self.logger.print(str(e))
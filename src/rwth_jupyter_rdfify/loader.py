@@ -0,0 +1,225 @@
+import bz2
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import re
+import time
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
+from itertools import islice
+from pathlib import Path
+
+from rdflib import ConjunctiveGraph, URIRef
+from rdflib.util import guess_format
+
+from .graph import new_graph
+
+decompressors = {
+    ".gz": gzip.GzipFile,
+    ".bz2": bz2.BZ2File,
+    ".xz": lzma.LZMAFile,
+}
+# Formats with one statement per line which can be split into batches at any line break.
+line_formats = ["nt", "nquads"]
+
+SourceReference = namedtuple("SourceReference", ["path", "size", "sha256", "format"])
+# Result of parsing one file in a worker. quads holds four term indexes per statement, the last one is -1 for
+# statements in the default graph.
+ParsedFile = namedtuple("ParsedFile", ["path", "terms", "quads", "seconds", "source"])
+
+
+class HashingReader(io.RawIOBase):
+    """Raw reader which hashes and counts every byte read from the underlying file."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.hash = hashlib.sha256()
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.raw.readinto(buffer)
+        if n:
+            self.hash.update(memoryview(buffer)[:n])
+            self.bytes_read += n
+        return n
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+def open_binary(path, reader):
+    """Opens the file behind reader as a binary stream, transparently decompressing .gz, .bz2 and .xz files."""
+    decompressor = decompressors.get(Path(path).suffix.lower())
+    if decompressor is not None:
+        return decompressor(fileobj=io.BufferedReader(reader), mode="rb")
+    return io.BufferedReader(reader)
+
+
+def strip_compression_suffix(path):
+    path = Path(path)
+    if path.suffix.lower() in decompressors:
+        return path.with_suffix("")
+    return path
+
+
+def stream_load(path, fmt, graph=None, batch_size=50000, progress=None):
+    """Loads the file at path into graph without holding its text in memory.
+    Line based formats are parsed in batches of batch_size lines, other formats are parsed directly from the stream.
+    progress is called with (bytes read, total bytes) after every batch.
+    Returns the graph and a SourceReference describing the file."""
+    path = Path(path)
+    if graph is None:
+        graph = new_graph(fmt=fmt)
+    size = path.stat().st_size
+    reader = HashingReader(open(path, "rb"))
+    with reader, open_binary(path, reader) as stream:
+        if fmt in line_formats:
+            text = io.TextIOWrapper(stream, encoding="utf-8")
+            # Blank node labels are scoped to the whole file, not to the batch.
+            bnode_context = dict()
+            while True:
+                batch = "".join(islice(text, batch_size))
+                if not batch:
+                    break
+                graph.parse(data=batch, format=fmt, bnode_context=bnode_context)
+                if progress is not None:
+                    progress(reader.bytes_read, size)
+        else:
+            graph.parse(source=stream, format=fmt)
+            if progress is not None:
+                progress(reader.bytes_read, size)
+        # Consume whatever the decompressor or parser did not need so the hash covers the whole file.
+        while reader.read(1 << 20):
+            pass
+    return graph, SourceReference(str(path.absolute()), size, reader.hash.hexdigest(), fmt)
+
+
+def is_pattern(path):
+    return re.search(r"[*?[]", str(path)) is not None
+
+
+def expand_paths(pattern):
+    """Returns the sorted files matched by a glob pattern, all RDF files in a directory or the file itself."""
+    path = Path(pattern)
+    if path.is_dir():
+        return sorted(p for p in path.iterdir()
+                      if p.is_file() and not p.name.startswith(".") and guess_file_format(p) is not None)
+    if is_pattern(pattern):
+        return sorted(Path(p) for p in glob(str(pattern), recursive=True) if Path(p).is_file())
+    return [path]
+
+
+def pattern_label(pattern):
+    """Name of the innermost directory of a glob pattern or directory, used as default label."""
+    path = Path(pattern)
+    while is_pattern(path):
+        path = path.parent
+    return path.name or "loaded"
+
+
+def guess_file_format(path, default=None):
+    """Guesses the RDF format from the file extension, ignoring compression suffixes."""
+    return guess_format(str(strip_compression_suffix(path))) or default
+
+
+def parse_file(path, fmt, batch_size=50000):
+    """Parses one file and returns it dictionary encoded as ParsedFile. Runs in worker processes."""
+    start = time.perf_counter()
+    g, source = stream_load(path, fmt, batch_size=batch_size)
+    ids = dict()
+    terms = []
+
+    def encode(term):
+        i = ids.get(term)
+        if i is None:
+            i = ids[term] = len(terms)
+            terms.append(term)
+        return i
+
+    quads = array("q")
+    if isinstance(g, ConjunctiveGraph):
+        default = g.default_context.identifier
+        for s, p, o, c in g.quads((None, None, None)):
+            c = c.identifier if c is not None else default
+            quads.extend((encode(s), encode(p), encode(o), -1 if c == default else encode(c)))
+    else:
+        for s, p, o in g:
+            quads.extend((encode(s), encode(p), encode(o), -1))
+    return ParsedFile(str(path), terms, quads, time.perf_counter() - start, source)
+
+
+def parallel_parse(paths, default_fmt, workers=None, batch_size=50000):
+    """Parses all files in a process pool and yields ParsedFile results as they complete.
+    A single file or workers=1 is parsed in the current process."""
+    jobs = [(path, guess_file_format(path, default_fmt), batch_size) for path in paths]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        for job in jobs:
+            try:
+                yield parse_file(*job)
+            except Exception as e:
+                raise ValueError(f"Could not parse '{job[0]}': {e}") from e
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(parse_file, *job): job[0] for job in jobs}
+        try:
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except Exception as e:
+                    raise ValueError(f"Could not parse '{futures[future]}': {e}") from e
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def insert_parsed(target, parsed, named_graph=False):
+    """Adds a parsed file to target. Statements of its default graph go into the default graph of target or,
+    with named_graph, into a graph named after the file. Named graphs of quad files are kept."""
+    terms, quads = parsed.terms, parsed.quads
+    rows = zip(quads[0::4], quads[1::4], quads[2::4], quads[3::4])
+    if not isinstance(target, ConjunctiveGraph):
+        target.addN((terms[s], terms[p], terms[o], target) for s, p, o, _ in rows)
+        return
+    default = target.get_context(URIRef(Path(parsed.path).absolute().as_uri())) if named_graph \
+        else target.default_context
+    contexts = dict()
+
+    def context(c):
+        if c < 0:
+            return default
+        if c not in contexts:
+            contexts[c] = target.get_context(terms[c])
+        return contexts[c]
+
+    target.addN((terms[s], terms[p], terms[o], context(c)) for s, p, o, c in rows)
+
+
+class EncodedMerge:
+    """Collects the triples of parsed files under one term dictionary, for bulk loading into an empty compact store."""
+
+    def __init__(self):
+        self.ids = dict()
+        self.terms = []
+        self.triples = set()
+
+    def add(self, parsed):
+        ids, terms = self.ids, self.terms
+        mapping = []
+        for term in parsed.terms:
+            i = ids.get(term)
+            if i is None:
+                i = ids[term] = len(terms)
+                terms.append(term)
+            mapping.append(i)
+        quads = parsed.quads
+        self.triples.update(zip(map(mapping.__getitem__, quads[0::4]), map(mapping.__getitem__, quads[1::4]),
+                                map(mapping.__getitem__, quads[2::4])))
@@ -0,0 +1,102 @@
+"""Evaluation of local SPARQL queries in a worker thread.
+
+The query reads the graph through a view which checks a cancellation flag whenever rdflib asks for triples, so a
+runaway query (e.g. an accidental cross product) stops soon after it is cancelled or its time limit is reached, even
+if it has not produced a row yet. SELECT rows are collected while rdflib yields them, so the rows found so far can be
+shown while the query runs and are kept when it is stopped early."""
+import threading
+import time
+
+import rdflib
+from rdflib.query import Result
+
+from .prepared import QueryTimings, prepared_queries
+
+# Number of triples read from one pattern between two checks of the cancellation flag.
+CHECK_INTERVAL = 4096
+
+
+class QueryCancelled(Exception):
+    pass
+
+
+class CancellableGraph(rdflib.Graph):
+    """View of graph which raises QueryCancelled from triples() once cancelled is set."""
+
+    def __init__(self, graph, cancelled):
+        super().__init__(store=graph.store, identifier=graph.identifier, namespace_manager=graph.namespace_manager)
+        self.cancelled = cancelled
+
+    def triples(self, triple):
+        if self.cancelled.is_set():
+            raise QueryCancelled()
+        for i, t in enumerate(super().triples(triple)):
+            if i % CHECK_INTERVAL == 0 and self.cancelled.is_set():
+                raise QueryCancelled()
+            yield t
+
+
+class LocalQuery:
+    """Evaluates prefix + query on graph in a worker thread. SELECT queries stop after max_rows rows."""
+
+    def __init__(self, graph, query, prefix="", max_rows=None):
+        self.graph = graph
+        self.query = query
+        self.prefix = prefix
+        self.max_rows = max_rows
+        self.timings = QueryTimings()
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self.result = None
+        self.rows = []
+        self.truncated = False
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="rdfify-query", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        start = None
+        try:
+            prepared = prepared_queries.prepare(self.query, self.prefix, dict(self.graph.namespaces()), self.timings)
+            start = time.perf_counter()
+            # Datasets answer queries over the union of their graphs, which a plain view can not do.
+            graph = self.graph
+            if not isinstance(graph, rdflib.ConjunctiveGraph):
+                graph = CancellableGraph(graph, self.cancelled)
+            self.result = graph.query(prepared)
+            if self.result.type == "SELECT":
+                for row in self.result:
+                    if self.cancelled.is_set():
+                        break
+                    self.rows.append(row)
+                    if self.max_rows is not None and len(self.rows) >= self.max_rows:
+                        self.truncated = True
+                        break
+        except QueryCancelled:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            if start is not None:
+                self.timings.evaluate = time.perf_counter() - start
+            self.done.set()
+
+    def wait(self, timeout=None):
+        """Waits until the query finished or timeout seconds passed. Returns whether it finished."""
+        return self.done.wait(timeout)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def partial(self):
+        """Returns the result, which for SELECT queries only holds the rows found until the query stopped."""
+        if self.result is None or self.result.type != "SELECT":
+            return self.result
+        res = Result("SELECT")
+        res.vars = self.result.vars
+        res.bindings = [{var: value for var, value in zip(res.vars, row) if value is not None}
+                        for row in self.rows[:]]
+        return res
@@ -1,25 +1,49 @@
-from IPython.display import display, HTML
+import threading
+
+from IPython.display import display, HTML, Pretty
 
 
 class RDFLogger:
 
     def __init__(self):
         self.verbose = False
+        # Output of a background job running in a thread goes to the job instead of the notebook, see capture.
+        self.local = threading.local()
 
     def set_verbose(self, verbose=True):
         self.verbose = verbose
 
+    def capture(self, job):
+        """Routes the output of the calling thread to job, or back to the notebook if job is None."""
+        self.local.job = job
+
     def print(self, msg, verbose=False):
         self.out(msg, verbose, True)
 
     def display_html(self, html):
         self.out(HTML(html))
 
+    def progress(self, msg, handle=None):
+        """Displays a status line. Passing the returned handle again updates the line in place."""
+        return self.show(Pretty(msg), handle)
+
+    def show(self, obj, handle=None):
+        """Displays obj. Passing the returned handle again replaces the displayed object, also from another thread."""
+        if handle is None:
+            job = getattr(self.local, "job", None)
+            if job is not None:
+                return job.output(obj)
+            return display(obj, display_id=True)
+        handle.update(obj)
+        return handle
+
     def out(self, msg, verbose=False, _print=False):
         if verbose and not self.verbose:
             return
+        job = getattr(self.local, "job", None)
+        if job is not None:
+            job.output(msg)
+        elif _print:
+            print(msg)
         else:
-            if _print:
-                print(msg)
-            else:
-                display(msg)
+            display(msg)
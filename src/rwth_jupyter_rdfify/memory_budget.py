@@ -0,0 +1,262 @@
+"""Memory budget for the labelled graphs and sources of the store.
+
+The graphs and sources of the store are kept in LabelStore mappings, which remember when each label was last used.
+After every %rdf call, and before a spilled entry is loaded again, the budget estimates the memory of all entries and
+writes the least recently used ones to a spill directory until the total fits into the limit. Graphs are written as
+binary snapshots, sources as text files. A spilled entry is replaced by a placeholder and loaded again on the next
+access through the mapping, so modules do not notice the difference. Labels referring to the same graph, like "last",
+share one estimate and are spilled and reloaded together. Pinned labels and the most recently used entry are never
+spilled.
+"""
+import itertools
+import pickle
+import re
+import sys
+import tempfile
+import threading
+from collections.abc import MutableMapping
+from pathlib import Path
+
+from .stats import estimate_graph_memory
+
+SIZE_UNITS = {"": 1, "B": 1, "K": 2 ** 10, "KB": 2 ** 10, "M": 2 ** 20, "MB": 2 ** 20, "G": 2 ** 30, "GB": 2 ** 30}
+
+
+def parse_size(text):
+    """Parses sizes like 512MB, 2G or 1000000. Returns None for "none"."""
+    if text.strip().lower() == "none":
+        return None
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMG]?B?)\s*", text.upper())
+    if match is None:
+        raise ValueError(f"Invalid size '{text}', use e.g. 512MB or 2GB")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+class Spilled:
+    """Placeholder of an entry written to the spill directory. size is its estimate when it was spilled."""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+
+class SpilledGraph(Spilled):
+    def __init__(self, path, size, graph):
+        super().__init__(path, size)
+        from .compact_store import CompactStore
+        from .snapshot import save_snapshot
+        self.backend = "compact" if isinstance(graph.store, CompactStore) else "default"
+        # The source is a small function, it stays in memory. The entailment holds the inferred triples.
+        self.source = getattr(graph, "source", None)
+        entailment = getattr(graph, "entailment", None)
+        save_snapshot(path, {"graph": graph})
+        self.entailment_path = None
+        if entailment is not None:
+            self.entailment_path = path.with_suffix(".entailment")
+            with open(self.entailment_path, "wb") as f:
+                pickle.dump(entailment, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def read(self):
+        """Returns the triples and namespaces of the spilled graph as new graph, leaving the spilled files in place."""
+        from .snapshot import load_snapshot
+        return load_snapshot(self.path, self.backend, verify=False)["graph"]
+
+    def load(self):
+        g = self.read()
+        if self.source is not None:
+            g.source = self.source
+        if self.entailment_path is not None:
+            with open(self.entailment_path, "rb") as f:
+                g.entailment = pickle.load(f)
+            self.entailment_path.unlink()
+        self.path.unlink()
+        return g
+
+
+class SpilledSource(Spilled):
+    def __init__(self, path, size, text):
+        super().__init__(path, size)
+        path.write_text(text, encoding="utf-8")
+
+    def load(self):
+        text = self.path.read_text(encoding="utf-8")
+        self.path.unlink()
+        return text
+
+
+def can_spill(value):
+    """Plain graphs in memory and strings can be spilled. Datasets and graphs in a database can not."""
+    if isinstance(value, str):
+        return True
+    import rdflib
+    from .compact_store import CompactStore
+    return (type(value) is rdflib.Graph and
+            (isinstance(value.store, CompactStore) or type(value.store).__name__ == "Memory"))
+
+
+def estimate(value):
+    if isinstance(value, str):
+        return sys.getsizeof(value)
+    return estimate_graph_memory(value) if hasattr(value, "store") else 0
+
+
+class LabelStore(MutableMapping):
+    """Mapping of labels to graphs or sources which loads spilled entries again when they are accessed. With spill
+    unset, the entries are never spilled, but reads and writes are still ordered by the lock of the budget."""
+
+    def __init__(self, budget, kind, spill=True):
+        self.budget = budget
+        self.kind = kind
+        self.data = dict()
+        self.used = dict()
+        # Clock value of the last write of each label, background jobs do not overwrite labels written after they started.
+        self.written = dict()
+        if spill:
+            budget.stores.append(self)
+
+    def __getitem__(self, label):
+        with self.budget.lock:
+            value = self.data[label]
+            self.used[label] = next(self.budget.clock)
+            if isinstance(value, Spilled):
+                value = self.budget.reload(self, value)
+            return value
+
+    def __setitem__(self, label, value):
+        with self.budget.lock:
+            self.data[label] = value
+            self.used[label] = self.written[label] = next(self.budget.clock)
+
+    def changed(self, label):
+        """Records that the graph of label was changed in place as a write of all labels referring to it, so
+        background jobs which started before do not overwrite the change."""
+        with self.budget.lock:
+            value = self.data[label]
+            clock = next(self.budget.clock)
+            for key, v in self.data.items():
+                if v is value:
+                    self.written[key] = clock
+
+    def __delitem__(self, label):
+        with self.budget.lock:
+            value = self.data.pop(label)
+            self.used.pop(label, None)
+            self.written[label] = next(self.budget.clock)
+            if isinstance(value, Spilled) and not any(v is value for v in self.data.values()):
+                value.path.unlink(missing_ok=True)
+
+    def __iter__(self):
+        return iter(list(self.data))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, label):
+        return label in self.data
+
+    def peek(self, label):
+        """Returns the entry of label without loading it, i.e. a Spilled placeholder if it is spilled."""
+        return self.data[label]
+
+    def is_spilled(self, label):
+        return isinstance(self.data.get(label), Spilled)
+
+    def read(self, label):
+        """Returns the entry of label like __getitem__, but a spilled graph is read from the spill directory without
+        being loaded back, so reading many spilled graphs one after the other stays within the budget."""
+        with self.budget.lock:
+            value = self.data[label]
+            if isinstance(value, SpilledGraph):
+                return value.read()
+        return self[label]
+
+
+class MemoryBudget:
+    """Keeps the estimated memory of the entries of all LabelStores below limit bytes. Without a limit, nothing is
+    spilled."""
+
+    def __init__(self, limit=None, spill_dir=None):
+        self.limit = limit
+        self.spill_dir = spill_dir
+        self.temporary = None
+        self.pinned = set()
+        self.stores = []
+        self.clock = itertools.count()
+        self.ids = itertools.count()
+        self.lock = threading.RLock()
+
+    def directory(self):
+        if self.spill_dir is None:
+            if self.temporary is None:
+                self.temporary = tempfile.TemporaryDirectory(prefix="rdfify-spill-")
+            return Path(self.temporary.name)
+        path = Path(self.spill_dir)
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def entries(self):
+        """Returns one entry per distinct value of every store: (store, value, labels, last use, size)."""
+        entries = []
+        for store in self.stores:
+            groups = dict()
+            for label, value in store.data.items():
+                if value is None:
+                    continue
+                group = groups.setdefault(id(value), [value, [], -1])
+                group[1].append(label)
+                group[2] = max(group[2], store.used.get(label, -1))
+            for value, labels, used in groups.values():
+                size = value.size if isinstance(value, Spilled) else estimate(value)
+                entries.append((store, value, labels, used, size))
+        return entries
+
+    def usage(self):
+        """Estimated bytes held in memory by the entries which are not spilled."""
+        with self.lock:
+            return sum(size for _, value, _, _, size in self.entries() if not isinstance(value, Spilled))
+
+    def enforce(self, extra=0):
+        """Spills the least recently used entries until the entries in memory plus extra bytes fit into the limit.
+        Returns the labels of the spilled entries by kind of store, e.g. {"graph": ["a", "b"]}."""
+        if self.limit is None:
+            return dict()
+        with self.lock:
+            entries = [entry for entry in self.entries() if not isinstance(entry[1], Spilled)]
+            total = sum(entry[4] for entry in entries) + extra
+            if total <= self.limit:
+                return dict()
+            newest = max(entry[3] for entry in entries) if entries else None
+            spilled = dict()
+            for store, value, labels, used, size in sorted(entries, key=lambda entry: entry[3]):
+                if total <= self.limit:
+                    break
+                if used == newest or self.pinned.intersection(labels) or not can_spill(value) or size == 0:
+                    continue
+                self.spill(store, value, labels, size)
+                total -= size
+                spilled.setdefault(store.kind, []).extend(labels)
+            return spilled
+
+    def spill(self, store, value, labels, size):
+        path = self.directory() / f"{store.kind}-{next(self.ids)}"
+        if isinstance(value, str):
+            placeholder = SpilledSource(path.with_suffix(".txt"), size, value)
+        else:
+            placeholder = SpilledGraph(path.with_suffix(".rdfsnap"), size, value)
+        for label in labels:
+            store.data[label] = placeholder
+
+    def reload(self, store, placeholder):
+        """Loads a spilled entry back into all labels of store referring to it, first making room for it."""
+        self.enforce(placeholder.size)
+        value = placeholder.load()
+        for label, v in store.data.items():
+            if v is placeholder:
+                store.data[label] = value
+        return value
+
+    def pin(self, label):
+        self.pinned.add(label)
+
+    def unpin(self, label):
+        self.pinned.discard(label)
@@ -0,0 +1,177 @@
+"""RDFS closure on dictionary encoded triples.
+
+Terms are mapped to integer ids and the RDFS rules are evaluated as vectorized joins over NumPy arrays until a
+fixpoint is reached. The result is exactly the closure computed by owlrl's RDFS_Semantics with its default settings
+(no axiomatic and no datatype axiomatic triples), but only the new triples are written back into the graph."""
+from collections import defaultdict
+
+from rdflib import Literal
+from rdflib.namespace import RDF, RDFS
+
+
+class TermDictionary:
+    """Bidirectional mapping between rdflib terms and consecutive integer ids."""
+
+    def __init__(self):
+        self.ids = dict()
+        self.terms = list()
+
+    def encode(self, term):
+        i = self.ids.get(term)
+        if i is None:
+            i = len(self.terms)
+            self.ids[term] = i
+            self.terms.append(term)
+        return i
+
+    def decode(self, i):
+        return self.terms[i]
+
+    def __len__(self):
+        return len(self.terms)
+
+
+def literal_equivalents(graph):
+    """owlrl's one time rule: for literals with equal values, (s p lt1) entails (s p lt2).
+    Literals are grouped by value instead of comparing all pairs."""
+    literals = set(o for o in graph.objects() if isinstance(o, Literal))
+    groups = defaultdict(list)
+    unhashable = []
+    for lt in literals:
+        if lt.value is None:
+            continue
+        try:
+            groups[lt.value].append(lt)
+        except TypeError:
+            unhashable.append(lt)
+    for lt1 in unhashable:
+        same = [lt2 for lt2 in unhashable if lt1.value == lt2.value]
+        if len(same) > 1:
+            groups[id(lt1)] = same
+    added = []
+    for same in groups.values():
+        if len(same) < 2:
+            continue
+        for lt1 in same:
+            for s, p, _ in graph.triples((None, None, lt1)):
+                for lt2 in same:
+                    if lt2 is not lt1:
+                        added.append((s, p, lt2))
+    return added
+
+
+def join(np, left, right):
+    """Returns index arrays (i, j) with left[i] == right[j] for all matching pairs."""
+    order = np.argsort(right, kind="stable")
+    sorted_right = right[order]
+    start = np.searchsorted(sorted_right, left, side="left")
+    end = np.searchsorted(sorted_right, left, side="right")
+    counts = end - start
+    i = np.repeat(np.arange(len(left)), counts)
+    # Position of every match inside its run of equal keys in sorted_right.
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    j = order[np.repeat(start, counts) + offsets]
+    return i, j
+
+
+class TripleSet:
+    """Deduplicated set of encoded triples, packed into single integers for fast membership tests."""
+
+    def __init__(self, np, n_terms):
+        self.np = np
+        self.base = n_terms
+        self.keys = np.empty(0, dtype=object if n_terms ** 3 >= 2 ** 63 else np.int64)
+        self.triples = np.empty((0, 3), dtype=np.int64)
+
+    def pack(self, triples):
+        t = triples.astype(self.keys.dtype)
+        return (t[:, 0] * self.base + t[:, 1]) * self.base + t[:, 2]
+
+    def add(self, triples):
+        """Adds triples and returns the ones which were not yet present."""
+        np = self.np
+        if len(triples) == 0:
+            return triples
+        keys, first = np.unique(self.pack(triples), return_index=True)
+        new = ~np.isin(keys, self.keys, assume_unique=True)
+        keys, triples = keys[new], triples[first[new]]
+        self.keys = np.union1d(self.keys, keys)
+        self.triples = np.concatenate([self.triples, triples])
+        return triples
+
+
+def rdfs_closure(graph):
+    """Expands graph in-place to its RDFS closure and returns the number of added triples."""
+    try:
+        import numpy as np
+    except ImportError:
+        raise ImportError("The native engine requires numpy. Install it with 'pip install numpy'.")
+
+    asserted = len(graph)
+    for t in literal_equivalents(graph):
+        graph.add(t)
+
+    terms = TermDictionary()
+    TYPE, SCO, SPO, DOM, RNG = (terms.encode(t) for t in [
+        RDF.type, RDFS.subClassOf, RDFS.subPropertyOf, RDFS.domain, RDFS.range])
+    PROPERTY, CLASS, RESOURCE, CMP, MEMBER, DATATYPE, LITERAL = (terms.encode(t) for t in [
+        RDF.Property, RDFS.Class, RDFS.Resource, RDFS.ContainerMembershipProperty, RDFS.member,
+        RDFS.Datatype, RDFS.Literal])
+    encoded = np.array([(terms.encode(s), terms.encode(p), terms.encode(o)) for s, p, o in graph],
+                       dtype=np.int64).reshape(-1, 3)
+    is_literal = np.array([isinstance(t, Literal) for t in terms.terms], dtype=bool)
+
+    closure = TripleSet(np, len(terms))
+    closure.add(encoded)
+
+    def const(value, n):
+        return np.full(n, value, dtype=np.int64)
+
+    def triples(s, p, o):
+        return np.stack([s, p, o], axis=1)
+
+    def unary(delta):
+        """Rules with a single premise: rdf1, rdfs6, rdfs8, rdfs10, rdfs12 and the datatype rule."""
+        s, p, o = delta[:, 0], delta[:, 1], delta[:, 2]
+        out = [triples(p, const(TYPE, len(p)), const(PROPERTY, len(p)))]
+        typed = p == TYPE
+        for cls, pred, obj in [(PROPERTY, SPO, None), (CLASS, SCO, RESOURCE), (CLASS, SCO, None),
+                               (CMP, SPO, MEMBER), (DATATYPE, SCO, LITERAL)]:
+            x = s[typed & (o == cls)]
+            out.append(triples(x, const(pred, len(x)), x if obj is None else const(obj, len(x))))
+        return out
+
+    def binary(a, b):
+        """Rules with two premises, first premise from a and second from b: rdfs2, 3, 5, 7, 9 and 11."""
+        out = []
+        for pred in [DOM, RNG]:
+            schema = a[a[:, 1] == pred]
+            i, j = join(np, schema[:, 0], b[:, 1])
+            target = b[j, 0] if pred == DOM else b[j, 2]
+            out.append(triples(target, const(TYPE, len(i)), schema[i, 2]))
+        for pred in [SPO, SCO]:
+            left, right = a[a[:, 1] == pred], b[b[:, 1] == pred]
+            i, j = join(np, left[:, 2], right[:, 0])
+            out.append(triples(left[i, 0], const(pred, len(i)), right[j, 2]))
+        sub = a[a[:, 1] == SPO]
+        i, j = join(np, sub[:, 0], b[:, 1])
+        out.append(triples(b[j, 0], sub[i, 2], b[j, 2]))
+        sub = a[a[:, 1] == SCO]
+        typed = b[b[:, 1] == TYPE]
+        i, j = join(np, sub[:, 0], typed[:, 2])
+        out.append(triples(typed[j, 0], const(TYPE, len(i)), sub[i, 2]))
+        return out
+
+    # rdfs4a and rdfs4b are only applied to the triples present before the first cycle.
+    nodes = np.unique(np.concatenate([encoded[:, 0], encoded[:, 2]]))
+    delta = closure.add(triples(nodes, const(TYPE, len(nodes)), const(RESOURCE, len(nodes))))
+    delta = np.concatenate([encoded, delta])
+    while len(delta):
+        derived = np.concatenate(unary(delta) + binary(delta, closure.triples) + binary(closure.triples, delta))
+        # Literals can not be predicates.
+        derived = derived[~is_literal[derived[:, 1]]]
+        delta = closure.add(derived)
+
+    new = closure.triples[len(encoded):]
+    graph.addN((terms.decode(s), terms.decode(p), terms.decode(o), graph) for s, p, o in new.tolist())
+    return len(graph) - asserted
@@ -0,0 +1,217 @@
+"""Paged extraction of large results from remote endpoints.
+
+Many public endpoints cut results off after a fixed number of rows. A paged query is sent as a series of queries
+which are ordered by all of their variables and select one window with LIMIT and OFFSET each. CONSTRUCT queries select
+the window of solutions in a subquery. A few pages are fetched concurrently, failed requests are retried with
+exponential backoff and pages are handed on in order, so only the pages in flight are held in memory. The result ends
+with the first empty page."""
+import random
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import rdflib
+import requests
+from rdflib.plugins.sparql.algebra import translateQuery
+
+from .prepared import parse_query
+from .results import result_rows
+
+# PREFIX and BASE declarations and comments at the start of a query.
+PROLOGUE = re.compile(r"(?:\s+|#[^\n]*|(?:PREFIX|BASE)\b[^<]*<[^>]*>)*", re.IGNORECASE)
+# Comments, strings, IRIs and braces of a query, which is all needed to find its group graph patterns.
+TOKEN = re.compile("|".join([
+    r"#[^\n]*",
+    r'"""(?:[^"\\]|\\.|"(?!""))*"""',
+    r"'''(?:[^'\\]|\\.|'(?!''))*'''",
+    r'"(?:[^"\\\n]|\\.)*"',
+    r"'(?:[^'\\\n]|\\.)*'",
+    r'<[^<>"{}|^`\\\x00-\x20]*>',
+    r"[{}]",
+]))
+RETRY_STATUS = {429, 500, 502, 503, 504}
+graph_formats = {
+    "application/rdf+xml": "xml",
+    "text/turtle": "turtle",
+    "application/n-triples": "nt",
+    "application/ld+json": "json-ld",
+    "application/json": "json-ld",
+}
+
+# items holds the rows of a SELECT page or the triples of a CONSTRUCT page.
+Page = namedtuple("Page", ["number", "header", "items"])
+
+
+class PageError(Exception):
+    pass
+
+
+class PagedQuery:
+    """A SELECT or CONSTRUCT query split into pages of page_size solutions. Raises ValueError for queries which
+    can not be paged."""
+
+    def __init__(self, query, page_size=10000):
+        parsed = parse_query(query)
+        self.suffix = ""
+        tree = parsed[1]
+        if tree.name == "SelectQuery":
+            self.type = "SELECT"
+        elif tree.name == "ConstructQuery":
+            self.type = "CONSTRUCT"
+        else:
+            raise ValueError("Only SELECT and CONSTRUCT queries can be paged")
+        self.page_size = page_size
+        algebra = translateQuery(parsed).algebra
+        variables = algebra.PV if self.type == "SELECT" else algebra.p._vars
+        # Pages are only disjoint if the solutions are ordered the same way in every request.
+        order = " ".join(sorted(var.n3() for var in variables if not var.startswith("__")))
+
+        end = PROLOGUE.match(query).end()
+        self.prologue = query[:end]
+        body = query[end:]
+        if self.type == "CONSTRUCT":
+            if any(key in tree for key in ["limitoffset", "valuesClause", "groupby", "having"]):
+                raise ValueError("Paged CONSTRUCT queries may not use GROUP BY, HAVING, LIMIT, OFFSET or VALUES")
+            self.construct(tree, body, order)
+        elif "limitoffset" not in tree and "valuesClause" not in tree:
+            self.template = body + ("\n" if "orderby" in tree else f"\nORDER BY {order}\n")
+        elif self.type == "SELECT" and "datasetClause" not in tree:
+            # LIMIT, OFFSET and VALUES of the query stay in a subquery.
+            self.template = f"SELECT * WHERE {{\n{{\n{body}\n}}\n}}\nORDER BY {order}\n"
+        else:
+            raise ValueError("Paged queries may not use LIMIT, OFFSET or VALUES after the WHERE clause")
+
+    def construct(self, tree, body, order):
+        """Pages a CONSTRUCT query by its solutions: the template is applied to a window of the solutions of the
+        WHERE clause selected by a subquery. Pages of as many triples could split the triples of a solution."""
+        start = next_group(body, 0)
+        if "template" in tree:
+            template_end = group_end(body, start)
+            template = body[start:template_end]
+            where_start = next_group(body, template_end)
+            dataset = body[template_end:where_start]
+        else:
+            # CONSTRUCT WHERE { ... } uses its pattern as template.
+            where_start = start
+            template = None
+            dataset = re.sub(r"^\s*CONSTRUCT", "", body[:where_start], flags=re.IGNORECASE)
+        where = body[where_start:group_end(body, where_start)]
+        dataset = re.sub(r"\bWHERE\s*$", "", dataset.strip(), flags=re.IGNORECASE).strip()
+        self.template = (f"CONSTRUCT {template or where}\n{dataset}\nWHERE {{\nSELECT * WHERE {where}\n"
+                         f"ORDER BY {order}\n")
+        self.suffix = "\n}"
+        self.probe_template = f"ASK {dataset}\n{{\nSELECT * WHERE {where}\n"
+
+    def page(self, number):
+        return f"{self.prologue}{self.template}LIMIT {self.page_size} OFFSET {number * self.page_size}{self.suffix}"
+
+    def probe(self, number):
+        """ASK query whether the window of page number has any solutions, for CONSTRUCT queries."""
+        return f"{self.prologue}{self.probe_template}LIMIT 1 OFFSET {number * self.page_size}\n}}"
+
+    def is_last(self, page):
+        """Results end with the first empty page. A page which is not full does not end them, as endpoints may return
+        fewer rows than requested. An empty CONSTRUCT page ends them only if its window has no solutions, which is
+        checked with probe."""
+        return len(page.items) == 0
+
+
+def next_group(text, start):
+    """Position of the next opening brace in text outside of comments, strings and IRIs."""
+    for m in TOKEN.finditer(text, start):
+        if m.group() == "{":
+            return m.start()
+    raise ValueError("The query has no WHERE clause")
+
+
+def group_end(text, start):
+    """Position after the brace closing the one at start."""
+    depth = 0
+    for m in TOKEN.finditer(text, start):
+        if m.group() == "{":
+            depth += 1
+        elif m.group() == "}":
+            depth -= 1
+            if depth == 0:
+                return m.end()
+    raise ValueError("Unbalanced braces in the query")
+
+
+class PageFetcher:
+    """Fetches the pages of a PagedQuery from endpoint with up to concurrency requests at a time."""
+
+    def __init__(self, client, endpoint, paged, fmt="xml", concurrency=4, retries=3, backoff=1.0, use_cache=True,
+                 compress=True):
+        self.client = client
+        self.endpoint = endpoint
+        self.paged = paged
+        self.fmt = fmt
+        self.concurrency = max(concurrency, 1)
+        self.retries = retries
+        self.backoff = backoff
+        self.use_cache = use_cache
+        self.compress = compress
+        # Problems found while fetching, e.g. pages cut off by the endpoint.
+        self.warnings = []
+
+    def fetch(self, number):
+        def read(response):
+            mime = response.content_type.split(";")[0].strip()
+            if self.paged.type == "SELECT":
+                rows = result_rows(response.open(), mime)
+                return Page(number, next(rows), list(rows))
+            g = rdflib.Graph()
+            g.parse(data=response.body, format=graph_formats.get(mime, "xml"))
+            return Page(number, None, list(g))
+
+        return self.request(number, self.paged.page(number), self.fmt, read)
+
+    def has_solutions(self, number):
+        """Whether the window of CONSTRUCT page number has solutions, even if they produce no triples."""
+        return self.request(number, self.paged.probe(number), "json", lambda response: response.convert()["boolean"])
+
+    def request(self, number, query, fmt, read):
+        """Sends a query for page number and returns read(response), retrying failed requests."""
+        for attempt in range(self.retries + 1):
+            try:
+                return read(self.client.query(self.endpoint, query, fmt, self.use_cache, self.compress))
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                status = getattr(e.response, "status_code", None)
+                if attempt == self.retries or (isinstance(e, requests.HTTPError) and status not in RETRY_STATUS):
+                    raise PageError(f"Page {number + 1} failed: {e}")
+                delay = self.backoff * 2 ** attempt
+                retry_after = e.response.headers.get("Retry-After") if e.response is not None else None
+                if retry_after is not None and retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+                time.sleep(delay * random.uniform(1, 1.5))
+
+    def pages(self):
+        """Yields the pages in order. At most concurrency pages are requested ahead of the page yielded next."""
+        executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="rdfify-page")
+        futures = dict()
+        requested = 0
+        short = None
+        try:
+            number = 0
+            while True:
+                while requested < number + self.concurrency:
+                    futures[requested] = executor.submit(self.fetch, requested)
+                    requested += 1
+                page = futures.pop(number).result()
+                yield page
+                if self.paged.is_last(page) and (self.paged.type == "SELECT" or not self.has_solutions(number)):
+                    return
+                if short and page.items:
+                    self.warnings.append(
+                        f"Page {short.number + 1} had only {len(short.items)} of {self.paged.page_size} rows, but "
+                        f"later pages were not empty. The endpoint returns at most {len(short.items)} rows per "
+                        f"request, so rows are missing. Use --page-size {len(short.items)} or less.")
+                    short = False
+                if short is None and self.paged.type == "SELECT" and 0 < len(page.items) < self.paged.page_size:
+                    short = page
+                number += 1
+        finally:
+            # Pages after the last one are not needed.
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -1,16 +1,27 @@
-import os
-import rdflib
 import requests
 from pathlib import Path
+from rdflib import Dataset
 from .rdf_module import RDFModule
+from .graph import new_graph, quad_formats, stores
+from .http_cache import DownloadCache
+from .jobs import add_background_argument
+from .compact_store import CompactStore
+from .memory_budget import Spilled
+from .loader import (EncodedMerge, SourceReference, expand_paths, guess_file_format, insert_parsed, is_pattern, parallel_parse,
+                     pattern_label, stream_load, strip_compression_suffix)
+from .snapshot import load_snapshot, save_snapshot
+from .stats import stats
+from .sqlite_store import graph_labels, open_graph
 from .util import StopCellExecution
 
+download_cache = DownloadCache()
+
 
 class PersistenceModule(RDFModule):
     def __init__(self, name, parser, logger, description, displayname):
         super().__init__(name, parser, logger, description, displayname)
         self.parser.add_argument(
-            "--load", "-l", help="Load an RDF graph from a local file path")
+            "--load", "-l", help="Load an RDF graph from a local file path. A directory or glob pattern loads all matching files in parallel")
         self.parser.add_argument(
             "--download", "-d", help="Download an RDF graph from a remote URL")
         self.parser.add_argument(
@@ -18,25 +29,70 @@ class PersistenceModule(RDFModule):
         self.parser.add_argument(
             "--label", help="Label to identify the graph (used for loading with --label or saving with --save)")
         self.parser.add_argument(
-            "--format", "-f", choices=["turtle", "json-ld", "xml", "n3", "nt", "trig"],
-            default="turtle", help="RDF format for the file")
+            "--format", "-f", choices=["turtle", "json-ld", "xml", "n3", "nt", "nquads", "trig", "snapshot"],
+            default="turtle", help="RDF format for the file. snapshot is a binary format which loads much faster and can hold all labelled graphs at once")
         self.parser.add_argument(
             "--output", "-o", help="Output file path for --save operation")
+        self.parser.add_argument(
+            "--store", choices=stores, default="default", help="Store backing loaded or downloaded graphs. The compact store needs several times less memory for large graphs")
+        self.parser.add_argument(
+            "--stream", help="Load the file incrementally instead of reading it into memory at once. Decompresses .gz, .bz2 and .xz files and only keeps a reference to the file as source", action="store_true")
+        self.parser.add_argument(
+            "--batch-size", type=int, default=50000, help="Number of lines parsed per batch when streaming nt or nquads files")
+        self.parser.add_argument(
+            "--db", help="SQLite database file keeping graphs on disk. Loaded and downloaded graphs are written into it, --save copies a graph into it instead of a file")
+        self.parser.add_argument(
+            "--open", help="Reopen the graph given by --label (or all graphs) from the database given by --db without parsing", action="store_true")
+        self.parser.add_argument(
+            "--workers", type=int, help="Number of worker processes parsing files when loading a directory or glob pattern. Defaults to the number of CPUs")
+        self.parser.add_argument(
+            "--named-graphs", help="Load every file of a directory or glob pattern into its own named graph of a dataset instead of merging them", action="store_true")
+        self.parser.add_argument(
+            "--offline", help="Serve --download only from the download cache without contacting the server", action="store_true")
+        self.parser.add_argument(
+            "--cache-dir", help="Directory of the download cache. Defaults to ~/.cache/jupyter-rdfify/downloads")
+        add_background_argument(self.parser)
 
     def handle(self, params, store):
         try:
-            if params.load:
-                self._load_from_file(params.load, params.label, params.format, store)
-            elif params.download:
-                self._download_from_url(params.download, params.label, params.format, store)
-            elif params.save:
-                self._save_to_file(params.label, params.output, params.format, store)
-            else:
-                self.log("Please specify --load, --download, or --save")
+            if params.cache_dir is not None:
+                download_cache.set_directory(params.cache_dir)
+            action = "open" if params.open else "load" if params.load else "download" if params.download else "save"
+            with stats.phase(action):
+                if params.open:
+                    self._open_from_db(params.db, params.label, store)
+                elif params.load and params.format == "snapshot":
+                    self._load_snapshot(params.load, params.label, params.store, store)
+                elif params.load and (is_pattern(params.load) or Path(params.load).is_dir()):
+                    self._load_many(params.load, params.label, params.format, params.workers, params.named_graphs, params.batch_size, params.store, params.db, store)
+                elif params.load and params.stream:
+                    self._stream_from_file(params.load, params.label, params.format, params.batch_size, params.store, params.db, store)
+                elif params.load:
+                    self._load_from_file(params.load, params.label, params.format, params.store, params.db, store)
+                elif params.download:
+                    self._download_from_url(params.download, params.label, params.format, params.store, params.db, params.offline, store)
+                elif params.save and params.db:
+                    self._save_to_db(params.label, params.db, store)
+                elif params.save and params.format == "snapshot":
+                    self._save_snapshot(params.label, params.output, store)
+                elif params.save:
+                    self._save_to_file(params.label, params.output, params.format, store)
+                else:
+                    self.log("Please specify --load, --download, --save or --open")
         except Exception as e:
             self.log(f"Error: {str(e)}")
 
-    def _load_from_file(self, file_path, label, fmt, store):
+    def _new_graph(self, label, fmt, backend, db):
+        """Returns an empty graph, either in memory or replacing the graph with this label in the database db."""
+        if db is None:
+            return new_graph(backend, fmt)
+        if fmt in ["nquads", "trig"]:
+            raise ValueError(f"Graphs in the database can not be loaded from the quad format {fmt}")
+        g = open_graph(db, label)
+        g.remove((None, None, None))
+        return g
+
+    def _load_from_file(self, file_path, label, fmt, backend, db, store):
         """Load an RDF graph from a local file."""
         try:
             path = Path(file_path)
@@ -47,13 +103,14 @@ class PersistenceModule(RDFModule):
             with open(path, 'r', encoding='utf-8') as f:
                 content = f.read()
 
-            g = rdflib.Graph().parse(data=content, format=fmt)
-            g.source = lambda: f"file://{path.absolute()}"
-
             # Use provided label or derive from filename
             if label is None:
                 label = path.stem
 
+            g = self._new_graph(label, fmt, backend, db).parse(data=content, format=fmt)
+            g.commit()
+            g.source = lambda: f"file://{path.absolute()}"
+
             store["rdfgraphs"][label] = g
             store["rdfsources"][label] = content
             store["rdfgraphs"]["last"] = g
@@ -64,37 +121,245 @@ class PersistenceModule(RDFModule):
             self.log(f"Failed to load file '{file_path}': {str(e)}")
             raise StopCellExecution
 
-    def _download_from_url(self, url, label, fmt, store):
-        """Download an RDF graph from a remote URL."""
+    def _stream_from_file(self, file_path, label, fmt, batch_size, backend, db, store):
+        """Load an RDF graph from a local, possibly compressed file in batches."""
+        try:
+            path = Path(file_path)
+            if not path.exists():
+                self.log(f"File not found: {file_path}")
+                return
+
+            # Use provided label or derive from filename without compression suffix
+            if label is None:
+                label = strip_compression_suffix(path).stem
+
+            g = self._new_graph(label, fmt, backend, db)
+            handle = None
+
+            def progress(done, total):
+                nonlocal handle
+                percent = 100 * done / total if total else 100
+                handle = self.logger.progress(
+                    f"{self.displayname}: Loading '{file_path}': {percent:.0f}% ({len(g)} triples)", handle)
+
+            g, source = stream_load(path, fmt, g, batch_size, progress)
+            g.commit()
+            g.source = lambda: f"file://{path.absolute()}"
+
+            store["rdfgraphs"][label] = g
+            store["rdfsources"][label] = source
+            store["rdfgraphs"]["last"] = g
+            store["rdfsources"]["last"] = source
+
+            self.log(f"Loaded graph from '{file_path}' with label '{label}' ({len(g)} triples)")
+        except Exception as e:
+            self.log(f"Failed to load file '{file_path}': {str(e)}")
+            raise StopCellExecution
+
+    def _load_many(self, pattern, label, fmt, workers, named_graphs, batch_size, backend, db, store):
+        """Load all files matching a glob pattern or inside a directory, parsing them in a process pool."""
         try:
-            self.log(f"Downloading from {url}...")
+            paths = expand_paths(pattern)
+            if not paths:
+                self.log(f"No files found for '{pattern}'")
+                return
 
-            headers = {'Accept': self._get_accept_header(fmt)}
-            response = requests.get(url, headers=headers, timeout=30)
-            response.raise_for_status()
+            # Use provided label or derive from the directory
+            if label is None:
+                label = pattern_label(pattern)
 
-            content = response.text
+            formats = set(guess_file_format(path, fmt) for path in paths)
+            if named_graphs:
+                if db is not None or backend != "default":
+                    raise ValueError("Named graphs can only be loaded into the default store")
+                g = Dataset()
+            else:
+                g = self._new_graph(label, next((f for f in formats if f in quad_formats), fmt), backend, db)
 
-            g = rdflib.Graph().parse(data=content, format=fmt)
-            g.source = lambda: url
+            # An empty compact store is built directly from the encoded triples of all files.
+            merge = EncodedMerge() if isinstance(g.store, CompactStore) and len(g) == 0 else None
+            handle = None
+            report = []
+            parsed_count = 0
+            for parsed in parallel_parse(paths, fmt, workers, batch_size):
+                if merge is not None:
+                    merge.add(parsed)
+                else:
+                    insert_parsed(g, parsed, named_graphs)
+                report.append(parsed)
+                parsed_count += len(parsed.quads) // 4
+                handle = self.logger.progress(
+                    f"{self.displayname}: Loading '{pattern}': {len(report)}/{len(paths)} files ({parsed_count} triples parsed)", handle)
+            if merge is not None:
+                g.store.load_encoded(merge.terms, merge.triples)
+            g.commit()
+            g.source = lambda: f"file://{Path(pattern).absolute()}"
+            sources = [parsed.source for parsed in sorted(report, key=lambda parsed: parsed.path)]
+
+            store["rdfgraphs"][label] = g
+            store["rdfsources"][label] = sources
+            store["rdfgraphs"]["last"] = g
+            store["rdfsources"]["last"] = sources
+
+            lines = [f"  {parsed.path}: {len(parsed.quads) // 4} triples in {parsed.seconds:.2f}s"
+                     for parsed in sorted(report, key=lambda parsed: parsed.path)]
+            self.log(f"Loaded {len(paths)} files from '{pattern}' with label '{label}' ({len(g)} triples)\n"
+                     + "\n".join(lines))
+        except Exception as e:
+            self.log(f"Failed to load '{pattern}': {str(e)}")
+            raise StopCellExecution
+
+    def _download_from_url(self, url, label, fmt, backend, db, offline, store):
+        """Download an RDF graph from a remote URL through the download cache."""
+        try:
+            self.log(f"Loading cached copy of {url}..." if offline else f"Downloading from {url}...")
+
+            doc = download_cache.fetch(url, self._get_accept_header(fmt), offline)
 
             # Use provided label or derive from URL
             if label is None:
                 label = url.split('/')[-1].split('.')[0] or "downloaded"
 
+            # Snapshots hold a single graph, so documents in quad formats are always parsed.
+            snapshot = doc.snapshot_path(fmt) if fmt not in quad_formats else None
+            cached = None
+            if snapshot is not None and snapshot.exists():
+                try:
+                    cached = next(iter(load_snapshot(snapshot, backend if db is None else "default").values()))
+                except (OSError, ValueError):
+                    cached = None
+
+            if cached is not None and db is None:
+                g = cached
+            else:
+                g = self._new_graph(label, fmt, backend, db)
+                if cached is not None:
+                    for prefix, namespace in cached.namespaces():
+                        g.bind(prefix, namespace, override=True)
+                    g.addN((s, p, o, g) for s, p, o in cached)
+                else:
+                    with open(doc.path, 'rb') as f:
+                        g.parse(source=f, format=fmt, publicID=url)
+                    if snapshot is not None:
+                        save_snapshot(snapshot, {label: g})
+            g.commit()
+            g.source = lambda: url
+            source = SourceReference(str(doc.path), doc.size, doc.sha256, fmt)
+
             store["rdfgraphs"][label] = g
-            store["rdfsources"][label] = content
+            store["rdfsources"][label] = source
             store["rdfgraphs"]["last"] = g
-            store["rdfsources"]["last"] = content
+            store["rdfsources"]["last"] = source
 
-            self.log(f"Downloaded graph from '{url}' with label '{label}' ({len(g)} triples)")
-        except requests.RequestException as e:
+            if doc.modified:
+                self.log(f"Downloaded graph from '{url}' with label '{label}' ({len(g)} triples)")
+            else:
+                origin = "snapshot" if cached is not None else "cached copy"
+                self.log(f"Graph from '{url}' is unchanged, restored label '{label}' from its {origin} ({len(g)} triples)")
+        except (requests.RequestException, LookupError) as e:
             self.log(f"Failed to download from '{url}': {str(e)}")
             raise StopCellExecution
         except Exception as e:
             self.log(f"Failed to parse downloaded graph: {str(e)}")
             raise StopCellExecution
 
+    def _open_from_db(self, db, label, store):
+        """Reopen labelled graphs from a database without parsing them."""
+        if db is None:
+            self.log("Please specify the database with --db")
+            return
+        if not Path(db).exists():
+            self.log(f"Database not found: {db}")
+            return
+        present = graph_labels(db)
+        for label in (present if label is None else [label]):
+            if label not in present:
+                self.log(f"Graph with label '{label}' not found in '{db}'")
+                continue
+            g = open_graph(db, label)
+            g.source = lambda label=label: f"sqlite://{Path(db).absolute()}#{label}"
+            store["rdfgraphs"][label] = g
+            store["rdfgraphs"]["last"] = g
+            self.log(f"Opened graph '{label}' from '{db}' ({len(g)} triples)")
+
+    def _save_to_db(self, label, db, store):
+        """Copy a graph into a database."""
+        if label is None:
+            self.log("Please specify --label to identify which graph to save")
+            return
+        if label not in store["rdfgraphs"]:
+            self.log(f"Graph with label '{label}' not found")
+            return
+        g = store["rdfgraphs"][label]
+        if getattr(g.store, "path", None) == str(Path(db).absolute()) and str(g.identifier) == label:
+            g.commit()
+            self.log(f"Graph '{label}' is stored in '{db}' already")
+            return
+        target = self._new_graph(label, None, None, db)
+        for prefix, namespace in g.namespaces():
+            target.bind(prefix, namespace, override=True)
+        target.addN((s, p, o, target) for s, p, o in g)
+        target.commit()
+        self.log(f"Saved graph '{label}' to '{db}' ({len(target)} triples)")
+
+    def _load_snapshot(self, file_path, label, backend, store):
+        """Load graphs from a binary snapshot. A snapshot of a single graph may be relabelled with label."""
+        try:
+            path = Path(file_path)
+            if not path.exists():
+                self.log(f"File not found: {file_path}")
+                return
+
+            graphs = load_snapshot(path, backend)
+            if label is not None:
+                unique = set(id(g) for g in graphs.values())
+                if len(unique) != 1:
+                    self.log("--label can only be used for snapshots of a single graph")
+                    return
+                graphs = {label: next(iter(graphs.values()))}
+
+            for name, g in graphs.items():
+                g.source = lambda: f"file://{path.absolute()}"
+                store["rdfgraphs"][name] = g
+                if name != "last":
+                    store["rdfgraphs"]["last"] = g
+            self.log(f"Loaded {len(graphs)} labelled graphs from snapshot '{file_path}': {', '.join(graphs)}")
+        except Exception as e:
+            self.log(f"Failed to load snapshot '{file_path}': {str(e)}")
+            raise StopCellExecution
+
+    def _save_snapshot(self, label, output, store):
+        """Save one graph, or all labelled graphs if no label is given, to a binary snapshot."""
+        try:
+            if label is None:
+                # Spilled graphs are read one at a time while they are written, instead of all being loaded back.
+                # Labels of the same graph stay together.
+                labels = store["rdfgraphs"]
+                graphs = dict()
+                readers = dict()
+                for name in labels:
+                    value = labels.peek(name)
+                    if isinstance(value, Spilled):
+                        value = readers.setdefault(id(value), lambda name=name: labels.read(name))
+                    graphs[name] = value
+                label = "store"
+            elif label not in store["rdfgraphs"]:
+                self.log(f"Graph with label '{label}' not found")
+                return
+            else:
+                graphs = {label: store["rdfgraphs"][label]}
+
+            if output is None:
+                output = f"{label}.{self._get_file_extension('snapshot')}"
+            output_path = Path(output)
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+
+            count = save_snapshot(output_path, graphs)
+            self.log(f"Saved {len(graphs)} labelled graphs to snapshot '{output}' ({count} triples)")
+        except Exception as e:
+            self.log(f"Failed to save snapshot: {str(e)}")
+            raise StopCellExecution
+
     def _save_to_file(self, label, output, fmt, store):
         """Save a graph to a local file."""
         try:
@@ -140,7 +405,9 @@ class PersistenceModule(RDFModule):
             'json-ld': 'jsonld',
             'n3': 'n3',
             'nt': 'nt',
+            'nquads': 'nq',
             'trig': 'trig',
+            'snapshot': 'rdfsnap',
         }
         return extensions.get(fmt, 'rdf')
 
@@ -153,6 +420,7 @@ class PersistenceModule(RDFModule):
             'json-ld': 'application/ld+json',
             'n3': 'text/n3',
             'nt': 'application/n-triples',
+            'nquads': 'application/n-quads',
             'trig': 'application/trig',
         }
         return accept_types.get(fmt, 'application/rdf+xml')
@@ -0,0 +1,98 @@
+"""Cache of parsed and translated SPARQL queries for local graphs.
+
+rdflib parses a query string and translates it into its algebra on every call of Graph.query. Prepared queries skip
+both steps, so repeated queries, e.g. the same query evaluated with different initial bindings in a loop, only pay
+for their evaluation."""
+import threading
+import time
+
+from rdflib.plugins.sparql.algebra import translateQuery
+from rdflib.plugins.sparql.parser import parseQuery
+
+from .cache import LRUCache
+
+# rdflib's pyparsing grammar fails when used by several threads at once, e.g. by background jobs or federated queries.
+parser_lock = threading.Lock()
+
+
+def parse_query(query):
+    """parseQuery holding the lock shared by all threads parsing SPARQL."""
+    with parser_lock:
+        return parseQuery(query)
+
+
+class QueryTimings:
+    """Seconds spent parsing, translating and evaluating a query. Parsing and translating are 0 for cached queries."""
+
+    def __init__(self):
+        self.parse = 0.0
+        self.translate = 0.0
+        self.evaluate = 0.0
+        self.cached = False
+
+    def __str__(self):
+        if self.cached:
+            prepared = "Prepared query from cache"
+        else:
+            prepared = f"Query parsed in {self.parse * 1000:.1f}ms, translated in {self.translate * 1000:.1f}ms"
+        return f"{prepared}, evaluated in {self.evaluate * 1000:.1f}ms"
+
+
+class PreparedQueryCache:
+    """Prepared queries keyed by prefix, query text and the namespaces used to resolve prefixed names."""
+
+    def __init__(self, maxsize=256):
+        self.queries = LRUCache(maxsize)
+        self.lock = threading.Lock()
+
+    def key(self, query, prefix, namespaces):
+        return prefix, query, tuple(sorted(namespaces.items()))
+
+    def prepare(self, query, prefix="", namespaces=None, timings=None):
+        """Returns the prepared query of prefix + query. Prefixed names which are not declared in the query are
+        resolved with namespaces, as Graph.query does with the namespaces of the graph."""
+        namespaces = namespaces or dict()
+        key = self.key(query, prefix, namespaces)
+        with self.lock:
+            prepared = self.queries.get(key)
+            if timings is not None:
+                timings.cached = prepared is not None
+            if prepared is None:
+                start = time.perf_counter()
+                parsed = parse_query(prefix + query)
+                parsed_at = time.perf_counter()
+                prepared = translateQuery(parsed, None, namespaces)
+                if timings is not None:
+                    timings.parse = parsed_at - start
+                    timings.translate = time.perf_counter() - parsed_at
+                self.queries.put(key, prepared)
+        return prepared
+
+    def clear(self):
+        self.queries.clear()
+
+    def stats(self):
+        return f"Prepared queries: {self.queries.stats()}"
+
+
+prepared_queries = PreparedQueryCache()
+
+
+def run_query(graph, query, initBindings=None, prefix="", timings=None):
+    """Evaluates query on graph like graph.query(prefix + query, initBindings=initBindings), but parses and translates
+    the query only once. initBindings maps variable names to rdflib terms. If a QueryTimings object is passed, it is
+    filled with the time spent in each step. Solutions of SELECT queries are computed lazily, unless timings are
+    requested: then they are all computed here, so the evaluation time is complete.
+
+        from rwth_jupyter_rdfify import run_query
+        for person in people:
+            res = run_query(g, "SELECT ?name WHERE { ?p foaf:name ?name }", {"p": person})
+    """
+    prepared = prepared_queries.prepare(query, prefix, dict(graph.namespaces()), timings)
+    start = time.perf_counter()
+    res = graph.query(prepared, initBindings=initBindings)
+    if timings is not None:
+        if res.type == "SELECT":
+            res.bindings
+        timings.evaluate = time.perf_counter() - start
+    return res
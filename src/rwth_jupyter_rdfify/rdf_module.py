@@ -2,6 +2,9 @@ from abc import ABC, abstractmethod
 
 
 class RDFModule(ABC):
+    # Whether calls of the module are recorded by %rdf stats.
+    instrumented = True
+
     def __init__(self, name, parser, logger, description="", displayname=None):
         self.name = name
         self.logger = logger
@@ -12,6 +15,10 @@ class RDFModule(ABC):
         else:
             self.displayname = displayname
 
+    def copies_graphs(self, params):
+        """Whether the call changes graphs of the store in place. Such calls work on copies in background jobs."""
+        return False
+
     @abstractmethod
     def handle(self, params, store=None):
         raise NotImplementedError()
@@ -0,0 +1,195 @@
+"""Graphviz layout outside of the kernel.
+
+The layout of a drawing is computed by a Graphviz process which is watched by a background thread, so a cell returns
+as soon as the drawing is prepared and the SVG replaces a placeholder once it is ready. Layouts exceeding a timeout
+or cancelled by the user are killed and replaced by a fallback. Finished SVGs are cached in memory and on disk, keyed
+by the hash of the DOT source together with the layout engine. The DOT source is determined by the drawn triples and
+the drawing options, so redrawing an unchanged graph shows the cached SVG without running Graphviz again."""
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from IPython.display import HTML, SVG
+
+from .cache import LRUCache, content_key
+from .stats import stats
+
+layout_engines = ["dot", "neato", "fdp", "sfdp", "circo", "twopi"]
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "jupyter-rdfify" / "svg"
+
+
+class RenderError(Exception):
+    pass
+
+
+class RenderCancelled(RenderError):
+    pass
+
+
+class SVGCache:
+    """SVG documents by key, the most recently used in memory and all of them in a cache directory."""
+
+    def __init__(self, directory=None, maxsize=32):
+        self.memory = LRUCache(maxsize)
+        self.directory = Path(directory) if directory is not None else default_cache_dir()
+
+    def key(self, source, engine):
+        return content_key(engine, source)
+
+    def _path(self, key):
+        return self.directory / f"{key}.svg"
+
+    def get(self, key):
+        svg = self.memory.get(key)
+        if svg is None:
+            try:
+                svg = self._path(key).read_text(encoding="utf-8")
+            except OSError:
+                return None
+            self.memory.put(key, svg)
+        return svg
+
+    def put(self, key, svg):
+        self.memory.put(key, svg)
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = self._path(key).with_suffix(".tmp")
+            tmp.write_text(svg, encoding="utf-8")
+            os.replace(tmp, self._path(key))
+        except OSError:
+            # The cache directory is optional, the SVG is still kept in memory.
+            pass
+
+
+class RenderJob:
+    """Layout of one drawing by a Graphviz process."""
+
+    def __init__(self, job_id, source, engine, timeout):
+        self.id = job_id
+        self.source = source
+        self.engine = engine
+        self.timeout = timeout
+        self.process = None
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def run(self):
+        """Returns the SVG. Raises RenderCancelled if cancelled and RenderError if Graphviz fails or times out."""
+        with self.lock:
+            if self.cancelled:
+                raise RenderCancelled(f"Drawing {self.id} was cancelled")
+            try:
+                self.process = subprocess.Popen([self.engine, "-Tsvg"], stdin=subprocess.PIPE,
+                                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except OSError as e:
+                raise RenderError(f"Could not run Graphviz '{self.engine}', is it installed and on your path? ({e})")
+        try:
+            out, err = self.process.communicate(self.source.encode("utf-8"), timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.communicate()
+            raise RenderError(f"The layout took longer than {self.timeout}s")
+        if self.cancelled:
+            raise RenderCancelled(f"Drawing {self.id} was cancelled")
+        if self.process.returncode != 0:
+            raise RenderError(f"Graphviz failed: {err.decode('utf-8', 'replace').strip()}")
+        return out.decode("utf-8")
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            if self.process is not None and self.process.poll() is None:
+                self.process.kill()
+
+
+class Renderer:
+    """Runs layouts in the background and shows their results in place of a placeholder."""
+
+    def __init__(self, workers=2, cache=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rdfify-render")
+        self.cache = cache if cache is not None else SVGCache()
+        self.jobs = dict()
+        self.next_id = 1
+
+    def render(self, dot, logger, engine="dot", timeout=30, fallback=None, wait=False):
+        """Displays the SVG of dot. A cached SVG is shown right away, otherwise the layout runs in the background
+        unless wait is set. On a cache miss, fallback is called before the layout starts. It returns a function
+        computing the HTML which is shown instead if the layout fails or times out. That function runs in the layout
+        thread, so fallback takes everything it needs from the drawn graph right away.
+        Returns the job or None if the SVG was cached."""
+        source = dot.source
+        key = self.cache.key(source, engine)
+        svg = self.cache.get(key)
+        stats.add("svg cache", 0.0, hits=int(svg is not None))
+        if svg is not None:
+            logger.print("Drawing served from the SVG cache", True)
+            logger.out(SVG(svg))
+            return None
+        if fallback is not None:
+            fallback = fallback()
+
+        job = RenderJob(self.next_id, source, engine, timeout)
+        self.next_id += 1
+        self.jobs[job.id] = job
+        handle = logger.show(HTML(f"<p>Drawing {job.id}: computing the layout. Cancel with "
+                                  f"<code>%rdf graph cancel-draw --job {job.id}</code></p>"))
+        # The layout may finish after the cell, it is still counted for the cell which started it.
+        cell = stats.current_cell()
+
+        def run():
+            try:
+                with stats.phase("layout", cell) as phase:
+                    svg = job.run()
+                    phase.count(characters=len(source))
+                self.cache.put(key, svg)
+                shown = SVG(svg)
+            except RenderCancelled as e:
+                shown = HTML(f"<p>{e}.</p>")
+            except RenderError as e:
+                shown = HTML(f"<p>{e}.</p>")
+                if fallback is not None:
+                    shown = HTML(shown.data + fallback_html(fallback))
+            except Exception as e:
+                shown = HTML(f"<p>Drawing failed: {e}</p>")
+            finally:
+                self.jobs.pop(job.id, None)
+            logger.show(shown, handle)
+
+        if wait:
+            run()
+        else:
+            self.executor.submit(run)
+        return job
+
+    def render_now(self, dot, engine="dot", timeout=30):
+        """Returns the SVG of dot, computing the layout in the calling thread if it is not cached."""
+        key = self.cache.key(dot.source, engine)
+        svg = self.cache.get(key)
+        if svg is None:
+            with stats.phase("layout"):
+                svg = RenderJob(None, dot.source, engine, timeout).run()
+            self.cache.put(key, svg)
+        return svg
+
+    def cancel(self, job_id=None):
+        """Cancels the layout job_id or all running layouts and returns the cancelled jobs."""
+        jobs = list(self.jobs.values()) if job_id is None else [self.jobs[job_id]] if job_id in self.jobs else []
+        for job in jobs:
+            job.cancel()
+        return jobs
+
+
+def fallback_html(fallback):
+    try:
+        return fallback()
+    except Exception as e:
+        return f"<p>The fallback could not be shown either: {e}</p>"
+
+
+renderer = Renderer()
@@ -0,0 +1,304 @@
+"""Incremental parsing of SPARQL SELECT results.
+
+The XML and JSON result formats are parsed while the response is read, yielding one row at a time. Only the rows that
+are displayed are kept in memory; the remaining rows are either read on demand or spooled to a temporary file."""
+import html
+import io
+import json
+import os
+import pickle
+import tempfile
+import xml.etree.ElementTree as ET
+from itertools import islice
+
+from rdflib import BNode, Literal, URIRef
+
+SPARQL_NS = "{http://www.w3.org/2005/sparql-results#}"
+XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+CHUNK_SIZE = 1 << 16
+result_mime_types = ["application/sparql-results+xml", "application/sparql-results+json"]
+
+
+def result_rows(stream, mime, raw=False):
+    """Yields the variable names and then every row of the result in stream as a list of rdflib terms
+    (None for unbound variables). With raw, terms are (kind, value, datatype, language) tuples instead, which are
+    cheaper to create. The stream is closed when the generator finishes or is closed."""
+    if mime == "application/sparql-results+json":
+        return json_result_rows(stream, raw_json_term if raw else json_term)
+    return xml_result_rows(stream, raw_xml_term if raw else xml_term)
+
+
+def xml_term(node):
+    tag = node.tag
+    text = node.text or ""
+    if tag == SPARQL_NS + "uri":
+        return URIRef(text)
+    elif tag == SPARQL_NS + "bnode":
+        return BNode(text)
+    elif tag == SPARQL_NS + "literal":
+        datatype = node.get("datatype")
+        return Literal(text, lang=node.get(XML_LANG), datatype=URIRef(datatype) if datatype else None)
+    raise ValueError(f"Unknown node: {ET.tostring(node)}")
+
+
+def raw_xml_term(node):
+    kind = node.tag[len(SPARQL_NS):]
+    if kind == "literal":
+        return kind, node.text or "", node.get("datatype"), node.get(XML_LANG)
+    return kind, node.text or "", None, None
+
+
+def xml_result_rows(stream, term=xml_term):
+    try:
+        variables = []
+        row = None
+        results = None
+        for event, elem in ET.iterparse(stream, events=("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                if tag == SPARQL_NS + "result":
+                    row = dict()
+                elif tag == SPARQL_NS + "results":
+                    results = elem
+            elif tag == SPARQL_NS + "variable":
+                variables.append(elem.get("name"))
+            elif tag == SPARQL_NS + "head":
+                yield list(variables)
+            elif tag == SPARQL_NS + "binding":
+                row[elem.get("name")] = term(elem[0]) if len(elem) else None
+            elif tag == SPARQL_NS + "result":
+                yield [row.get(var) for var in variables]
+                # Drop parsed results so the tree does not grow with the result.
+                results.clear()
+    finally:
+        stream.close()
+
+
+def json_term(value):
+    kind = value["type"]
+    if kind == "uri":
+        return URIRef(value["value"])
+    elif kind == "bnode":
+        return BNode(value["value"])
+    datatype = value.get("datatype")
+    return Literal(value["value"], lang=value.get("xml:lang"), datatype=URIRef(datatype) if datatype else None)
+
+
+def raw_json_term(value):
+    kind = value["type"]
+    if kind == "uri" or kind == "bnode":
+        return kind, value["value"], None, None
+    return "literal", value["value"], value.get("datatype"), value.get("xml:lang")
+
+
+def json_row(binding, variables, term=json_term):
+    return [term(binding[var]) if var in binding else None for var in variables]
+
+
+class JSONReader:
+    """Reads a JSON document piecewise: containers are entered one token at a time, values are decoded whole."""
+
+    def __init__(self, stream):
+        self.text = io.TextIOWrapper(stream, encoding="utf-8")
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.text.read(CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Returns the next non whitespace character without consuming it, or "" at the end of the document."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' in JSON result at '{self.buffer[self.pos:self.pos + 20]}'")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A value ending with the buffer may be a truncated number, so it is decoded again with more input.
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def keys(self):
+        """Enters an object and yields its keys. The caller has to consume the value of every key."""
+        self.expect("{")
+        while True:
+            char = self.peek()
+            if char == "}":
+                self.pos += 1
+                return
+            if char == ",":
+                self.pos += 1
+                continue
+            key = self.value()
+            self.expect(":")
+            yield key
+
+    def items(self):
+        """Enters an array and yields its elements one by one."""
+        self.expect("[")
+        while True:
+            char = self.peek()
+            if char == "]":
+                self.pos += 1
+                return
+            if char == ",":
+                self.pos += 1
+                continue
+            yield self.value()
+
+
+def json_result_rows(stream, term=json_term):
+    try:
+        reader = JSONReader(stream)
+        variables = None
+        # Bindings appearing before the head (as written by rdflib) have to wait for the variable names.
+        pending = None
+        for key in reader.keys():
+            if key == "head":
+                variables = reader.value().get("vars", [])
+                yield variables
+                if pending is not None:
+                    for binding in pending:
+                        yield json_row(binding, variables, term)
+                    pending = None
+            elif key == "results":
+                for result_key in reader.keys():
+                    if result_key != "bindings":
+                        reader.value()
+                    elif variables is None:
+                        pending = SpooledRows(None, reader.items())
+                    else:
+                        for binding in reader.items():
+                            yield json_row(binding, variables, term)
+            else:
+                reader.value()
+        if variables is None:
+            yield []
+    finally:
+        stream.close()
+
+
+def result_cell(term):
+    """Formats a result term as table cell."""
+    if term is None:
+        return ""
+    if isinstance(term, URIRef):
+        return f"&lt;{html.escape(term, quote=False)}&gt;"
+    if isinstance(term, BNode):
+        return f"&lt;_:{html.escape(term, quote=False)}&gt;"
+    cell = html.escape(term, quote=False)
+    if term.language is not None:
+        cell += f"@{term.language}"
+    if term.datatype is not None:
+        cell += f"^^{term.datatype}"
+    return cell
+
+
+def result_cell_rows(header, rows):
+    """Row iterator for html_table: the header followed by the formatted rows."""
+    yield header
+    for row in rows:
+        yield [result_cell(term) for term in row]
+
+
+class ResultRows:
+    """SELECT result whose rows are parsed when they are requested. header holds the variable names."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.header = next(rows)
+        self.count = 0
+        self.exhausted = False
+
+    def take(self, n):
+        """Returns the next n rows."""
+        page = list(islice(self.rows, n))
+        self.count += len(page)
+        if len(page) < n:
+            self.close()
+        return page
+
+    def __iter__(self):
+        for row in self.rows:
+            self.count += 1
+            yield row
+        self.close()
+
+    def close(self):
+        self.exhausted = True
+        self.rows.close()
+
+
+class SpooledRows:
+    """Rows of a SELECT result written to a temporary file, so storing them does not need memory per row. With lazy,
+    rows are only taken from rows when an iteration reaches them or by fill, so they can be shown while they arrive and
+    stored in the same pass."""
+
+    def __init__(self, header, rows, lazy=False):
+        self.header = header
+        self.file = tempfile.TemporaryFile()
+        self.count = 0
+        self.source = iter(rows)
+        if not lazy:
+            self.fill()
+
+    def _take(self):
+        """Appends the next row of the source to the file and returns it, None once the source is exhausted."""
+        if self.source is None:
+            return None
+        row = next(self.source, None)
+        if row is None:
+            self.source = None
+            self.file.flush()
+            return None
+        self.file.seek(0, os.SEEK_END)
+        pickle.dump(row, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.count += 1
+        return row
+
+    def fill(self):
+        """Spools the rows which have not been taken yet."""
+        while self._take() is not None:
+            pass
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        position = 0
+        read = 0
+        while True:
+            if read < self.count:
+                self.file.seek(position)
+                row = pickle.load(self.file)
+            else:
+                row = self._take()
+                if row is None:
+                    return
+            position = self.file.tell()
+            read += 1
+            yield row
@@ -1,13 +1,19 @@
 import rdflib
 from IPython.display import display_pretty
-from owlrl import DeductiveClosure, RDFS_Semantics, OWLRL_Semantics
 from .rdf_module import RDFModule
-from .graph import parse_graph, draw_graph
-from .table import graph_spo_iterator, html_table
-from .util import strip_comments
+from .cache import ParseCache
+from .compact_store import CompactStore
+from .entailment import engines, entail
+from .graph import add_draw_arguments, draw_graph, draw_options, parse_graph, stores
+from .jobs import add_background_argument
+from .stats import stats
+from .table import display_graph_table
+from .util import StopCellExecution, strip_comments
 
 displays = ["graph", "table", "raw", "none"]
 formats = ["turtle", "json-ld", "xml", "n3"]
+# Shared by all serialization modules. The format is part of the cache key.
+parse_cache = ParseCache()
 
 
 class SerializationModule(RDFModule):
@@ -23,7 +29,26 @@ class SerializationModule(RDFModule):
             "--prefix", "-p", help="Define a prefix which gets prepend to every query. Useful for PREFIX declarations", action="store_true")
         self.parser.add_argument(
             "--entail", "-e", choices=["rdfs", "owl", "rdfs+owl"], help="Uses a brute force implementation of the finite version of RDFS semantics or OWL 2 RL. Uses owlrl python package.")
+        self.parser.add_argument(
+            "--engine", choices=engines, default="owlrl", help="Reasoner used for --entail. The native engine evaluates the RDFS rules on integer encoded triples using numpy and only supports the RDFS regime")
+        self.parser.add_argument(
+            "--store", choices=stores, default="default", help="Store backing the parsed graph. The compact store needs several times less memory for large graphs")
+        self.parser.add_argument(
+            "--no-cache", help="Always reparse the cell instead of reusing the graph of an identical earlier cell", action="store_true")
+        self.parser.add_argument(
+            "--cache-dir", help="Additionally keep parsed graphs in this directory so they survive kernel restarts")
+        self.parser.add_argument(
+            "--limit", type=int, default=100, help="Number of rows per page when display is set to table")
+        self.parser.add_argument(
+            "--offset", type=int, default=0, help="Number of triples skipped before the first page when display is set to table")
+        add_draw_arguments(self.parser)
+        add_background_argument(self.parser)
         self.prefix = ""
+        # TurtleState of the last run of each labelled cell.
+        self.states = dict()
+
+    def copies_graphs(self, params):
+        return params.label in self.states
 
     def handle(self, params, store):
         if params.cell is not None:
@@ -31,35 +56,99 @@ class SerializationModule(RDFModule):
                 self.prefix = params.cell + "\n"
                 self.log("Stored prefix.")
             else:
+                if params.cache_dir is not None:
+                    parse_cache.set_spill_dir(params.cache_dir)
                 try:
-                    code = strip_comments(params.cell)
-                    g = parse_graph(self.prefix + code,
-                                    self.logger, self.name)
+                    g = None
+                    delta = None
+                    code = None
+                    # Labelled Turtle cells remember their statements instead of using the parse cache, a re-run
+                    # only parses the changed statements.
+                    incremental = self.name == "turtle" and params.label is not None and not params.no_cache
+                    if incremental and params.label in self.states:
+                        with stats.phase("strip comments"):
+                            code = strip_comments(params.cell)
+                        g, delta = self.reparse(params.label, self.prefix + code, params.entail, params.engine,
+                                                params.store, store)
+                    key = parse_cache.key(self.name, self.prefix, params.cell)
+                    if g is None and not params.no_cache and not incremental:
+                        with stats.phase("parse cache") as phase:
+                            g = parse_cache.get(key, params.store)
+                            phase.count(hits=int(g is not None))
+                    if g is None:
+                        if code is None:
+                            with stats.phase("strip comments"):
+                                code = strip_comments(params.cell)
+                        if incremental:
+                            g = self.parse_labelled(params.label, self.prefix + code, params.store)
+                        else:
+                            g = parse_graph(self.prefix + code,
+                                            self.logger, self.name, params.store)
+                        if not params.no_cache:
+                            parse_cache.put(key, g)
+                    self.log(parse_cache.stats(), True)
                 except Exception as e:
                     self.log(f"Parse failed:\n{str(e)}")
                     store["rdfgraphs"]["last"] = None
                     store["rdfsources"]["last"] = self.prefix + params.cell
                     return
                 g.source = lambda: self.name
+                g.delta = delta
                 if params.label is not None:
                     store["rdfgraphs"][params.label] = g
                     store["rdfsources"][params.label] = self.prefix + params.cell
                 store["rdfgraphs"]["last"] = g
                 store["rdfsources"]["last"] = self.prefix + params.cell
-                if params.entail is not None:
-                    if params.entail == "rdfs":
-                        DeductiveClosure(RDFS_Semantics).expand(g)
-                    elif params.entail == "owl":
-                        DeductiveClosure(OWLRL_Semantics).expand(g)
-                    elif params.entail == "rdfs+owl":
-                        DeductiveClosure(
-                            OWLRL_Semantics, rdfs_closure=True).expand(g)
+                if params.entail is not None and getattr(g, "entailment", None) is None:
+                    entail(g, params.entail, params.engine)
                 if params.display == "none":
                     return
                 elif params.display == "graph":
-                    draw_graph(g, self.logger)
+                    draw_graph(g, self.logger, **draw_options(params))
                 elif params.display == "table":
-                    self.logger.display_html(html_table(graph_spo_iterator(g)))
+                    display_graph_table(g, self.logger, params.limit, params.offset)
                 else:
-                    display_pretty(g.serialize(format=params.serialize,
-                                               encoding="utf-8",).decode("utf-8"), raw=True)
+                    with stats.phase("serialize"):
+                        text = g.serialize(format=params.serialize, encoding="utf-8",).decode("utf-8")
+                    display_pretty(text, raw=True)
+
+    def reparse(self, label, text, regime, engine, backend, store):
+        """Applies the changes of a labelled Turtle cell since its last run to its graph. Returns the graph and its
+        GraphDelta, or None and None if the whole cell has to be parsed, e.g. because its entailment changed."""
+        state = self.states[label]
+        g = store["rdfgraphs"].peek(label) if label in store["rdfgraphs"] else None
+        entailment = getattr(g, "entailment", None)
+        if (g is None or g is not state.graph or
+                ("compact" if isinstance(g.store, CompactStore) else "default") != backend or
+                (entailment is not None and (entailment.regime, entailment.engine) != (regime, engine))):
+            del self.states[label]
+            return None, None
+        # In background jobs, this is a copy which replaces the graph when the job completes.
+        g = store["rdfgraphs"][label]
+        state.graph = g
+        if not state.is_current(g):
+            del self.states[label]
+            return None, None
+        with stats.phase("incremental parse") as phase:
+            delta = state.update(text)
+            if delta is None:
+                del self.states[label]
+                return None, None
+            store["rdfgraphs"].changed(label)
+            phase.count(statements=delta.statements_added, added=delta.added, removed=delta.removed)
+        self.log(f"Parsed {delta.statements_added} changed statements: {len(delta.added)} triples added, "
+                 f"{len(delta.removed)} removed.", True)
+        return g, delta
+
+    def parse_labelled(self, label, text, backend):
+        """Parses a labelled Turtle cell statement by statement and remembers its statements for the next run."""
+        from .incremental import parse_turtle
+        try:
+            with stats.phase("parse") as phase:
+                g, state = parse_turtle(text, backend)
+                phase.count(characters=len(text), triples=g)
+        except Exception as err:
+            self.logger.print(f"Could not parse {self.name} graph:<br>{str(err)}")
+            raise StopCellExecution
+        self.states[label] = state
+        return g
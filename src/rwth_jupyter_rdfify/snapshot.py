@@ -0,0 +1,208 @@
+"""Binary snapshot format for labelled graphs.
+
+A snapshot holds a term dictionary shared by all graphs and one integer encoded triple array per graph.
+Layout: MAGIC | sections | header (JSON) | header length (uint64) | MAGIC
+The header names the byte range of every section, the labels and namespace bindings of every graph and a SHA-256
+checksum over all sections. Loading maps the file into memory and slices the sections without any parsing."""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from rdflib import BNode, Literal, URIRef
+
+from .compact_store import CompactStore
+from .graph import new_graph
+
+MAGIC = b"RDFSNAP1"
+URI, BLANK, LITERAL = 0, 1, 2
+
+
+def id_typecode(n):
+    """Smallest array typecode with at least 4 or 8 bytes, depending on the number of terms."""
+    size = 4 if n < 2 ** 32 else 8
+    for code in "IL" if size == 4 else "LQ":
+        if array(code).itemsize == size:
+            return code
+    return "Q"
+
+
+class SectionWriter:
+    def __init__(self, f):
+        self.f = f
+        self.offset = f.tell()
+        self.sections = dict()
+        self.hash = hashlib.sha256()
+
+    def write(self, name, data):
+        if isinstance(data, array):
+            if sys.byteorder != "little":
+                data = array(data.typecode, data)
+                data.byteswap()
+            data = data.tobytes()
+        self.f.write(data)
+        self.hash.update(data)
+        self.sections[name] = [self.offset, len(data)]
+        self.offset += len(data)
+
+
+def save_snapshot(path, graphs):
+    """Writes a dict of labelled graphs into one snapshot file. Labels referring to the same graph share its data.
+    A graph may also be given as function returning it, which is called when the graph is written, so graphs can be
+    loaded one at a time."""
+    ids = dict()
+    kinds = bytearray()
+    offsets = array("Q", [0])
+    datatypes = array("q")
+    langs = array("q")
+    lang_table = dict()
+    values = bytearray()
+
+    def encode(term):
+        i = ids.get(term)
+        if i is not None:
+            return i
+        datatype = -1
+        lang = -1
+        if isinstance(term, Literal):
+            if term.datatype is not None:
+                # Datatypes are encoded first, so they can be decoded before the literals using them.
+                datatype = encode(term.datatype)
+            if term.language is not None:
+                lang = lang_table.setdefault(term.language, len(lang_table))
+            kinds.append(LITERAL)
+        else:
+            kinds.append(BLANK if isinstance(term, BNode) else URI)
+        i = ids[term] = len(ids)
+        values.extend(str(term).encode("utf-8"))
+        offsets.append(len(values))
+        datatypes.append(datatype)
+        langs.append(lang)
+        return i
+
+    unique = []
+    for label, g in graphs.items():
+        if g is None:
+            continue
+        for entry in unique:
+            if entry[0] is g:
+                entry[1].append(label)
+                break
+        else:
+            unique.append((g, [label]))
+
+    encoded = []
+    for g, labels in unique:
+        if callable(g):
+            g = g()
+        triples = array("Q", (encode(term) for triple in g for term in triple))
+        encoded.append((labels, triples, [[prefix, str(namespace)] for prefix, namespace in g.namespaces()]))
+    code = id_typecode(len(ids))
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        writer = SectionWriter(f)
+        writer.write("kinds", bytes(kinds))
+        writer.write("offsets", offsets)
+        writer.write("values", bytes(values))
+        writer.write("datatypes", datatypes)
+        writer.write("langs", langs)
+        header_graphs = []
+        for n, (labels, triples, namespaces) in enumerate(encoded):
+            writer.write(f"graph{n}", triples if code == triples.typecode else array(code, triples))
+            header_graphs.append({
+                "labels": labels,
+                "section": f"graph{n}",
+                "triples": len(triples) // 3,
+                "namespaces": namespaces,
+            })
+        header = json.dumps({
+            "version": 1,
+            "terms": len(ids),
+            "id_typecode": code,
+            "typecodes": {"offsets": offsets.typecode, "datatypes": datatypes.typecode, "langs": langs.typecode},
+            "langs": list(lang_table),
+            "sections": writer.sections,
+            "graphs": header_graphs,
+            "sha256": writer.hash.hexdigest(),
+        }).encode("utf-8")
+        f.write(header)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(MAGIC)
+    os.replace(tmp, path)
+    return sum(g["triples"] for g in header_graphs)
+
+
+def read_array(view, header, name, code):
+    offset, length = header["sections"][name]
+    data = array(code)
+    data.frombytes(view[offset:offset + length])
+    if sys.byteorder != "little":
+        data.byteswap()
+    return data
+
+
+def load_snapshot(path, store="default", verify=True):
+    """Reads a snapshot file and returns a dict mapping every label to its rebuilt graph."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        try:
+            if view[:len(MAGIC)] != MAGIC or view[-len(MAGIC):] != MAGIC:
+                raise ValueError(f"'{path}' is not a graph snapshot")
+            end = len(view) - len(MAGIC) - 8
+            header_length = struct.unpack("<Q", view[end:end + 8])[0]
+            header = json.loads(str(view[end - header_length:end], "utf-8"))
+            if verify:
+                h = hashlib.sha256()
+                h.update(view[len(MAGIC):end - header_length])
+                if h.hexdigest() != header["sha256"]:
+                    raise ValueError(f"Checksum mismatch, snapshot '{path}' is corrupted")
+
+            typecodes = header["typecodes"]
+            offsets = read_array(view, header, "offsets", typecodes["offsets"])
+            datatypes = read_array(view, header, "datatypes", typecodes["datatypes"])
+            langs = read_array(view, header, "langs", typecodes["langs"])
+            start = header["sections"]["kinds"][0]
+            kinds = bytes(view[start:start + header["terms"]])
+            base = header["sections"]["values"][0]
+            lang_table = header["langs"]
+
+            terms = []
+            for i in range(header["terms"]):
+                value = str(view[base + offsets[i]:base + offsets[i + 1]], "utf-8")
+                kind = kinds[i]
+                if kind == URI:
+                    terms.append(URIRef(value))
+                elif kind == BLANK:
+                    terms.append(BNode(value))
+                else:
+                    terms.append(Literal(
+                        value,
+                        lang=lang_table[langs[i]] if langs[i] >= 0 else None,
+                        datatype=terms[datatypes[i]] if datatypes[i] >= 0 else None))
+
+            graphs = dict()
+            for entry in header["graphs"]:
+                triples = read_array(view, header, entry["section"], header["id_typecode"])
+                g = new_graph(store)
+                for prefix, namespace in entry["namespaces"]:
+                    g.bind(prefix, namespace, override=True)
+                bulk_insert(g, terms, triples)
+                for label in entry["labels"]:
+                    graphs[label] = g
+        finally:
+            view.release()
+    return graphs
+
+
+def bulk_insert(g, terms, triples):
+    """Adds the encoded triples to g. The compact store is rebuilt directly from the ids."""
+    if isinstance(g.store, CompactStore) and len(g) == 0:
+        g.store.load_encoded(terms, zip(triples[0::3], triples[1::3], triples[2::3]))
+    else:
+        g.addN((terms[triples[k]], terms[triples[k + 1]], terms[triples[k + 2]], g)
+               for k in range(0, len(triples), 3))
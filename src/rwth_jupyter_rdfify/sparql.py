@@ -1,9 +1,21 @@
-from IPython.display import display, display_pretty
-from SPARQLWrapper import SPARQLWrapper
+import html
+import time
+from itertools import chain, islice
+
+import rdflib
+from IPython.display import HTML, display, display_pretty
 
 from .rdf_module import RDFModule
 from .graph import parse_graph, draw_graph
-from .table import display_table, html_table
+from .federation import FederatedQuery, is_endpoint
+from .jobs import add_background_argument
+from .local_query import LocalQuery
+from .paging import PageFetcher, PagedQuery
+from .prepared import prepared_queries
+from .results import ResultRows, SpooledRows, result_cell_rows, result_mime_types, result_rows
+from .sparql_client import SPARQLClient
+from .stats import stats
+from .table import display_graph_table, display_pager, display_table, html_table
 
 def parse_header(line):
     """Replacement for cgi.parse_header"""
@@ -30,6 +42,10 @@ mime_types = {
     "application/sparql-results+json": ["table"],
 }
 
+client = SPARQLClient()
+# Seconds between two updates of the rows shown while a local query runs.
+PROGRESS_INTERVAL = 0.5
+
 
 class SPARQLModule(RDFModule):
     def __init__(self, name, parser, logger, description, displayname):
@@ -46,51 +62,288 @@ class SPARQLModule(RDFModule):
             "--local", "-l", help="Give a label of a local graph. This cell will then ignore the endpoint and query the graph instead")
         self.parser.add_argument(
             "--store", "-s", help="Store result of the query with this label")
+        self.parser.add_argument(
+            "--no-cache", help="Always send the query to the endpoint instead of reusing a cached result", action="store_true")
+        self.parser.add_argument(
+            "--cache-ttl", type=float, help="Seconds for which results of remote queries are cached (default 600)")
+        self.parser.add_argument(
+            "--no-compression", help="Do not request gzip compressed responses", action="store_true")
+        self.parser.add_argument(
+            "--limit", type=int, default=100, help="Number of rows per page when display is set to table. Further rows of remote results are only read when their page is shown")
+        self.parser.add_argument(
+            "--offset", type=int, default=0, help="Number of rows skipped before the first page when display is set to table")
+        self.parser.add_argument(
+            "--paged", help="Fetch the result of a SELECT or CONSTRUCT query from the endpoint in pages, for endpoints which cap the size of results", action="store_true")
+        self.parser.add_argument(
+            "--page-size", type=int, default=10000, help="Number of solutions per page of a paged query")
+        self.parser.add_argument(
+            "--concurrency", type=int, default=4, help="Number of pages of a paged query fetched at the same time")
+        self.parser.add_argument(
+            "--retries", type=int, default=3, help="Number of times a failed page is requested again, waiting longer each time")
+        self.parser.add_argument(
+            "--federate", nargs="+", metavar="TARGET", help="Run the query on all of these endpoints and labelled local graphs at once and merge the results")
+        self.parser.add_argument(
+            "--distinct", help="Leave out rows of a federated query which another target returned already", action="store_true")
+        self.parser.add_argument(
+            "--source-column", help="Add a column naming the target which returned the row to federated results", action="store_true")
+        self.parser.add_argument(
+            "--timeout", type=float, help="Seconds after which a local query is stopped. The rows found until then are displayed and stored")
+        self.parser.add_argument(
+            "--max-rows", type=int, default=100000, help="Maximum number of rows of a local SELECT query (default 100000)")
+        add_background_argument(self.parser)
         self.prefix = ""
-        self.wrapper = None
+        self.endpoint = None
 
     def query(self, query, params):
         self.log(params)
         if params.endpoint is not None:
-            self.wrapper = SPARQLWrapper(params.endpoint)
-        if self.wrapper is not None:
-            self.wrapper.setQuery(self.prefix + query)
-            self.wrapper.setReturnFormat(params.format)
+            self.endpoint = params.endpoint
+        if self.endpoint is not None:
+            if params.cache_ttl is not None:
+                client.cache.ttl = params.cache_ttl
             try:
-                result = self.wrapper.query()
-                if result._get_responseFormat() != params.format:
+                if params.paged:
+                    return self.query_paged(query, params)
+                with stats.phase("request") as phase:
+                    result = client.query(self.endpoint, query, params.format,
+                                          not params.no_cache, not params.no_compression)
+                    phase.count(cached=int(result.cached))
+                if result.format != params.format:
                     self.log(
                         f"""
 The server responded with a format different from the requested format.\n
 Either the server does not support the requested format or the query resulted in an incompatible type.\n
-Requested: '{params.format}', Response: '{result._get_responseFormat()}'
+Requested: '{params.format}', Response: '{result.format}'
                         """)
-                content_type = parse_header(result.info()["content-type"])
-                body = result.response.read()
-                self.display_response(body, content_type[0], params.display)
+                origin = "result cache" if result.cached else f"endpoint in {result.elapsed:.2f}s"
+                self.log(f"Response from {origin}. {client.cache.stats()}", True)
+                content_type = parse_header(result.content_type)
+                if params.display == "table" and content_type[0] in result_mime_types:
+                    return self.display_rows(result, content_type[0], params)
+                self.display_response(result.body, content_type[0], params.display, params.limit, params.offset)
                 return result
             except Exception as e:
                 self.log(f"Error during query:\n{str(e)}")
         else:
             self.log("Endpoint not set. Use --endpoint parameter.")
 
-    def queryLocal(self, query, graph):
+    def query_paged(self, query, params):
+        """Fetches the result of query page by page. SELECT rows are spooled to disk as the pages arrive,
+        CONSTRUCT results are collected into a graph."""
         try:
-            res = graph.query(query)
-            if res.type == "SELECT":
-                self.logger.display_html(
-                    html_table(select_result_row_iter(res)))
-            elif res.type == "ASK":
-                self.logger.print(res.askAnswer)
-            elif res.type == "CONSTRUCT":
-                draw_graph(res.graph, self.logger)
-            elif res.type == "DESCRIBE":
-                draw_graph(res.graph, self.logger)
-            return res
+            paged = PagedQuery(query, params.page_size)
         except Exception as e:
-            self.log(f"Error during local query:\n{str(e)}")
+            self.log(f"Can not page this query: {e}")
+            return None
+        fetcher = PageFetcher(client, self.endpoint, paged, params.format, params.concurrency, params.retries,
+                              use_cache=not params.no_cache, compress=not params.no_compression)
+        started = time.monotonic()
+        handle = None
+        total = 0
+
+        def progress(page):
+            nonlocal handle, total
+            total += len(page.items)
+            unit = "rows" if paged.type == "SELECT" else "triples"
+            handle = self.logger.progress(
+                f"Fetched {page.number + 1} pages with {total} {unit} in {time.monotonic() - started:.1f}s", handle)
+
+        pages = fetcher.pages()
+        if paged.type == "SELECT":
+            with stats.phase("paged fetch") as phase:
+                first = next(pages)
+                progress(first)
+
+                def rows():
+                    yield from first.items
+                    for page in pages:
+                        progress(page)
+                        yield from page.items
+
+                spooled = SpooledRows(first.header, rows())
+                phase.count(rows=spooled)
+            for warning in fetcher.warnings:
+                self.log(warning)
+            if params.display != "none":
+                display_pager(self.logger, lambda: result_cell_rows(spooled.header, spooled),
+                              params.limit, params.offset, len(spooled))
+            return spooled
+        g = rdflib.Graph()
+        with stats.phase("paged fetch") as phase:
+            for page in pages:
+                progress(page)
+                g.addN((s, p, o, g) for s, p, o in page.items)
+            phase.count(triples=g)
+        for warning in fetcher.warnings:
+            self.log(warning)
+        if params.display == "graph":
+            draw_graph(g, self.logger)
+        elif params.display == "table":
+            display_graph_table(g, self.logger, params.limit, params.offset)
+        elif params.display == "raw":
+            self.logger.print(g.serialize(format="turtle"))
+        return g
 
-    def display_response(self, body, mime, method):
+    def query_federated(self, query, params, store):
+        """Runs query on all targets given by --federate. SELECT rows are merged into one result while they arrive,
+        CONSTRUCT and DESCRIBE results into one graph."""
+        targets = dict()
+        for target in params.federate:
+            if is_endpoint(target):
+                targets[target] = None
+            elif target in store["rdfgraphs"]:
+                targets[target] = store["rdfgraphs"][target]
+            else:
+                self.log(f"'{target}' is neither an endpoint URL nor the label of a local graph.")
+                return None
+        federated = FederatedQuery(targets, query, client, self.prefix, params.format, not params.no_cache,
+                                   not params.no_compression)
+        if federated.kind == "ASK":
+            self.log("Federated queries support SELECT, CONSTRUCT and DESCRIBE queries.")
+            return None
+        federated.start()
+        handle = None
+        received = 0
+
+        def on_event(event, name, value):
+            nonlocal handle, received
+            received += event == "row"
+            if event != "row" or received % 1000 == 0:
+                handle = self.logger.show(HTML(self.federation_summary(federated)), handle)
+
+        def header():
+            return (federated.header or []) + (["source"] if params.source_column else [])
+
+        def cell_rows():
+            # The header is known once the first row has arrived.
+            rows = iter(res)
+            first = list(islice(rows, 1))
+            res.header = header()
+            return result_cell_rows(res.header, chain(first, rows))
+
+        try:
+            with stats.phase("federated query") as phase:
+                if federated.kind == "SELECT":
+                    # The first page is shown as soon as its rows arrived, all rows are spooled in the same pass.
+                    res = SpooledRows(None, federated.rows(params.distinct, params.source_column, on_event), lazy=True)
+                    pager = None
+                    if params.display != "none":
+                        pager = display_pager(self.logger, cell_rows, params.limit, params.offset)
+                    res.fill()
+                    res.header = header()
+                    if pager is not None:
+                        pager.total = len(res)
+                else:
+                    res = rdflib.Graph()
+                    for event, name, value in federated.events():
+                        on_event(event, name, value)
+                        if event == "row":
+                            res.add(value)
+                phase.count(targets=federated.targets, rows=res)
+        except KeyboardInterrupt:
+            federated.cancel()
+            self.log("Federated query cancelled.")
+            return None
+        if handle is not None:
+            handle.update(HTML(self.federation_summary(federated)))
+        if federated.kind == "SELECT":
+            return res
+        if params.display == "graph":
+            draw_graph(res, self.logger)
+        elif params.display == "table":
+            display_graph_table(res, self.logger, params.limit, params.offset)
+        elif params.display == "raw":
+            self.logger.print(res.serialize(format="turtle"))
+        return res
+
+    def federation_summary(self, federated):
+        rows = [["target", "rows", "first row", "total", "status"]]
+        for target in federated.stats.values():
+            first = f"{target.first_row:.2f}s" if target.first_row is not None else ""
+            if target.elapsed is None:
+                total, status = "", "running"
+            else:
+                total = f"{target.elapsed:.2f}s"
+                status = html.escape(str(target.error)) if target.error is not None else "done"
+            rows.append([html.escape(target.name), target.rows, first, total, status])
+        return html_table(iter(rows))
+
+    def display_rows(self, result, mime, params):
+        """Displays the first page of a result while it is parsed. The remaining rows are spooled to disk if the
+        result is stored, otherwise they stay unread until their page is shown."""
+        rows = ResultRows(result_rows(result.open(), mime))
+        if params.store is not None:
+            spooled = SpooledRows(rows.header, rows)
+            display_pager(self.logger, lambda: result_cell_rows(spooled.header, spooled),
+                          params.limit, params.offset, len(spooled))
+            return spooled
+        display_pager(self.logger, None, params.limit, params.offset, rows=result_cell_rows(rows.header, rows))
+        return rows
+
+    def queryLocal(self, query, graph, limit=100, offset=0, timeout=None, max_rows=None):
+        """Runs query in a worker thread while the rows found so far are shown. The query is stopped after timeout
+        seconds, max_rows rows or when the kernel is interrupted, then the rows found until then are displayed."""
+        job = LocalQuery(graph, query, self.prefix, max_rows).start()
+        started = time.monotonic()
+        handle = None
+        shown = 0
+        stopped = None
+        try:
+            while not job.wait(PROGRESS_INTERVAL):
+                elapsed = time.monotonic() - started
+                if timeout is not None and elapsed >= timeout:
+                    stopped = f"Stopped after the time limit of {timeout:g}s"
+                    break
+                if len(job.rows) != shown or handle is None:
+                    shown = len(job.rows)
+                    handle = self.logger.show(HTML(self.progress_html(job, elapsed, limit)), handle)
+        except KeyboardInterrupt:
+            stopped = "Query cancelled"
+        if stopped is not None:
+            job.cancel()
+            job.wait(PROGRESS_INTERVAL)
+        if job.truncated:
+            stopped = f"Stopped after {max_rows} rows, use --max-rows to get more"
+        self.log(f"{job.timings}. {prepared_queries.stats()}", True)
+        if not job.timings.cached:
+            stats.add("query parse", job.timings.parse)
+            stats.add("query translate", job.timings.translate)
+        stats.add("query evaluate", job.timings.evaluate, rows=len(job.rows))
+        if job.error is not None:
+            if handle is not None:
+                handle.update(HTML(""))
+            self.log(f"Error during local query:\n{str(job.error)}")
+            return None
+        res = job.partial()
+        if stopped is not None:
+            message = f"{stopped}. Showing the {len(job.rows)} rows found so far." if res is not None else f"{stopped}."
+        else:
+            message = ""
+        if handle is not None:
+            handle.update(HTML(f"<p>{message}</p>" if message else ""))
+        elif message:
+            self.log(message)
+        if res is None:
+            return None
+        if res.type == "SELECT":
+            display_pager(self.logger, lambda: select_result_row_iter(res), limit, offset)
+        elif res.type == "ASK":
+            self.logger.print(res.askAnswer)
+        elif res.type == "CONSTRUCT":
+            draw_graph(res.graph, self.logger)
+        elif res.type == "DESCRIBE":
+            draw_graph(res.graph, self.logger)
+        return res
+
+    def progress_html(self, job, elapsed, limit):
+        rows = job.rows[:limit]
+        status = f"<p>Query running for {elapsed:.0f}s, {len(job.rows)} rows so far. Interrupt the kernel to stop it.</p>"
+        if not rows or job.result is None:
+            return status
+        header = [var.n3() for var in job.result.vars]
+        return html_table(chain([header], rows)) + status
+
+    def display_response(self, body, mime, method, limit=100, offset=0):
         if method == "none":
             return
         if not mime in mime_types:
@@ -102,7 +355,7 @@ Requested: '{params.format}', Response: '{result._get_responseFormat()}'
                 g = parse_graph(body, self.logger)
                 draw_graph(g, self.logger)
             elif method == "table":
-                display_table(body, mime, self.logger)
+                display_table(body, mime, self.logger, limit, offset)
         else:
             if method != "raw":
                 self.log(
@@ -114,10 +367,20 @@ Requested: '{params.format}', Response: '{result._get_responseFormat()}'
             if params.prefix:
                 self.prefix = params.cell + "\n"
                 self.log("Stored prefix.")
+            elif params.federate is not None:
+                res = self.query_federated(params.cell, params, store)
+                if params.store is not None:
+                    store["rdfresults"][params.store] = res
+                    store["rdfsources"][params.store] = params.cell
+                    if isinstance(res, rdflib.Graph):
+                        res.source = lambda: self.name
+                        store["rdfgraphs"][params.store] = res
+                store["rdfresults"]["last"] = res
+                store["rdfsources"]["last"] = params.cell
             elif params.local is not None:
                 if params.local in store["rdfgraphs"]:
-                    res = self.queryLocal(
-                        self.prefix + params.cell, store["rdfgraphs"][params.local])
+                    res = self.queryLocal(params.cell, store["rdfgraphs"][params.local], params.limit,
+                                          params.offset, params.timeout, params.max_rows)
                     if params.store is not None:
                         store["rdfresults"][params.store] = res
                         store["rdfsources"][params.store] = params.cell
@@ -129,6 +392,10 @@ Requested: '{params.format}', Response: '{result._get_responseFormat()}'
                 res = self.query(self.prefix + params.cell, params)
                 if params.store is not None:
                     store["rdfresults"][params.store] = res
+                    if isinstance(res, rdflib.Graph):
+                        # Paged CONSTRUCT results can be queried like parsed graphs.
+                        res.source = lambda: self.name
+                        store["rdfgraphs"][params.store] = res
                     store["rdfsources"][params.store] = params.cell
                 store["rdfresults"]["last"] = res
                 store["rdfsources"]["last"] = params.cell
@@ -0,0 +1,222 @@
+"""HTTP client for remote SPARQL endpoints.
+
+Every endpoint gets its own keep-alive session with a connection pool, so consecutive cells reuse open connections.
+Response bodies are streamed, so large results can be parsed while they arrive. Bodies which were read completely and
+are not too large are kept in a result cache keyed by endpoint, query and format, which expires entries after a time to
+live and evicts the least recently used ones."""
+import copy
+import io
+import json
+import time
+from xml.dom import minidom
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .cache import LRUCache, content_key
+
+accept_headers = {
+    "xml": "application/sparql-results+xml, application/rdf+xml;q=0.9, application/xml;q=0.5",
+    "json": "application/sparql-results+json, application/json;q=0.9, application/ld+json;q=0.8",
+}
+# Queries longer than this are sent as POST request instead of being encoded into the URL.
+MAX_GET_LENGTH = 2000
+# Larger response bodies are not cached.
+MAX_CACHED_BODY = 16 << 20
+CHUNK_SIZE = 1 << 16
+
+
+def response_format(mime):
+    if "json" in mime:
+        return "json"
+    if "xml" in mime:
+        return "xml"
+    return mime
+
+
+class SPARQLResponse:
+    """Metadata and body of an endpoint response. The body is either read at once through body or streamed once
+    through open(). cached tells whether it was served from the result cache."""
+
+    def __init__(self, endpoint, query, content_type, elapsed, body=None, stream=None, cached=False):
+        self.endpoint = endpoint
+        self.query = query
+        self.content_type = content_type
+        self.elapsed = elapsed
+        self._body = body
+        self.stream = stream
+        self.cached = cached
+
+    @property
+    def body(self):
+        if self._body is None:
+            with self.open() as stream:
+                self._body = stream.read()
+        return self._body
+
+    def open(self):
+        """Returns the body as binary file object."""
+        if self._body is not None:
+            return io.BytesIO(self._body)
+        if self.stream is None:
+            raise ValueError("The response body has already been read")
+        stream, self.stream = self.stream, None
+        return stream
+
+    @property
+    def format(self):
+        return response_format(self.content_type.split(";")[0].strip())
+
+    def convert(self):
+        """Parses the body like SPARQLWrapper does: JSON into a dict, XML into a DOM document."""
+        if self.format == "json":
+            return json.loads(self.body)
+        if self.format == "xml":
+            return minidom.parseString(self.body)
+        return self.body.decode("utf-8")
+
+
+class CachingReader(io.RawIOBase):
+    """Reads the decoded body of a streamed response and hands it to on_complete once it was read completely,
+    unless it exceeds limit bytes."""
+
+    def __init__(self, response, limit, on_complete):
+        self.response = response
+        self.chunks = response.iter_content(CHUNK_SIZE)
+        self.chunk = memoryview(b"")
+        self.body = bytearray()
+        self.limit = limit
+        self.on_complete = on_complete
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.chunk:
+            chunk = next(self.chunks, b"")
+            if not chunk:
+                if self.body is not None:
+                    self.on_complete(bytes(self.body))
+                    self.body = None
+                return 0
+            if self.body is not None:
+                self.body.extend(chunk)
+                if len(self.body) > self.limit:
+                    self.body = None
+            self.chunk = memoryview(chunk)
+        n = min(len(buffer), len(self.chunk))
+        buffer[:n] = self.chunk[:n]
+        self.chunk = self.chunk[n:]
+        return n
+
+    def close(self):
+        self.response.close()
+        super().close()
+
+
+class ResultCache(LRUCache):
+    """LRU cache of responses whose entries expire ttl seconds after they were stored.
+    Least recently used entries are also evicted while the bodies take more than max_bytes."""
+
+    def __init__(self, maxsize=64, ttl=600, max_bytes=64 << 20):
+        super().__init__(maxsize)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+        stored, value = entry
+        if time.monotonic() - stored > self.ttl:
+            self.pop(key)
+            # Counted as miss instead of hit.
+            self.hits -= 1
+            self.misses += 1
+            return default
+        return value
+
+    def put(self, key, value):
+        self.pop(key)
+        self.nbytes += len(value.body)
+        evicted = super().put(key, (time.monotonic(), value))
+        for _, (_, response) in evicted:
+            self.nbytes -= len(response.body)
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            evicted.append(self.entries.popitem(last=False))
+            self.nbytes -= len(evicted[-1][1][1].body)
+        return evicted
+
+    def pop(self, key, default=None):
+        entry = super().pop(key)
+        if entry is None:
+            return default
+        self.nbytes -= len(entry[1].body)
+        return entry
+
+    def clear(self):
+        super().clear()
+        self.nbytes = 0
+
+
+class SPARQLClient:
+    def __init__(self, cache_size=64, ttl=600, pool_size=4, timeout=60):
+        self.sessions = dict()
+        self.cache = ResultCache(cache_size, ttl)
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+    def session(self, endpoint):
+        """Returns the keep-alive session of an endpoint, creating it on first use."""
+        session = self.sessions.get(endpoint)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self.sessions[endpoint] = session
+        return session
+
+    def key(self, endpoint, query, fmt):
+        return content_key(endpoint, query, fmt)
+
+    def query(self, endpoint, query, fmt="xml", use_cache=True, compress=True):
+        """Sends query to endpoint and returns a SPARQLResponse with a streamed body.
+        Raises requests exceptions on failure."""
+        key = self.key(endpoint, query, fmt)
+        if use_cache:
+            response = self.cache.get(key)
+            if response is not None:
+                # A copy, the cached response is shared by all later hits.
+                response = copy.copy(response)
+                response.cached = True
+                return response
+
+        headers = {"Accept": accept_headers[fmt], "Accept-Encoding": "gzip, deflate" if compress else "identity"}
+        start = time.perf_counter()
+        session = self.session(endpoint)
+        if len(query) > MAX_GET_LENGTH:
+            http_response = session.post(endpoint, data={"query": query}, headers=headers, timeout=self.timeout,
+                                         stream=True)
+        else:
+            http_response = session.get(endpoint, params={"query": query}, headers=headers, timeout=self.timeout,
+                                        stream=True)
+        try:
+            http_response.raise_for_status()
+        except requests.HTTPError:
+            http_response.close()
+            raise
+        content_type = http_response.headers.get("Content-Type", "application/xml")
+        elapsed = time.perf_counter() - start
+
+        def on_complete(body):
+            self.cache.put(key, SPARQLResponse(endpoint, query, content_type, elapsed, body=body))
+
+        stream = io.BufferedReader(CachingReader(http_response, MAX_CACHED_BODY, on_complete), CHUNK_SIZE)
+        return SPARQLResponse(endpoint, query, content_type, elapsed, stream=stream)
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+        self.sessions = dict()
@@ -0,0 +1,293 @@
+"""Persistent rdflib store in a SQLite database file.
+
+One database file can hold several labelled graphs. Terms are stored once in a term table and triples as integer ids
+with SPO, POS and OSP indexes, so graphs can be reopened after a kernel restart without parsing. Lookups fetch their
+results in pages and only decode the terms they need, so queries do not load the whole graph into memory. The
+connection may be used from several threads, e.g. by queries running in a worker thread or graphs loaded by a
+background job, and every access to it holds the lock of the store."""
+import functools
+import sqlite3
+import threading
+from pathlib import Path
+
+import rdflib
+from rdflib import BNode, Literal, URIRef, plugin
+from rdflib.store import Store, VALID_STORE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS terms (
+    id INTEGER PRIMARY KEY, kind TEXT NOT NULL, value TEXT NOT NULL, datatype TEXT NOT NULL, lang TEXT NOT NULL,
+    UNIQUE (kind, value, datatype, lang));
+CREATE TABLE IF NOT EXISTS graphs (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS triples (
+    g INTEGER NOT NULL, s INTEGER NOT NULL, p INTEGER NOT NULL, o INTEGER NOT NULL,
+    PRIMARY KEY (g, s, p, o)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS triples_pos ON triples (g, p, o, s);
+CREATE INDEX IF NOT EXISTS triples_osp ON triples (g, o, s, p);
+CREATE TABLE IF NOT EXISTS namespaces (prefix TEXT PRIMARY KEY, namespace TEXT NOT NULL UNIQUE);
+"""
+# Number of buffered additions written in one statement and number of rows fetched per page.
+BATCH_SIZE = 10000
+# Number of decoded terms kept in memory.
+TERM_CACHE_SIZE = 100000
+
+
+def locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def term_key(term):
+    if isinstance(term, Literal):
+        return "L", str(term), str(term.datatype or ""), term.language or ""
+    elif isinstance(term, BNode):
+        return "B", str(term), "", ""
+    return "U", str(term), "", ""
+
+
+def key_term(kind, value, datatype, lang):
+    if kind == "L":
+        return Literal(value, lang=lang or None, datatype=URIRef(datatype) if datatype else None)
+    elif kind == "B":
+        return BNode(value)
+    return URIRef(value)
+
+
+class SQLiteStore(Store):
+    """Context aware store where every graph identifier is a label inside one SQLite file."""
+    context_aware = True
+    formula_aware = False
+    transaction_aware = True
+    graph_aware = True
+
+    def __init__(self, configuration=None, identifier=None):
+        self.connection = None
+        self.path = None
+        self.ids = dict()
+        self.terms = dict()
+        self.graph_ids = dict()
+        self.pending = list()
+        self.lock = threading.RLock()
+        super().__init__(configuration, identifier)
+
+    @locked
+    def open(self, configuration, create=True):
+        self.path = str(Path(configuration).absolute())
+        self.connection = sqlite3.connect(configuration, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        return VALID_STORE
+
+    @locked
+    def close(self, commit_pending_transaction=True):
+        if self.connection is None:
+            return
+        if commit_pending_transaction:
+            self.commit()
+        self.connection.close()
+        self.connection = None
+
+    @locked
+    def commit(self):
+        self.flush()
+        self.connection.commit()
+
+    @locked
+    def rollback(self):
+        self.pending = list()
+        self.connection.rollback()
+        # Ids handed out during the transaction are gone.
+        self.ids = dict()
+        self.terms = dict()
+        self.graph_ids = dict()
+
+    def _graph_id(self, context, create=False):
+        name = str(getattr(context, "identifier", context))
+        gid = self.graph_ids.get(name)
+        if gid is None:
+            row = self.connection.execute("SELECT id FROM graphs WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                if not create:
+                    return None
+                gid = self.connection.execute("INSERT INTO graphs (name) VALUES (?)", (name,)).lastrowid
+            else:
+                gid = row[0]
+            self.graph_ids[name] = gid
+        return gid
+
+    def _term_id(self, term, create=False):
+        tid = self.ids.get(term)
+        if tid is not None:
+            return tid
+        key = term_key(term)
+        row = self.connection.execute(
+            "SELECT id FROM terms WHERE kind = ? AND value = ? AND datatype = ? AND lang = ?", key).fetchone()
+        if row is not None:
+            tid = row[0]
+        elif create:
+            tid = self.connection.execute(
+                "INSERT INTO terms (kind, value, datatype, lang) VALUES (?, ?, ?, ?)", key).lastrowid
+        else:
+            return None
+        if len(self.ids) >= TERM_CACHE_SIZE:
+            self.ids = dict()
+        self.ids[term] = tid
+        return tid
+
+    def _decode(self, ids):
+        """Decodes all ids, fetching the ones not in the term cache with a single query."""
+        missing = set(i for i in ids if i not in self.terms)
+        if len(self.terms) + len(missing) > TERM_CACHE_SIZE:
+            self.terms = dict()
+            missing = set(ids)
+        missing = list(missing)
+        for k in range(0, len(missing), 500):
+            chunk = missing[k:k + 500]
+            rows = self.connection.execute(
+                f"SELECT id, kind, value, datatype, lang FROM terms WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+            for tid, *key in rows:
+                self.terms[tid] = key_term(*key)
+        return [self.terms[i] for i in ids]
+
+    def flush(self):
+        """Writes buffered additions to the database."""
+        if self.pending:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO triples (g, s, p, o) VALUES (?, ?, ?, ?)", self.pending)
+            self.pending = list()
+
+    @locked
+    def add(self, triple, context, quoted=False):
+        if quoted:
+            raise ValueError("The SQLite store does not support quoted statements")
+        Store.add(self, triple, context, quoted)
+        gid = self._graph_id(context, create=True)
+        self.pending.append((gid, *(self._term_id(term, create=True) for term in triple)))
+        if len(self.pending) >= BATCH_SIZE:
+            self.flush()
+
+    def _where(self, triple_pattern, context):
+        """Builds the WHERE clause for a pattern. Returns None if a bound term or the graph is unknown."""
+        clauses, args = [], []
+        if context is not None:
+            gid = self._graph_id(context)
+            if gid is None:
+                return None
+            clauses.append("g = ?")
+            args.append(gid)
+        for column, term in zip("spo", triple_pattern):
+            if term is not None:
+                tid = self._term_id(term)
+                if tid is None:
+                    return None
+                clauses.append(f"{column} = ?")
+                args.append(tid)
+        return " AND ".join(clauses) or "1", args
+
+    @locked
+    def remove(self, triple_pattern, context=None):
+        self.flush()
+        Store.remove(self, triple_pattern, context)
+        where = self._where(triple_pattern, context)
+        if where is not None:
+            self.connection.execute(f"DELETE FROM triples WHERE {where[0]}", where[1])
+
+    def triples(self, triple_pattern, context=None):
+        # The lock is not held while the triples are yielded, so a lookup which is not consumed does not block others.
+        with self.lock:
+            self.flush()
+            where = self._where(triple_pattern, context)
+            if where is None:
+                return
+            # Within one graph the primary key already guarantees distinct triples.
+            distinct = "DISTINCT" if context is None else ""
+            cursor = self.connection.execute(f"SELECT {distinct} s, p, o FROM triples WHERE {where[0]}", where[1])
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(BATCH_SIZE)
+                if not rows:
+                    break
+                terms = self._decode([i for row in rows for i in row])
+            for k in range(0, len(terms), 3):
+                yield (terms[k], terms[k + 1], terms[k + 2]), iter([context])
+
+    @locked
+    def __len__(self, context=None):
+        self.flush()
+        if context is None:
+            return self.connection.execute("SELECT COUNT(*) FROM (SELECT DISTINCT s, p, o FROM triples)").fetchone()[0]
+        gid = self._graph_id(context)
+        if gid is None:
+            return 0
+        return self.connection.execute("SELECT COUNT(*) FROM triples WHERE g = ?", (gid,)).fetchone()[0]
+
+    def contexts(self, triple=None):
+        with self.lock:
+            self.flush()
+            names = self.connection.execute("SELECT name FROM graphs").fetchall()
+        for (name,) in names:
+            yield rdflib.Graph(store=self, identifier=name)
+
+    @locked
+    def add_graph(self, graph):
+        self._graph_id(graph, create=True)
+
+    @locked
+    def remove_graph(self, graph):
+        self.flush()
+        gid = self._graph_id(graph)
+        if gid is not None:
+            self.connection.execute("DELETE FROM triples WHERE g = ?", (gid,))
+            self.connection.execute("DELETE FROM graphs WHERE id = ?", (gid,))
+            del self.graph_ids[str(graph.identifier)]
+
+    @locked
+    def bind(self, prefix, namespace, override=True):
+        if override:
+            self.connection.execute("DELETE FROM namespaces WHERE prefix = ? OR namespace = ?",
+                                    (prefix, str(namespace)))
+        self.connection.execute("INSERT OR IGNORE INTO namespaces (prefix, namespace) VALUES (?, ?)",
+                                (prefix, str(namespace)))
+
+    @locked
+    def namespace(self, prefix):
+        row = self.connection.execute("SELECT namespace FROM namespaces WHERE prefix = ?", (prefix,)).fetchone()
+        return None if row is None else URIRef(row[0])
+
+    @locked
+    def prefix(self, namespace):
+        row = self.connection.execute("SELECT prefix FROM namespaces WHERE namespace = ?",
+                                      (str(namespace),)).fetchone()
+        return None if row is None else row[0]
+
+    def namespaces(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT prefix, namespace FROM namespaces").fetchall()
+        for prefix, namespace in rows:
+            yield prefix, URIRef(namespace)
+
+
+plugin.register("SQLite", Store, __name__, "SQLiteStore")
+
+
+def open_graph(path, label):
+    """Opens (or creates) the graph labelled label in the database at path."""
+    store = SQLiteStore()
+    store.open(str(path))
+    store.add_graph(label)
+    return rdflib.Graph(store=store, identifier=label)
+
+
+def graph_labels(path):
+    """Lists the labels of all graphs in the database at path."""
+    connection = sqlite3.connect(str(path))
+    try:
+        return [name for (name,) in connection.execute("SELECT name FROM graphs ORDER BY name")]
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        connection.close()
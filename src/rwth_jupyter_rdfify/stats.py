@@ -0,0 +1,201 @@
+"""Timing and memory instrumentation of the phases of %rdf cells.
+
+The code of the modules wraps its phases (comment stripping, parsing, entailment, query evaluation, HTML tables,
+Graphviz layout, ...) in stats.phase(name). While instrumentation is off, phase() returns one shared object which
+does nothing, so a hook costs a single attribute check. While it is on, every %rdf call gets a CellStats record with
+the duration, counts (e.g. triples or rows) and, with tracemalloc, the change of traced memory of each phase. Phases
+running in background threads, like Graphviz layouts and background jobs, are added to the cell which started them.
+"""
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+# Bytes per triple of rdflib's default memory store, measured with tracemalloc on the lubm benchmark graph.
+MEMORY_STORE_TRIPLE_BYTES = 1200
+
+
+class PhaseStats:
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.memory = None
+        self.counts = dict()
+
+    def to_dict(self):
+        return {"name": self.name, "seconds": self.seconds, "memory": self.memory, "counts": self.counts}
+
+
+class CellStats:
+    """Phases of one %rdf call. seconds is None while the call runs."""
+
+    def __init__(self, number, line):
+        self.number = number
+        self.line = line
+        self.seconds = None
+        self.peak_memory = None
+        self.phases = []
+
+    def to_dict(self):
+        return {"number": self.number, "line": self.line, "seconds": self.seconds, "peak_memory": self.peak_memory,
+                "phases": [phase.to_dict() for phase in self.phases]}
+
+
+class NoPhase:
+    """Stands in for a phase while instrumentation is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def count(self, **counts):
+        pass
+
+
+NO_PHASE = NoPhase()
+
+
+class Phase:
+    def __init__(self, recorder, cell, name):
+        self.recorder = recorder
+        self.cell = cell
+        self.stats = PhaseStats(name)
+
+    def __enter__(self):
+        self.memory = tracemalloc.get_traced_memory()[0] if self.recorder.memory else None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.seconds = time.perf_counter() - self.start
+        if self.memory is not None and tracemalloc.is_tracing():
+            self.stats.memory = tracemalloc.get_traced_memory()[0] - self.memory
+        self.recorder.record(self.cell, self.stats)
+        return False
+
+    def count(self, **counts):
+        """Records counts of the phase. Values which are no int, e.g. graphs or row lists, are counted with len()."""
+        for name, value in counts.items():
+            self.stats.counts[name] = value if isinstance(value, int) else len(value)
+
+
+class Recorder:
+    """Keeps the statistics of the last max_cells %rdf calls and the totals per phase since the last reset."""
+
+    def __init__(self, max_cells=1000):
+        self.enabled = False
+        self.memory = False
+        self.started_tracing = False
+        self.cells = deque(maxlen=max_cells)
+        self.totals = dict()
+        self.current = None
+        # Cell of the background job running in a thread, see current_cell.
+        self.local = threading.local()
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def enable(self, memory=False):
+        self.enabled = True
+        self.memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    def disable(self):
+        self.enabled = False
+        self.memory = False
+        self.current = None
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def reset(self):
+        with self.lock:
+            self.cells.clear()
+            self.totals = dict()
+
+    def begin_cell(self, line):
+        """Starts the record of a %rdf call. Returns None while instrumentation is off."""
+        if not self.enabled:
+            return None
+        self.calls += 1
+        cell = CellStats(self.calls, line)
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            cell.peak_memory = tracemalloc.get_traced_memory()[0]
+        cell.start = time.perf_counter()
+        with self.lock:
+            self.cells.append(cell)
+        self.current = cell
+        return cell
+
+    def end_cell(self, cell):
+        if cell is None:
+            return
+        cell.seconds = time.perf_counter() - cell.start
+        if cell.peak_memory is not None and tracemalloc.is_tracing():
+            cell.peak_memory = tracemalloc.get_traced_memory()[1] - cell.peak_memory
+        if self.current is cell:
+            self.current = None
+
+    def current_cell(self):
+        """The %rdf call running in this thread: a background job or else the call of the notebook cell."""
+        return getattr(self.local, "cell", None) or self.current
+
+    def phase(self, name, cell=None):
+        """Context manager measuring a phase of cell, by default of the running %rdf call."""
+        if not self.enabled:
+            return NO_PHASE
+        return Phase(self, cell or self.current_cell(), name)
+
+    def add(self, name, seconds, cell=None, **counts):
+        """Records a phase which was timed elsewhere, e.g. by a worker thread."""
+        if not self.enabled:
+            return
+        stats = PhaseStats(name)
+        stats.seconds = seconds
+        stats.counts = counts
+        self.record(cell or self.current_cell(), stats)
+
+    def record(self, cell, stats):
+        with self.lock:
+            if cell is not None:
+                cell.phases.append(stats)
+            total = self.totals.setdefault(stats.name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                                        "memory": None, "counts": dict()})
+            total["calls"] += 1
+            total["seconds"] += stats.seconds
+            total["max_seconds"] = max(total["max_seconds"], stats.seconds)
+            if stats.memory is not None:
+                total["memory"] = (total["memory"] or 0) + stats.memory
+            for name, value in stats.counts.items():
+                total["counts"][name] = total["counts"].get(name, 0) + value
+
+    def to_dict(self):
+        with self.lock:
+            return {"enabled": self.enabled, "memory": self.memory,
+                    "cells": [cell.to_dict() for cell in self.cells],
+                    "totals": {name: dict(total, counts=dict(total["counts"])) for name, total in self.totals.items()}}
+
+
+stats = Recorder()
+
+
+def estimate_graph_memory(g):
+    """Estimated bytes of memory held by the triples of g. Graphs in a database only hold a term cache."""
+    from .compact_store import CompactStore
+    from .sqlite_store import SQLiteStore
+    store = g.store
+    if isinstance(store, SQLiteStore):
+        return 0
+    if isinstance(store, CompactStore):
+        # The integer arrays are exact, the terms are estimated from the first thousand.
+        arrays = sum(permutation.nbytes() for permutation in (store.spo, store.pos, store.osp))
+        sample = store.terms[:1000]
+        if not sample:
+            return arrays
+        term_bytes = sum(len(str(term)) + 150 for term in sample) / len(sample)
+        return int(arrays + term_bytes * len(store.terms) + MEMORY_STORE_TRIPLE_BYTES // 10 * len(store.added))
+    return len(g) * MEMORY_STORE_TRIPLE_BYTES
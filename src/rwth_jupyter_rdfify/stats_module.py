@@ -0,0 +1,105 @@
+import html
+import json
+from pathlib import Path
+
+from .memory_budget import Spilled
+from .rdf_module import RDFModule
+from .stats import estimate_graph_memory, stats
+from .table import html_table
+
+
+def format_seconds(seconds):
+    return f"{seconds * 1000:.1f}ms" if seconds < 1 else f"{seconds:.2f}s"
+
+
+def format_bytes(n):
+    if n is None:
+        return ""
+    for unit in ["B", "KB", "MB"]:
+        if abs(n) < 1024:
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n:.1f}GB"
+
+
+def format_counts(counts):
+    return ", ".join(f"{value} {name}" for name, value in counts.items())
+
+
+class StatsModule(RDFModule):
+    instrumented = False
+
+    def __init__(self, name, parser, logger, description, displayname):
+        super().__init__(name, parser, logger, description, displayname)
+        self.parser.add_argument(
+            "action", nargs="?", choices=["show", "on", "off", "reset", "export"], default="show",
+            help="on starts recording the time spent in each phase of later %%rdf calls, off stops it. show displays the recorded calls, the totals per phase and the size of all labelled graphs, export returns them as dict or writes them to --output as JSON")
+        self.parser.add_argument(
+            "--memory", help="With on, also record the memory allocated in each phase using tracemalloc, which slows down Python code", action="store_true")
+        self.parser.add_argument(
+            "--cells", type=int, default=10, help="Number of recent calls shown")
+        self.parser.add_argument(
+            "--output", "-o", help="JSON file written by export")
+
+    def handle(self, params, store):
+        if params.action == "on":
+            stats.enable(params.memory)
+            self.log("Recording the phases of %rdf calls" + (" with memory tracing." if params.memory else "."))
+        elif params.action == "off":
+            stats.disable()
+            self.log("Stopped recording.")
+        elif params.action == "reset":
+            stats.reset()
+            self.log("Cleared all recorded calls.")
+        elif params.action == "export":
+            data = dict(stats.to_dict(), graphs=self.graph_sizes(store))
+            if params.output is None:
+                return data
+            Path(params.output).write_text(json.dumps(data, indent=2), encoding="utf-8")
+            self.log(f"Wrote statistics of {len(data['cells'])} calls to '{params.output}'.")
+        else:
+            self.show(params.cells, store)
+
+    def graph_sizes(self, store):
+        sizes = dict()
+        for label in store["rdfgraphs"]:
+            g = store["rdfgraphs"].peek(label)
+            if g is None or label == "last":
+                continue
+            if isinstance(g, Spilled):
+                sizes[label] = {"triples": None, "store": "spilled", "memory": g.size}
+                continue
+            sizes[label] = {"triples": len(g), "store": type(g.store).__name__, "memory": estimate_graph_memory(g)}
+        return sizes
+
+    def show(self, cells, store):
+        data = stats.to_dict()
+        state = "on" + (" with memory tracing" if data["memory"] else "") if data["enabled"] else "off"
+        parts = [f"<p>Recording is {state}. Use <code>%rdf stats on</code> and <code>%rdf stats off</code> to change it.</p>"]
+        recent = data["cells"][-cells:] if cells > 0 else []
+        if recent:
+            rows = [["#", "call", "total", "peak memory", "phases"]]
+            for cell in recent:
+                phases = "<br>".join(
+                    f"{html.escape(phase['name'])} {format_seconds(phase['seconds'])}"
+                    + (f" ({format_bytes(phase['memory'])})" if phase["memory"] is not None else "")
+                    + (f": {format_counts(phase['counts'])}" if phase["counts"] else "")
+                    for phase in cell["phases"])
+                total = format_seconds(cell["seconds"]) if cell["seconds"] is not None else "running"
+                rows.append([cell["number"], f"<code>%rdf {html.escape(cell['line'])}</code>", total,
+                             format_bytes(cell["peak_memory"]), phases])
+            parts.append(f"<h4>Last {len(recent)} calls</h4>" + html_table(iter(rows)))
+        if data["totals"]:
+            rows = [["phase", "calls", "total", "mean", "max", "memory", "counts"]]
+            for name, total in sorted(data["totals"].items(), key=lambda item: -item[1]["seconds"]):
+                rows.append([html.escape(name), total["calls"], format_seconds(total["seconds"]),
+                             format_seconds(total["seconds"] / total["calls"]), format_seconds(total["max_seconds"]),
+                             format_bytes(total["memory"]), format_counts(total["counts"])])
+            parts.append("<h4>Totals per phase</h4>" + html_table(iter(rows)))
+        sizes = self.graph_sizes(store)
+        if sizes:
+            rows = [["label", "triples", "store", "estimated memory"]]
+            for label, size in sizes.items():
+                rows.append([html.escape(label), "" if size["triples"] is None else size["triples"], size["store"], format_bytes(size["memory"])])
+            parts.append("<h4>Labelled graphs</h4>" + html_table(iter(rows)))
+        self.logger.display_html("".join(parts))
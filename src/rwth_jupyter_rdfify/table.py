@@ -1,77 +1,29 @@
 from IPython.display import HTML
-import xml.etree.ElementTree as ET
+import io
+from itertools import chain, islice
+from .cache import LRUCache
 from .graph import parse_graph
-import json
+from .results import result_cell_rows, result_mime_types, result_rows
+from .stats import stats
 
 
-def display_table(body, mime, logger):
-    if mime == "application/sparql-results+xml":
-        root = ET.fromstring(body)
-        logger.display_html(html_table(xml_row_iterator(root)))
-    elif mime == "application/sparql-results+json":
-        result = json.loads(body)
-        logger.display_html(html_table(json_row_iterator(result)))
+def display_table(body, mime, logger, limit=100, offset=0):
+    if mime in result_mime_types:
+        display_pager(logger, lambda: result_body_rows(body, mime), limit, offset)
     elif mime == "application/rdf+xml":
         g = parse_graph(body, logger)
-        logger.display_html(html_table(graph_spo_iterator(g)))
+        display_graph_table(g, logger, limit, offset)
     else:
         logger.print("Could not display table")
 
 
-#
-
-def xml_row_iterator(elem):
-    """Iterates a Sparql xml result (http://www.w3.org/2005/sparql-results#) by rows. First result are the column headers."""
-    ns = {"sparql": "http://www.w3.org/2005/sparql-results#"}
-    headers = []
-    for head in elem.findall("sparql:head/sparql:variable", ns):
-        headers.append(head.attrib["name"])
-    yield headers
-    for result in elem.findall("sparql:results/sparql:result", ns):
-        row = []
-        for binding in result.findall("sparql:binding", ns):
-            n = binding[0]
-            if n.tag == "{http://www.w3.org/2005/sparql-results#}literal":
-                lang = n.get("{http://www.w3.org/XML/1998/namespace}lang")
-                datatype = n.get(
-                    "datatype")
-                literal = n.text
-                if lang is not None:
-                    literal += "@{}".format(lang)
-                if datatype is not None:
-                    literal += "^^{}".format(datatype)
-                row.append(literal)
-            elif n.tag == "{http://www.w3.org/2005/sparql-results#}uri":
-                row.append("&lt;{}&gt;".format(n.text))
-            elif n.tag == "{http://www.w3.org/2005/sparql-results#}bnode":
-                row.append("&lt;_:{}&gt;".format(n.text))
-            else:
-                row.append("Unknown node: {}".format(ET.tostring(n)))
-        yield row
-
-
-def json_row_iterator(obj):
-    headers = obj["head"]["vars"]
-    yield headers
-    for binding in obj["results"]["bindings"]:
-        row = []
-        for header in headers:
-            if header in binding:
-                val = binding[header]
-                if val["type"] == "uri":
-                    row.append(f'&lt;{val["value"]}&gt;')
-                elif val["type"] == "literal":
-                    suff = ""
-                    if "xml:lang" in val:
-                        suff += f'@{val["xml:lang"]}'
-                    if "datatype" in val:
-                        suff += f'^^{val["datatype"]}'
-                    row.append(val["value"] + suff)
-                elif val["type"] == "bnode":
-                    row.append(f'&lt;_:{val["value"]}&gt;')
-            else:
-                row.append("")
-        yield row
+def result_body_rows(body, mime):
+    rows = result_rows(io.BytesIO(body), mime)
+    return result_cell_rows(next(rows), rows)
+
+
+def display_graph_table(g, logger, limit=100, offset=0):
+    return display_pager(logger, lambda: graph_spo_iterator(g), limit, offset, len(g))
 
 
 def graph_spo_iterator(graph):
@@ -81,21 +33,150 @@ def graph_spo_iterator(graph):
 
 
 def html_table(row_iter):
-    res = "<table>"
-    res += html_table_row(next(row_iter), True)
-    for row in row_iter:
-        res += html_table_row(row)
-    return res + "</table>"
+    parts = ["<table>", html_table_row(next(row_iter), True)]
+    parts.extend(html_table_row(row) for row in row_iter)
+    parts.append("</table>")
+    return "".join(parts)
 
 
 def html_table_row(row, header=False):
-    res = "<tr>"
-    for cell in row:
-        res += html_table_cell(cell, header)
-    return res + "</tr>"
+    return "<tr>" + "".join(html_table_cell(cell, header) for cell in row) + "</tr>"
 
 
 def html_table_cell(cell, header=False):
     if header:
         return "<th>{}</th>".format(cell)
     return "<td>{}</td>".format(cell)
+
+
+class TablePager:
+    """Renders a table one page at a time. The row iterator (header first) stays suspended between pages, so showing
+    a page only reads the rows up to its end. factory restarts the iterator for pages before the current position;
+    without it, only recently rendered pages can be shown again."""
+
+    def __init__(self, rows, limit=100, offset=0, factory=None, total=None):
+        self.factory = factory
+        self.limit = max(limit, 1)
+        self.offset = max(offset, 0)
+        self.total = total
+        self.pages = LRUCache(8)
+        self.current = 0
+        self.id = None
+        self._start(rows)
+
+    def _start(self, rows):
+        self.rows = rows
+        self.header = next(rows)
+        self.position = 0
+        self.exhausted = False
+
+    def _restart(self):
+        self.close()
+        self._start(self.factory())
+
+    def page_count(self):
+        total = self.total
+        if total is None and self.exhausted:
+            total = self.position
+        if total is None:
+            return None
+        return max(0, -(-(total - self.offset) // self.limit))
+
+    def has_next(self):
+        count = self.page_count()
+        return count is None or self.current + 1 < count
+
+    def render(self, page):
+        """Returns the HTML of page (counted from 0) and makes it the current page."""
+        page = max(page, 0)
+        html = self.pages.get(page)
+        if html is None:
+            start = self.offset + page * self.limit
+            if start < self.position:
+                if self.factory is None:
+                    raise ValueError("This table can not go back that far, its rows have been read already")
+                self._restart()
+            # Skip to the start of the page, then take its rows.
+            with stats.phase("read rows") as phase:
+                skipped = sum(1 for _ in islice(self.rows, start - self.position))
+                rows = list(islice(self.rows, self.limit))
+                phase.count(rows=skipped + len(rows))
+            self.position += skipped + len(rows)
+            if len(rows) < self.limit:
+                self.exhausted = True
+            if not rows and page > 0:
+                return self.render(page - 1)
+            with stats.phase("html table") as phase:
+                html = html_table(chain([self.header], rows)) + self._caption(start, len(rows))
+                phase.count(rows=rows, characters=html)
+            self.pages.put(page, html)
+        self.current = page
+        return html
+
+    def _caption(self, start, n):
+        if n == 0:
+            return "<p>No rows.</p>"
+        total = self.total if self.total is not None else (self.position if self.exhausted else None)
+        if start == 0 and n == total:
+            return ""
+        of = f" of {total}" if total is not None else ""
+        return f"<p>Table {self.id}: rows {start + 1} to {start + n}{of}</p>"
+
+    def close(self):
+        close = getattr(self.rows, "close", None)
+        if close is not None:
+            close()
+
+
+# Tables which can still be paged, by id. The least recently used ones are closed.
+pagers = LRUCache(32)
+next_pager_id = 1
+last_pager_id = None
+
+
+def register_pager(pager):
+    global next_pager_id, last_pager_id
+    pager.id = next_pager_id
+    next_pager_id += 1
+    last_pager_id = pager.id
+    for _, evicted in pagers.put(pager.id, pager):
+        evicted.close()
+    return pager
+
+
+def get_pager(pager_id=None):
+    return pagers.get(last_pager_id if pager_id is None else pager_id)
+
+
+def display_pager(logger, factory, limit=100, offset=0, total=None, rows=None):
+    """Displays the first page of a table. factory returns a new row iterator, rows may pass an iterator which can not
+    be restarted instead. With ipywidgets installed, buttons fetch further pages from the kernel, otherwise they are
+    shown with '%rdf table --page next'."""
+    pager = register_pager(TablePager(rows if rows is not None else factory(), limit, offset,
+                                      factory if rows is None else None, total))
+    html = pager.render(0)
+    if not pager.has_next() and pager.current == 0:
+        logger.display_html(html)
+        return pager
+    try:
+        import ipywidgets
+    except ImportError:
+        logger.display_html(html + f"<p>Show further pages with <code>%rdf table --pager {pager.id} --page next</code></p>")
+        return pager
+
+    output = ipywidgets.HTML(html)
+    previous_button = ipywidgets.Button(description="Previous", disabled=True)
+    next_button = ipywidgets.Button(description="Next")
+
+    def show(page):
+        try:
+            output.value = pager.render(page)
+        except ValueError as e:
+            output.value = f"<p>{e}</p>"
+        previous_button.disabled = pager.current == 0 or (pager.factory is None and pager.current - 1 not in pager.pages)
+        next_button.disabled = not pager.has_next()
+
+    previous_button.on_click(lambda _: show(pager.current - 1))
+    next_button.on_click(lambda _: show(pager.current + 1))
+    logger.out(ipywidgets.VBox([output, ipywidgets.HBox([previous_button, next_button])]))
+    return pager
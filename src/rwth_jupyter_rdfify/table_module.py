@@ -0,0 +1,66 @@
+from rdflib import Graph
+from rdflib.query import Result
+
+from .rdf_module import RDFModule
+from .results import ResultRows, SpooledRows, result_cell_rows
+from .sparql import select_result_row_iter
+from .table import display_graph_table, display_pager, get_pager
+
+
+class TableModule(RDFModule):
+    def __init__(self, name, parser, logger, description, displayname):
+        super().__init__(name, parser, logger, description, displayname)
+        self.parser.add_argument(
+            "--label", "-l", help="Display the labelled graph or stored query result as a new table")
+        self.parser.add_argument(
+            "--pager", type=int, help="Number of the table to page through. Defaults to the most recent table")
+        self.parser.add_argument(
+            "--page", default="next", help="Page to show: next, previous, first or a page number")
+        self.parser.add_argument(
+            "--limit", type=int, default=100, help="Number of rows per page of a new table")
+        self.parser.add_argument(
+            "--offset", type=int, default=0, help="Number of rows skipped before the first page of a new table")
+
+    def handle(self, params, store):
+        if params.label is not None:
+            self.display_label(params.label, params.limit, params.offset, store)
+            return
+        pager = get_pager(params.pager)
+        if pager is None:
+            self.log("There is no table to page through. Display a graph or result as table first.")
+            return
+        if params.page == "next":
+            page = pager.current + 1
+        elif params.page == "previous":
+            page = pager.current - 1
+        elif params.page == "first":
+            page = 0
+        elif params.page.isdigit():
+            page = int(params.page) - 1
+        else:
+            self.log(f"Unknown page '{params.page}'. Use next, previous, first or a page number.")
+            return
+        try:
+            self.logger.display_html(pager.render(page))
+        except ValueError as e:
+            self.log(str(e))
+
+    def display_label(self, label, limit, offset, store):
+        if label in store["rdfgraphs"] and isinstance(store["rdfgraphs"][label], Graph):
+            display_graph_table(store["rdfgraphs"][label], self.logger, limit, offset)
+            return
+        res = store["rdfresults"].get(label)
+        if isinstance(res, Result) and res.type == "SELECT":
+            display_pager(self.logger, lambda: select_result_row_iter(res), limit, offset)
+        elif isinstance(res, Result) and res.graph is not None:
+            display_graph_table(res.graph, self.logger, limit, offset)
+        elif isinstance(res, SpooledRows):
+            display_pager(self.logger, lambda: result_cell_rows(res.header, res), limit, offset)
+        elif isinstance(res, ResultRows) and not res.exhausted:
+            display_pager(self.logger, None, limit, offset, rows=result_cell_rows(res.header, res))
+        elif isinstance(res, ResultRows):
+            self.log(f"The rows of result '{label}' have been read already. Store remote results with --store to display them again.")
+        elif res is not None:
+            self.log(f"Result '{label}' can not be displayed as table.")
+        else:
+            self.log(f"No graph or result labelled '{label}' found.")